@@ -0,0 +1,239 @@
+"""Rule-based alerting evaluated as packets arrive.
+
+Rules are plain dicts:
+
+    {'name': 'Low battery', 'metric': 'battery_level', 'below': 20}
+    {'name': 'Weak link', 'metric': 'link_snr', 'below': -15}
+    {'name': 'Router offline', 'offline_after': 2 * 60 * 60, 'nodes': ['!a1b2c3d4']}
+
+Optional keys: 'above' (instead of / as well as 'below'), 'nodes' (limit the
+rule to these node ids) and 'sinks' (names of the sinks to notify, default
+all). Threshold rules fire when a value crosses into the bad range and
+resolve when it crosses back, so a node sitting at 10% battery alerts once.
+
+Offline rules keep one timer per node in a hashed timer wheel. Every packet
+from a node pushes its timer out; tick() only looks at the wheel slots that
+came due since the last tick, so nothing polls nodes.last_heard and the cost
+does not grow with the number of silent nodes.
+"""
+import json
+import logging
+import math
+import queue
+import threading
+import time as time_module
+import urllib.request
+
+from topology import node_num, node_id
+
+logger = logging.getLogger(__name__)
+
+# Timer wheel granularity (seconds) and size; one turn covers TICK * SLOTS seconds
+DEFAULT_TICK = 10
+DEFAULT_SLOTS = 1024
+
+
+class TimerWheel:
+    """Hashed timer wheel: schedule/cancel are O(1), advance() visits only the slots that came due."""
+
+    def __init__(self, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, now=None):
+        self.tick = tick
+        self.slots = [dict() for _ in range(slots)]
+        self.where = {}  # key -> slot index
+        self.current = int((now if now is not None else time_module.time()) // tick)
+
+    def __len__(self):
+        return len(self.where)
+
+    def schedule(self, key, deadline):
+        """(Re)schedule key to expire at deadline; deadlines already past expire on the next advance()."""
+        self.cancel(key)
+        # The slot of the first tick at or after the deadline, so it is due by the time that slot is visited
+        index = max(math.ceil(deadline / self.tick), self.current + 1) % len(self.slots)
+        self.slots[index][key] = deadline
+        self.where[key] = index
+
+    def cancel(self, key):
+        index = self.where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self, now=None):
+        """Remove and return the keys whose deadline is <= now."""
+        now = now if now is not None else time_module.time()
+        target = int(now // self.tick)
+        expired = []
+        # After a long pause every slot is due once
+        for tick in range(self.current + 1, min(target, self.current + len(self.slots)) + 1):
+            slot = self.slots[tick % len(self.slots)]
+            # Entries for later turns of the wheel share the slot and stay put
+            due = [key for key, deadline in slot.items() if deadline <= now]
+            for key in due:
+                del slot[key]
+                del self.where[key]
+            expired.extend(due)
+        self.current = max(self.current, target)
+        return expired
+
+
+class LogSink:
+    """Write alerts to the log."""
+
+    def send(self, alert):
+        if alert['resolved']:
+            logger.info(f"✅ {alert['text']}")
+        else:
+            logger.warning(f"🚨 {alert['text']}")
+
+
+class WebhookSink:
+    """POST alerts as JSON to a URL from a background thread, so ingest never waits on the network."""
+
+    def __init__(self, url, timeout=10):
+        self.url = url
+        self.timeout = timeout
+        self.queue = queue.Queue(maxsize=1000)
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def send(self, alert):
+        try:
+            self.queue.put_nowait(alert)
+        except queue.Full:
+            logger.error(f"Webhook queue full, alert dropped: {alert['text']}")
+
+    def _worker(self):
+        while True:
+            alert = self.queue.get()
+            request = urllib.request.Request(self.url, data=json.dumps(alert).encode('utf-8'),
+                                             headers={'Content-Type': 'application/json'})
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+            except Exception as e:
+                logger.error(f"Error posting alert to {self.url}: {e}")
+
+
+class MeshSink:
+    """Send alerts as a direct message over the mesh through the outbound queue (see outbound.py)."""
+
+    def __init__(self, outbound, destination, channel_index=0):
+        self.outbound = outbound
+        self.destination = destination
+        self.channel_index = channel_index
+
+    def send(self, alert):
+        prefix = "[Resolved] " if alert['resolved'] else "[Alert] "
+        self.outbound.put(prefix + alert['text'], self.destination, self.channel_index)
+
+
+def _node(node):
+    """Normalize a node number or id to '!a1b2c3d4'."""
+    try:
+        return node_id(node_num(node))
+    except (TypeError, ValueError):
+        return node
+
+
+class AlertEngine:
+    """Evaluates threshold and offline rules incrementally and hands alerts to the sinks."""
+
+    def __init__(self, rules, sinks, tick=DEFAULT_TICK, slots=DEFAULT_SLOTS, now=None):
+        self.sinks = sinks  # name -> sink
+        self.wheel = TimerWheel(tick, slots, now)
+        self.active = {}    # (rule name, node, subject) -> alert dict
+        self.lock = threading.Lock()
+        self.by_metric = {}
+        self.offline_rules = []
+        for rule in rules:
+            rule = dict(rule)
+            if rule.get('nodes') is not None:
+                rule['nodes'] = {_node(n) for n in rule['nodes']}
+            if 'offline_after' in rule:
+                self.offline_rules.append(rule)
+            else:
+                self.by_metric.setdefault(rule['metric'], []).append(rule)
+
+    def _applies(self, rule, node):
+        return rule.get('nodes') is None or node in rule['nodes']
+
+    def _emit(self, rule, node, subject, text, value, timestamp, resolved):
+        key = (rule['name'], node, subject)
+        if resolved:
+            alert = self.active.pop(key, None)
+            if alert is None:
+                return
+        elif key in self.active:
+            return
+        alert = {'rule': rule['name'], 'node_id': node, 'subject': subject, 'value': value,
+                 'timestamp': timestamp, 'resolved': resolved, 'text': text}
+        if not resolved:
+            self.active[key] = alert
+        for name in rule.get('sinks') or self.sinks:
+            sink = self.sinks.get(name)
+            if sink is None:
+                continue
+            try:
+                sink.send(alert)
+            except Exception as e:
+                logger.error(f"Error sending alert to {name} sink: {e}")
+
+    def _check(self, rule, node, subject, value, timestamp):
+        below = rule.get('below')
+        above = rule.get('above')
+        bad = (below is not None and value < below) or (above is not None and value > above)
+        label = f"{node} → {subject}" if subject else node
+        limit = f"below {below}" if below is not None and value < below else f"above {above}"
+        if bad:
+            text = f"{rule['name']}: {label} {rule['metric']}={value} ({limit})"
+        else:
+            text = f"{rule['name']}: {label} {rule['metric']}={value} back to normal"
+        self._emit(rule, node, subject, text, value, timestamp, resolved=not bad)
+
+    def heard(self, node, timestamp=None):
+        """A packet from node arrived: restart its offline timers and resolve offline alerts."""
+        if not self.offline_rules or node is None:
+            return
+        node = _node(node)
+        timestamp = timestamp if timestamp is not None else time_module.time()
+        with self.lock:
+            for rule in self.offline_rules:
+                if not self._applies(rule, node):
+                    continue
+                deadline = timestamp + rule['offline_after']
+                # Nodes that were already silent too long (e.g. old NodeDB entries at startup) are not alerted
+                if deadline > self.wheel.current * self.wheel.tick:
+                    self.wheel.schedule((rule['name'], node), deadline)
+                    self._emit(rule, node, None, f"{rule['name']}: {node} is heard again", None, timestamp, resolved=True)
+
+    def observe(self, node, values, timestamp=None):
+        """Evaluate threshold rules against a dict of metric values reported by node."""
+        node = _node(node)
+        timestamp = timestamp if timestamp is not None else time_module.time()
+        with self.lock:
+            for metric, value in values.items():
+                if value is None:
+                    continue
+                for rule in self.by_metric.get(metric, ()):
+                    if self._applies(rule, node):
+                        self._check(rule, node, None, value, timestamp)
+
+    def observe_link(self, node, neighbor, snr, timestamp=None):
+        """Evaluate 'link_snr' rules for the link node → neighbor."""
+        if snr is None or 'link_snr' not in self.by_metric:
+            return
+        node = _node(node)
+        neighbor = _node(neighbor)
+        timestamp = timestamp if timestamp is not None else time_module.time()
+        with self.lock:
+            for rule in self.by_metric['link_snr']:
+                if self._applies(rule, node) or self._applies(rule, neighbor):
+                    self._check(rule, node, neighbor, snr, timestamp)
+
+    def tick(self, now=None):
+        """Fire offline alerts for timers that expired since the last tick."""
+        now = now if now is not None else time_module.time()
+        with self.lock:
+            rules = {rule['name']: rule for rule in self.offline_rules}
+            for rule_name, node in self.wheel.advance(now):
+                rule = rules[rule_name]
+                hours = rule['offline_after'] / 3600
+                self._emit(rule, node, None, f"{rule_name}: {node} not heard for {hours:g} h", None, now, resolved=False)
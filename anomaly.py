@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+"""Streaming anomaly detection on telemetry and environment samples.
+
+AnomalyDetector keeps, per node and metric, a Welford running mean/variance
+(the long-term picture) and an EWMA mean/variance (the recent baseline) in
+numpy arrays. Each sample is scored against the EWMA baseline before it is
+folded in, so detection is O(1) per sample and never reads the database.
+meshdb.py feeds every incoming sample through it, before dead-band filtering,
+and writes the returned events to the events table.
+
+    python3 anomaly.py --since 2024-08-01 --kind reboot
+"""
+import argparse
+import datetime
+import math
+
+import numpy as np
+
+from pragmas import connect
+
+# metric -> (direction, z-score threshold, minimum absolute deviation)
+# direction: 'low' flags drops only, 'high' spikes only, 'both' jumps either way
+TELEMETRY_RULES = {
+    'voltage': ('low', 4.0, 0.15),
+    'channel_utilization': ('high', 4.0, 10.0),
+    'air_util_tx': ('high', 4.0, 5.0),
+}
+ENVIRONMENT_RULES = {
+    'temperature': ('both', 4.0, 3.0),
+    'humidity': ('both', 4.0, 15.0),
+    'bar': ('both', 4.0, 5.0),
+}
+# Event kind per (metric, direction of the deviation)
+EVENT_KINDS = {
+    ('voltage', 'low'): 'voltage_sag',
+    ('channel_utilization', 'high'): 'channel_utilization_spike',
+    ('air_util_tx', 'high'): 'air_util_tx_spike',
+}
+# Weight of the newest sample in the EWMA baseline
+EWMA_ALPHA = 0.1
+# Samples needed before a metric's baseline is trusted
+WARMUP = 10
+# Uptime may lag the wall clock by this much before a drop counts as a reboot (seconds)
+REBOOT_SLACK = 60
+
+
+class AnomalyDetector:
+    """Online per-node, per-metric statistics over a fixed set of metrics."""
+
+    def __init__(self, rules, alpha=EWMA_ALPHA, warmup=WARMUP, counter='uptime_seconds', capacity=256):
+        self.rules = rules
+        self.metrics = list(rules)
+        self.alpha = alpha
+        self.warmup = warmup
+        self.counter = counter
+        self.slots = {}   # node_id -> row
+        shape = (capacity, len(self.metrics))
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.mean = np.zeros(shape)      # Welford
+        self.m2 = np.zeros(shape)
+        self.ewma = np.zeros(shape)
+        self.ewvar = np.zeros(shape)
+        self.uptime = np.full((capacity, 2), np.nan)  # timestamp, uptime of the last sample
+
+    def _slot(self, node_id):
+        slot = self.slots.get(node_id)
+        if slot is None:
+            slot = len(self.slots)
+            if slot == len(self.count):
+                for name in ('count', 'mean', 'm2', 'ewma', 'ewvar', 'uptime'):
+                    array = getattr(self, name)
+                    grown = np.full((2 * slot,) + array.shape[1:], np.nan if name == 'uptime' else 0, dtype=array.dtype)
+                    grown[:slot] = array
+                    setattr(self, name, grown)
+            self.slots[node_id] = slot
+        return slot
+
+    def observe(self, node_id, timestamp, values):
+        """Score one sample, fold it into the statistics and return the list of events it raised.
+
+        Events are dicts with node_id, kind, metric, value, expected, score and timestamp.
+        """
+        slot = self._slot(node_id)
+        events = []
+        for column, metric in enumerate(self.metrics):
+            value = values.get(metric)
+            if value is None:
+                continue
+            value = float(value)
+            direction, threshold, min_deviation = self.rules[metric]
+            n = self.count[slot, column]
+            if n >= self.warmup:
+                expected = self.ewma[slot, column]
+                deviation = value - expected
+                std = math.sqrt(self.ewvar[slot, column])
+                score = deviation / std if std > 0 else math.copysign(math.inf, deviation) if deviation else 0.0
+                side = 'high' if deviation > 0 else 'low'
+                if abs(score) >= threshold and abs(deviation) >= min_deviation and direction in ('both', side):
+                    events.append({
+                        'node_id': node_id,
+                        'kind': EVENT_KINDS.get((metric, side), f'{metric}_jump'),
+                        'metric': metric,
+                        'value': value,
+                        'expected': round(float(expected), 3),
+                        'score': round(score, 2) if math.isfinite(score) else None,
+                        'timestamp': timestamp,
+                    })
+
+            # Welford
+            n += 1
+            self.count[slot, column] = n
+            delta = value - self.mean[slot, column]
+            self.mean[slot, column] += delta / n
+            self.m2[slot, column] += delta * (value - self.mean[slot, column])
+            # EWMA mean and variance
+            if n == 1:
+                self.ewma[slot, column] = value
+                self.ewvar[slot, column] = 0.0
+            else:
+                delta = value - self.ewma[slot, column]
+                increment = self.alpha * delta
+                self.ewma[slot, column] += increment
+                self.ewvar[slot, column] = (1 - self.alpha) * (self.ewvar[slot, column] + delta * increment)
+
+        uptime = values.get(self.counter) if self.counter else None
+        if uptime is not None:
+            last_timestamp, last_uptime = self.uptime[slot]
+            elapsed = timestamp - last_timestamp
+            # Uptime went backwards, or is shorter than the time since the previous sample
+            if not np.isnan(last_uptime) and elapsed >= 0 and \
+                    (uptime < last_uptime or uptime + REBOOT_SLACK < elapsed):
+                events.append({
+                    'node_id': node_id,
+                    'kind': 'reboot',
+                    'metric': self.counter,
+                    'value': float(uptime),
+                    'expected': float(last_uptime + elapsed),
+                    'score': None,
+                    'timestamp': timestamp,
+                })
+            self.uptime[slot] = (timestamp, uptime)
+        return events
+
+    def stats(self, node_id):
+        """{metric: (count, mean, std, ewma)} for one node, from the running statistics."""
+        slot = self.slots.get(node_id)
+        if slot is None:
+            return {}
+        result = {}
+        for column, metric in enumerate(self.metrics):
+            n = int(self.count[slot, column])
+            if n:
+                std = math.sqrt(self.m2[slot, column] / (n - 1)) if n > 1 else 0.0
+                result[metric] = (n, float(self.mean[slot, column]), std, float(self.ewma[slot, column]))
+        return result
+
+
+def get_events(node_id=None, kind=None, since=None, limit=100, database_path='messages.db'):
+    """Stored events, newest first."""
+    query = 'SELECT node_id, kind, metric, value, expected, score, timestamp FROM events WHERE 1 = 1'
+    params = []
+    if node_id is not None:
+        query += ' AND node_id = ?'
+        params.append(node_id)
+    if kind is not None:
+        query += ' AND kind = ?'
+        params.append(kind)
+    if since is not None:
+        query += ' AND timestamp >= ?'
+        params.append(since)
+    query += ' ORDER BY timestamp DESC LIMIT ?'
+    params.append(limit)
+    conn = connect(database_path)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List detected telemetry anomalies from messages.db.")
+    parser.add_argument('--node', help="Only this node id")
+    parser.add_argument('--kind', help="Only this event kind (e.g. reboot, voltage_sag)")
+    parser.add_argument('--since', help="Start date (YYYY-MM-DD)")
+    parser.add_argument('--limit', type=int, default=100)
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    args = parser.parse_args()
+    since = int(datetime.datetime.strptime(args.since, '%Y-%m-%d').timestamp()) if args.since else None
+    for node_id, kind, metric, value, expected, score, timestamp in get_events(args.node, args.kind, since, args.limit, args.db):
+        when = datetime.datetime.fromtimestamp(timestamp).strftime('%d.%m.%Y %H:%M:%S')
+        score = f" (z={score})" if score is not None else ""
+        print(f"{when} {node_id} {kind}: {metric} {value} expected {expected}{score}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""Move old telemetry, environment, positions and neighbors rows into Parquet files.
+
+Closed months (ending more than HOT_DAYS ago) are written to
+archive/<table>/month=YYYY-MM/part-<first id>-<last id>.parquet (zstd) and
+then deleted from messages.db, so the tables the ingest writes to stay
+small. query() reads the archive back with pyarrow datasets: only the
+requested columns are read, months outside the time range are skipped by
+their directory name, and the time/node filters are pushed down to the
+row-group statistics.
+
+    python3 archive.py run
+    python3 archive.py query telemetry --columns node_id timestamp voltage --nodes '!a1b2c3d4'
+    python3 archive.py trend channel_utilization --since 2024-01-01
+
+Needs pyarrow (pip install pyarrow).
+"""
+import argparse
+import datetime
+import logging
+import os
+import time as time_module
+
+import pandas as pd
+
+from dbstats import first_id_since
+from dictionary import storage_table
+from pragmas import connect
+from topology import node_num
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_DIR = 'archive'
+# Months are archived once they ended at least this many days ago
+HOT_DAYS = 30
+BATCH_SIZE = 50000
+ARCHIVED_TABLES = ['telemetry', 'environment', 'positions', 'neighbors']
+# Tables that store node numbers as decimal text instead of '!a1b2c3d4'
+DECIMAL_NODE_TABLES = {'neighbors'}
+ARROW_TYPES = {'INTEGER': 'int64', 'REAL': 'float64', 'TEXT': 'string'}
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("The archive needs pyarrow: pip install pyarrow")
+
+
+def _schema(c, table):
+    """Arrow schema from the declared SQLite column types, so every file of a table has the same schema."""
+    c.execute(f'PRAGMA table_info({table})')
+    return pa.schema([(name, ARROW_TYPES.get(declared.upper(), 'string')) for _, name, declared, _, _, _ in c.fetchall()])
+
+
+def _month_start(timestamp):
+    moment = datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc)
+    return datetime.datetime(moment.year, moment.month, 1, tzinfo=datetime.timezone.utc)
+
+
+def _next_month(moment):
+    return moment.replace(year=moment.year + moment.month // 12, month=moment.month % 12 + 1)
+
+
+def _months(since, until):
+    """'YYYY-MM' names of the UTC months overlapping [since, until)."""
+    months = []
+    moment = _month_start(since)
+    while moment.timestamp() < until:
+        months.append(moment.strftime('%Y-%m'))
+        moment = _next_month(moment)
+    return months
+
+
+def archive_table(table, now=None, hot_days=HOT_DAYS, delete=True, archive_dir=ARCHIVE_DIR, batch_size=BATCH_SIZE,
+                  database_path='messages.db'):
+    """Archive every closed month of table and return {month: rows archived}.
+
+    The file is complete on disk (written aside, then renamed) before the
+    rows are deleted in one transaction; if that is interrupted, the next
+    run writes the same id range to the same file name again.
+    """
+    _require_pyarrow()
+    now = now if now is not None else time_module.time()
+    cutoff = now - hot_days * 86400
+    conn = connect(database_path)
+    c = conn.cursor()
+    schema = _schema(c, table)
+    c.execute(f'SELECT MIN(timestamp) FROM (SELECT timestamp FROM {table} ORDER BY id LIMIT 1000)')
+    oldest = c.fetchone()[0]
+    archived = {}
+    if oldest is None:
+        conn.close()
+        return archived
+
+    start = _month_start(oldest)
+    while _next_month(start).timestamp() <= cutoff:
+        end = _next_month(start)
+        month = start.strftime('%Y-%m')
+        first = first_id_since(c, table, start.timestamp())
+        if first is not None:
+            following = first_id_since(c, table, end.timestamp())
+            where = 'id >= ? AND timestamp >= ? AND timestamp < ?'
+            params = [first, int(start.timestamp()), int(end.timestamp())]
+            if following is not None:
+                where += ' AND id < ?'
+                params.append(following)
+            count = _write_month(c, table, schema, where, params, os.path.join(archive_dir, table, f'month={month}'),
+                                 batch_size)
+            if count:
+                if delete:
+                    # Straight from the rows of a compacted table instead of row by row through its view
+                    c.execute(f'DELETE FROM {storage_table(c, table)} WHERE {where}', params)
+                    conn.commit()
+                archived[month] = count
+                logger.info(f"Archived {count} {table} rows from {month}")
+        start = end
+    conn.close()
+    return archived
+
+
+def _write_month(c, table, schema, where, params, directory, batch_size):
+    c.execute(f"SELECT {', '.join(schema.names)} FROM {table} WHERE {where} ORDER BY id", params)
+    os.makedirs(directory, exist_ok=True)
+    temporary = os.path.join(directory, 'part.tmp')
+    count = 0
+    first_id = last_id = None
+    with pq.ParquetWriter(temporary, schema, compression='zstd') as writer:
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            writer.write_table(pa.Table.from_arrays([pa.array(column, type=field.type)
+                                                     for column, field in zip(zip(*rows), schema)], schema=schema))
+            count += len(rows)
+            first_id = rows[0][0] if first_id is None else first_id
+            last_id = rows[-1][0]
+    if count:
+        os.replace(temporary, os.path.join(directory, f'part-{first_id}-{last_id}.parquet'))
+    else:
+        os.remove(temporary)
+    return count
+
+
+def archive_closed_partitions(tables=ARCHIVED_TABLES, now=None, hot_days=HOT_DAYS, delete=True, archive_dir=ARCHIVE_DIR,
+                              database_path='messages.db'):
+    """Run archive_table for each table; returns {table: {month: rows}}."""
+    return {table: archive_table(table, now, hot_days, delete, archive_dir, database_path=database_path)
+            for table in tables}
+
+
+def _dataset(table, archive_dir):
+    directory = os.path.join(archive_dir, table)
+    if not os.path.isdir(directory):
+        return None
+    partitioning = ds.partitioning(pa.schema([('month', pa.string())]), flavor='hive')
+    return ds.dataset(directory, format='parquet', partitioning=partitioning)
+
+
+def query(table, columns=None, since=None, until=None, nodes=None, include_hot=False, archive_dir=ARCHIVE_DIR,
+          database_path='messages.db'):
+    """DataFrame of archived rows of table (plus the rows still in messages.db with include_hot), by timestamp.
+
+    Only columns are read (all when None); since/until (unix time) prune
+    whole months and, with nodes, row groups.
+    """
+    _require_pyarrow()
+    if nodes and table in DECIMAL_NODE_TABLES:
+        nodes = [str(node_num(node)) for node in nodes]
+    frames = []
+    dataset = _dataset(table, archive_dir)
+    if dataset is not None:
+        condition = None
+        conditions = []
+        if since is not None or until is not None:
+            conditions.append(ds.field('month').isin(_months(since if since is not None else 0,
+                                                             until if until is not None else time_module.time() + 1)))
+        if since is not None:
+            conditions.append(ds.field('timestamp') >= since)
+        if until is not None:
+            conditions.append(ds.field('timestamp') < until)
+        if nodes:
+            conditions.append(ds.field('node_id').isin(list(nodes)))
+        for expression in conditions:
+            condition = expression if condition is None else condition & expression
+        names = columns or [name for name in dataset.schema.names if name != 'month']
+        frames.append(dataset.to_table(columns=names, filter=condition).to_pandas())
+
+    if include_hot:
+        conn = connect(database_path)
+        select = ', '.join(columns) if columns else '*'
+        sql = f'SELECT {select} FROM {table} WHERE 1 = 1'
+        params = []
+        if since is not None:
+            sql += ' AND timestamp >= ?'
+            params.append(since)
+        if until is not None:
+            sql += ' AND timestamp < ?'
+            params.append(until)
+        if nodes:
+            sql += f" AND node_id IN ({', '.join('?' * len(nodes))})"
+            params.extend(nodes)
+        frames.append(pd.read_sql_query(sql, conn, params=params))
+        conn.close()
+
+    frames = [frame for frame in frames if len(frame)]
+    if not frames:
+        return pd.DataFrame(columns=columns or [])
+    df = pd.concat(frames, ignore_index=True)
+    if 'timestamp' in df.columns:
+        df = df.sort_values('timestamp', kind='stable', ignore_index=True)
+    return df
+
+
+def trend(metric, table='telemetry', since=None, until=None, freq='D', include_hot=True, archive_dir=ARCHIVE_DIR,
+          database_path='messages.db'):
+    """Mesh-wide mean, max and sample count of metric per period (pandas offset alias, default daily)."""
+    df = query(table, ['timestamp', metric], since, until, include_hot=include_hot, archive_dir=archive_dir,
+               database_path=database_path)
+    if df.empty:
+        return pd.DataFrame(columns=['mean', 'max', 'count'])
+    series = df.set_index(pd.to_datetime(df['timestamp'], unit='s', utc=True))[metric]
+    return series.resample(freq).agg(['mean', 'max', 'count']).dropna(subset=['mean'])
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    return int(datetime.datetime.fromisoformat(value).replace(tzinfo=datetime.timezone.utc).timestamp())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Archive old rows of messages.db to Parquet and query them.")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    parser.add_argument('--archive-dir', default=ARCHIVE_DIR)
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="Archive closed months")
+    run.add_argument('--hot-days', type=int, default=HOT_DAYS, help="Keep months that ended less than this many days ago")
+    run.add_argument('--keep', action='store_true', help="Write the files but do not delete the rows")
+    run.add_argument('--tables', nargs='+', default=ARCHIVED_TABLES, choices=ARCHIVED_TABLES)
+    read = commands.add_parser('query', help="Print archived rows")
+    read.add_argument('table', choices=ARCHIVED_TABLES)
+    read.add_argument('--columns', nargs='+')
+    read.add_argument('--nodes', nargs='+')
+    read.add_argument('--hot', action='store_true', help="Include rows still in the database")
+    metric = commands.add_parser('trend', help="Mesh-wide mean/max of a metric per day")
+    metric.add_argument('metric', help="e.g. channel_utilization, air_util_tx, temperature")
+    metric.add_argument('--table', default='telemetry', choices=ARCHIVED_TABLES)
+    metric.add_argument('--freq', default='D', help="pandas period, e.g. D, W, MS")
+    for command in (read, metric):
+        command.add_argument('--since', help="Start date (YYYY-MM-DD, UTC)")
+        command.add_argument('--until', help="End date (YYYY-MM-DD, UTC)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    try:
+        if args.command == 'run':
+            archived = archive_closed_partitions(args.tables, hot_days=args.hot_days, delete=not args.keep,
+                                                 archive_dir=args.archive_dir, database_path=args.db)
+            for table, months in archived.items():
+                print(f"{table}: {sum(months.values())} rows from {len(months)} months")
+        elif args.command == 'query':
+            df = query(args.table, args.columns, _timestamp(args.since), _timestamp(args.until), args.nodes,
+                       args.hot, args.archive_dir, args.db)
+            print(df.to_string(index=False) if len(df) else "No rows.")
+        else:
+            df = trend(args.metric, args.table, _timestamp(args.since), _timestamp(args.until), args.freq,
+                       archive_dir=args.archive_dir, database_path=args.db)
+            print(df.to_string() if len(df) else "No data.")
+    except RuntimeError as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+"""Battery drain / charge rates and time-to-empty forecasts for every node.
+
+Each node keeps running least-squares sums (n, sum t, sum t^2, sum y,
+sum t*y) of battery_level and voltage over two sliding windows:
+
+- the short window gives the current rate (is it charging right now?);
+- the long window (a full day, so solar nodes' charge and night drain
+  cancel out) gives the net trend used for the time-to-empty forecast.
+
+Samples enter and leave the sums one at a time, so refresh() only reads
+telemetry rows stored since the last call, and fleet() solves the
+regressions of all nodes in one numpy pass.
+
+    python3 battery.py            # nodes closest to empty first
+"""
+import time as time_module
+from collections import deque
+
+import numpy as np
+
+from pragmas import connect
+
+SHORT_WINDOW = 3 * 60 * 60
+LONG_WINDOW = 24 * 60 * 60
+# A regression needs at least this many samples spanning at least this long (seconds)
+MIN_SAMPLES = 3
+MIN_SPAN = 60 * 60
+# Levels treated as empty
+EMPTY_LEVEL = 0.0
+EMPTY_VOLTAGE = 3.3
+# Devices report battery_level 101 while running from external power
+POWERED_LEVEL = 100
+# Rates (%/hour) smaller than this count as stable
+STABLE_RATE = 0.2
+
+# Columns of the per-window sums: n, t, t*t, battery, t*battery, voltage, t*voltage (voltage has its own n)
+N_B, T_B, TT_B, Y_B, TY_B, N_V, T_V, TT_V, Y_V, TY_V = range(10)
+
+
+class _Window:
+    """Sliding-window regression sums for every node, one row per node slot."""
+
+    def __init__(self, length, capacity):
+        self.length = length
+        self.sums = np.zeros((capacity, 10))
+        self.samples = []  # slot -> deque of (t_hours, battery, voltage)
+
+    def grow(self, capacity):
+        sums = np.zeros((capacity, 10))
+        sums[:len(self.sums)] = self.sums
+        self.sums = sums
+
+    def _apply(self, slot, t, battery, voltage, sign):
+        row = self.sums[slot]
+        if battery is not None:
+            row[N_B] += sign
+            row[T_B] += sign * t
+            row[TT_B] += sign * t * t
+            row[Y_B] += sign * battery
+            row[TY_B] += sign * t * battery
+        if voltage is not None:
+            row[N_V] += sign
+            row[T_V] += sign * t
+            row[TT_V] += sign * t * t
+            row[Y_V] += sign * voltage
+            row[TY_V] += sign * t * voltage
+
+    def add(self, slot, t, battery, voltage):
+        while len(self.samples) <= slot:
+            self.samples.append(deque())
+        samples = self.samples[slot]
+        samples.append((t, battery, voltage))
+        self._apply(slot, t, battery, voltage, 1.0)
+        cutoff = t - self.length / 3600.0
+        while samples and samples[0][0] < cutoff:
+            self._apply(slot, *samples.popleft(), -1.0)
+        if len(samples) == 1:
+            # Start from exact zeros again so rounding errors do not pile up
+            self.sums[slot] = 0.0
+            self._apply(slot, t, battery, voltage, 1.0)
+
+    def first(self, slots):
+        return np.array([self.samples[s][0][0] if s < len(self.samples) and self.samples[s] else np.nan for s in slots])
+
+
+def _slopes(sums, n_col, t_col, tt_col, y_col, ty_col):
+    """Least-squares slope per row (units per hour); NaN where there are too few samples."""
+    n = sums[:, n_col]
+    denominator = n * sums[:, tt_col] - sums[:, t_col] ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        slope = (n * sums[:, ty_col] - sums[:, t_col] * sums[:, y_col]) / denominator
+    slope[(n < MIN_SAMPLES) | ~(denominator > 1e-9)] = np.nan
+    return slope
+
+
+class BatteryForecaster:
+    """Per-node battery/voltage trends, updated one telemetry sample at a time."""
+
+    def __init__(self, short_window=SHORT_WINDOW, long_window=LONG_WINDOW, capacity=256):
+        self.slots = {}          # node_id -> row in the arrays
+        self.node_ids = []
+        self.epoch = None        # times are hours since the first sample, keeping the sums well conditioned
+        self.last = np.full((capacity, 3), np.nan)  # timestamp, battery_level, voltage of the latest sample
+        self.windows = (_Window(short_window, capacity), _Window(long_window, capacity))
+        self.last_telemetry_id = 0
+
+    def _slot(self, node_id):
+        slot = self.slots.get(node_id)
+        if slot is None:
+            slot = len(self.node_ids)
+            if slot == len(self.last):
+                last = np.full((2 * slot, 3), np.nan)
+                last[:slot] = self.last
+                self.last = last
+                for window in self.windows:
+                    window.grow(2 * slot)
+            self.slots[node_id] = slot
+            self.node_ids.append(node_id)
+        return slot
+
+    def observe(self, node_id, timestamp, battery_level, voltage):
+        """Add one telemetry sample; samples older than the node's latest one are ignored."""
+        if timestamp is None or (battery_level is None and voltage is None):
+            return
+        slot = self._slot(node_id)
+        if timestamp <= np.nan_to_num(self.last[slot, 0], nan=-np.inf):
+            return
+        if self.epoch is None:
+            self.epoch = timestamp
+        # Remember the level, but keep externally powered readings out of the drain regression
+        self.last[slot] = (timestamp, np.nan if battery_level is None else battery_level,
+                           np.nan if voltage is None else voltage)
+        if battery_level is not None and battery_level > POWERED_LEVEL:
+            battery_level = None
+        t = (timestamp - self.epoch) / 3600.0
+        for window in self.windows:
+            window.add(slot, t, battery_level, voltage)
+
+    def refresh(self, database_path='messages.db'):
+        """Feed telemetry rows stored since the last refresh; the first call only reads the last long window."""
+        conn = connect(database_path)
+        c = conn.cursor()
+        if self.last_telemetry_id == 0:
+            c.execute('SELECT MAX(timestamp) FROM telemetry')
+            newest = c.fetchone()[0] or 0
+            c.execute('''SELECT id, node_id, timestamp, battery_level, voltage FROM telemetry
+                         WHERE timestamp >= ? ORDER BY timestamp, id''', (newest - self.windows[1].length,))
+        else:
+            c.execute('''SELECT id, node_id, timestamp, battery_level, voltage FROM telemetry
+                         WHERE id > ? ORDER BY id''', (self.last_telemetry_id,))
+        rows = c.fetchall()
+        conn.close()
+        for row_id, node_id, timestamp, battery_level, voltage in rows:
+            self.observe(node_id, timestamp, battery_level, voltage)
+            self.last_telemetry_id = max(self.last_telemetry_id, row_id)
+        return len(rows)
+
+    def fleet(self, now=None):
+        """Forecast for every node, soonest-empty first, as a list of dicts.
+
+        battery_rate / voltage_rate are the short-window rates (%/h, V/h),
+        *_trend the long-window ones; hours_to_empty extrapolates the trend
+        from the latest level (by battery level, falling back to voltage).
+        """
+        count = len(self.node_ids)
+        if count == 0:
+            return []
+        now = now if now is not None else time_module.time()
+        short, long = (window.sums[:count] for window in self.windows)
+        battery_rate = _slopes(short, N_B, T_B, TT_B, Y_B, TY_B)
+        voltage_rate = _slopes(short, N_V, T_V, TT_V, Y_V, TY_V)
+        battery_trend = _slopes(long, N_B, T_B, TT_B, Y_B, TY_B)
+        voltage_trend = _slopes(long, N_V, T_V, TT_V, Y_V, TY_V)
+
+        # Regressions over too short a span are mostly noise
+        span = (self.last[:count, 0] - self.epoch) / 3600.0 - self.windows[1].first(range(count))
+        short_span = (self.last[:count, 0] - self.epoch) / 3600.0 - self.windows[0].first(range(count))
+        battery_rate[short_span < MIN_SPAN / 3600.0] = np.nan
+        voltage_rate[short_span < MIN_SPAN / 3600.0] = np.nan
+        battery_trend[span < MIN_SPAN / 3600.0] = np.nan
+        voltage_trend[span < MIN_SPAN / 3600.0] = np.nan
+
+        level = self.last[:count, 1]
+        voltage = self.last[:count, 2]
+        elapsed = (now - self.last[:count, 0]) / 3600.0
+        with np.errstate(divide='ignore', invalid='ignore'):
+            by_level = np.where(battery_trend < 0, (level - EMPTY_LEVEL) / -battery_trend - elapsed, np.nan)
+            by_voltage = np.where(voltage_trend < 0, (voltage - EMPTY_VOLTAGE) / -voltage_trend - elapsed, np.nan)
+        hours_to_empty = np.where(np.isnan(by_level), by_voltage, by_level)
+        hours_to_empty = np.maximum(hours_to_empty, 0.0)
+        powered = level > POWERED_LEVEL
+        hours_to_empty[powered] = np.nan
+
+        status = np.full(count, 'unknown', dtype=object)
+        status[np.abs(battery_rate) <= STABLE_RATE] = 'stable'
+        status[battery_rate > STABLE_RATE] = 'charging'
+        status[battery_rate < -STABLE_RATE] = 'draining'
+        status[powered] = 'powered'
+
+        order = np.lexsort((np.arange(count), np.nan_to_num(hours_to_empty, nan=np.inf)))
+
+        def value(array, i, digits):
+            return None if np.isnan(array[i]) else round(float(array[i]), digits) + 0.0
+
+        return [{
+            'node_id': self.node_ids[i],
+            'last_seen': int(self.last[i, 0]),
+            'battery_level': value(level, i, 1),
+            'voltage': value(voltage, i, 3),
+            'status': status[i],
+            'battery_rate': value(battery_rate, i, 2),
+            'voltage_rate': value(voltage_rate, i, 4),
+            'battery_trend': value(battery_trend, i, 2),
+            'voltage_trend': value(voltage_trend, i, 4),
+            'hours_to_empty': value(hours_to_empty, i, 1),
+        } for i in order]
+
+
+def main():
+    forecaster = BatteryForecaster()
+    forecaster.refresh()
+    print(f"{'Node':<12}{'Level':>7}{'Volt':>7}  {'Status':<9}{'%/h now':>9}{'%/h 24h':>9}{'Empty in':>10}")
+    for node in forecaster.fleet():
+        level = '' if node['battery_level'] is None else f"{node['battery_level']:.0f}"
+        voltage = '' if node['voltage'] is None else f"{node['voltage']:.2f}"
+        rate = '' if node['battery_rate'] is None else f"{node['battery_rate']:+.2f}"
+        trend = '' if node['battery_trend'] is None else f"{node['battery_trend']:+.2f}"
+        empty = '' if node['hours_to_empty'] is None else f"{node['hours_to_empty']:.1f} h"
+        print(f"{node['node_id']:<12}{level:>7}{voltage:>7}  {node['status']:<9}{rate:>9}{trend:>9}{empty:>10}")
+
+
+if __name__ == "__main__":
+    main()
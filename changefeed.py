@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Change feed of what the ingest process stored, for consumers that would otherwise poll messages.db.
+
+meshdb publishes every committed insert/upsert to a ChangeFeed, which
+appends it as one JSON line to an append-only changelog:
+
+    {"seq": 1234, "table": "telemetry", "op": "insert", "row": {...}, "time": 1724140800.5}
+
+Sequence numbers increase by one per record and survive restarts. The log
+is split into segment files named by their first sequence number
+(changes/00000000000000001234.jsonl); old segments are deleted once
+KEEP_SEGMENTS newer ones exist. publish() writes the records of one
+store call to the file before it returns, so a sequence number handed
+out is never handed out again after a crash (the spool marks the store
+call as done right after). Records that could not be written (disk full)
+stay in memory and are retried by the next publish() or flush().
+
+Consumers use ChangeReader and remember the last seq they processed:
+
+    reader = ChangeReader()
+    for batch in reader.follow(after_seq=last_seq, batch_size=500):
+        handle(batch)
+        last_seq = batch[-1]['seq']
+
+They pull at their own pace, so a slow consumer never blocks ingest. One
+that falls behind the retained segments gets ChangeFeedGap and has to
+reload from the tables before following again.
+
+    python3 changefeed.py --after 1000 --follow
+"""
+import argparse
+import json
+import logging
+import os
+import threading
+import time as time_module
+
+logger = logging.getLogger(__name__)
+
+CHANGES_DIR = 'changes'
+SEGMENT_BYTES = 16 * 1024 * 1024
+KEEP_SEGMENTS = 8
+SUFFIX = '.jsonl'
+
+
+class ChangeFeedGap(Exception):
+    """The records after the requested sequence number were already deleted."""
+
+
+def _segments(directory):
+    """[(first seq, path)] of the log segments, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted((int(name[:-len(SUFFIX)]), os.path.join(directory, name))
+                  for name in names if name.endswith(SUFFIX) and name[:-len(SUFFIX)].isdigit())
+
+
+class ChangeFeed:
+    """Writer side, owned by the ingest process."""
+
+    def __init__(self, directory=CHANGES_DIR, segment_bytes=SEGMENT_BYTES, keep_segments=KEEP_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.keep_segments = keep_segments
+        self.lock = threading.Lock()
+        self.buffer = []
+        self.file = None
+        self.seq = None  # opened lazily, so importing meshdb does not create the directory
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = _segments(self.directory)
+        self.seq = 0
+        if segments:
+            self.seq = self._recover(segments[-1][1], segments[-1][0] - 1)
+            self.file = open(segments[-1][1], 'a', encoding='utf-8')
+        else:
+            self._rotate()
+
+    def _recover(self, path, seq):
+        """Last complete seq in path; a line cut off by a crash is truncated away."""
+        with open(path, 'rb+') as f:
+            data = f.read()
+            end = data.rfind(b'\n') + 1
+            if end < len(data):
+                f.truncate(end)
+        lines = data[:end].splitlines()
+        return json.loads(lines[-1])['seq'] if lines else seq
+
+    def _rotate(self):
+        if self.file is not None:
+            self.file.close()
+        path = os.path.join(self.directory, f'{self.seq + 1:020d}{SUFFIX}')
+        self.file = open(path, 'a', encoding='utf-8')
+        for _, old in _segments(self.directory)[:-self.keep_segments]:
+            os.remove(old)
+
+    def publish(self, table, op, rows):
+        """Append committed rows (dicts) of table to the log; op is 'insert' or 'upsert'."""
+        now = time_module.time()
+        with self.lock:
+            if self.seq is None:
+                self._open()
+            for row in rows:
+                self.seq += 1
+                self.buffer.append({'seq': self.seq, 'table': table, 'op': op, 'row': row, 'time': now})
+            self._flush()
+
+    def flush(self):
+        """Retry writing records a failed write left in memory."""
+        with self.lock:
+            if self.buffer:
+                self._flush()
+
+    def _flush(self):
+        try:
+            self.file.write(''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in self.buffer))
+            self.file.flush()
+        except OSError as e:
+            logger.error(f"Error writing change feed: {e}")
+            return
+        self.buffer = []
+        if self.file.tell() >= self.segment_bytes:
+            self._rotate()
+
+
+class ChangeReader:
+    """Consumer side; reads records by sequence number, continuing from where the last read stopped."""
+
+    def __init__(self, directory=CHANGES_DIR):
+        self.directory = directory
+        self.position = None  # (segment path, byte offset, last seq read there)
+
+    def _locate(self, after_seq):
+        segments = _segments(self.directory)
+        if not segments:
+            return None
+        if after_seq + 1 < segments[0][0]:
+            raise ChangeFeedGap(f"records {after_seq + 1}..{segments[0][0] - 1} are no longer in {self.directory}")
+        path = segments[0][1]
+        for first, candidate in segments:
+            if first > after_seq + 1:
+                break
+            path = candidate
+        return path, 0, None
+
+    def read(self, after_seq=0, limit=1000):
+        """Up to limit records with seq > after_seq, oldest first (empty when there is nothing new)."""
+        if self.position is None or self.position[2] != after_seq:
+            self.position = self._locate(after_seq)
+            if self.position is None:
+                return []
+        path, offset, _ = self.position
+        records = []
+        while len(records) < limit:
+            try:
+                with open(path, 'rb') as f:
+                    f.seek(offset)
+                    for line in f:
+                        if not line.endswith(b'\n'):
+                            break  # still being written
+                        offset += len(line)
+                        record = json.loads(line)
+                        if record['seq'] > after_seq:
+                            records.append(record)
+                            after_seq = record['seq']
+                            if len(records) >= limit:
+                                break
+            except FileNotFoundError:
+                # Deleted by retention while we were behind
+                self.position = None
+                if records:
+                    break
+                raise ChangeFeedGap(f"segment {path} was deleted before it was read")
+            if len(records) >= limit:
+                break
+            following = [candidate for first, candidate in _segments(self.directory) if candidate > path]
+            if not following:
+                break
+            path, offset = following[0], 0
+        self.position = (path, offset, after_seq)
+        return records
+
+    def follow(self, after_seq=0, batch_size=1000, poll_interval=1.0):
+        """Yield batches of new records forever, waiting poll_interval when the feed is idle."""
+        while True:
+            batch = self.read(after_seq, batch_size)
+            if batch:
+                after_seq = batch[-1]['seq']
+                yield batch
+            else:
+                time_module.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print records from the ingest change feed.")
+    parser.add_argument('--after', type=int, default=0, help="Start after this sequence number")
+    parser.add_argument('--follow', action='store_true', help="Keep printing new records")
+    parser.add_argument('--table', help="Only records of this table")
+    parser.add_argument('--dir', default=CHANGES_DIR)
+    args = parser.parse_args()
+
+    reader = ChangeReader(args.dir)
+    batches = reader.follow(args.after) if args.follow else iter(lambda: reader.read(args.after), [])
+    try:
+        for batch in batches:
+            for record in batch:
+                if args.table is None or record['table'] == args.table:
+                    print(json.dumps(record, ensure_ascii=False))
+            args.after = batch[-1]['seq']
+    except KeyboardInterrupt:
+        pass
+    except ChangeFeedGap as e:
+        parser.error(str(e))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,36 +1,18 @@
-import sqlite3
+from dbstats import table_counts
 
 def count_records_in_tables(database_path):
-    conn = sqlite3.connect(database_path)
-    c = conn.cursor()
-    
-    # List of all your tables
-    tables = [
-        'environment', 
-        'neighbors', 
-        'positions', 
-        'telemetry', 
-        'messages', 
-        'nodes', 
-        'routing', 
-        'traceroute'
-    ]
-    
-    table_counts = {}
+    """(rows, exact) per table, read from the counters maintained at ingest instead of COUNT(*) scans.
 
-    for table in tables:
-        c.execute(f"SELECT COUNT(*) FROM {table}")
-        count = c.fetchone()[0]
-        table_counts[table] = count
-    
-    conn.close()
-    
-    return table_counts
+    exact is False for tables without a counter, whose rows are estimated from the AUTOINCREMENT sequence.
+    """
+    return table_counts(database_path)
 
 # Usage
 database_path = 'messages.db'  # Replace with your actual database path
-table_counts = count_records_in_tables(database_path)
-
-for table, count in table_counts.items():
-    print(f"Table '{table}' has {count} records.")
+table_counts_by_table = count_records_in_tables(database_path)
 
+for table, (count, exact) in table_counts_by_table.items():
+    if exact:
+        print(f"Table '{table}' has {count} records.")
+    else:
+        print(f"Table '{table}' has about {count} records (estimate).")
@@ -0,0 +1,234 @@
+"""Estimated radio coverage raster from node positions and neighbor SNR.
+
+Each node gets a log-distance path-loss model fitted to the SNR of its
+links (SNR = snr_1km - 10 * n * log10(d / 1 km)). The model is evaluated
+with numpy over the grid cells inside the node's range, and the coverage
+raster keeps the best predicted SNR per cell. Per-node layers are cached
+per grid resolution. After refresh() only nodes whose position or links
+changed (and their neighbors) are recomputed. Outlying positions are left
+out and the grid is coarsened if it would exceed MAX_GRID_CELLS, so a few
+stray fixes cannot make the raster huge.
+"""
+import math
+
+import numpy as np
+
+from geo import haversine_np, EARTH_RADIUS_M
+from pragmas import connect
+from topology import node_num
+
+DEFAULT_RESOLUTION_M = 500
+# Below this SNR a LoRa packet is assumed lost (dB)
+SNR_FLOOR = -20.0
+REFERENCE_DISTANCE_M = 1000.0
+# Used when a node has too few links to fit its own model
+DEFAULT_EXPONENT = 2.7
+DEFAULT_REFERENCE_SNR = 5.0
+MIN_EXPONENT = 2.0
+MAX_EXPONENT = 4.5
+# Never draw a node's coverage further out than this (meters); also the margin around the grid
+MAX_RANGE_M = 30000.0
+# Nodes further than this from the median position (bad GPS fixes, 0/0, far-away MQTT nodes) are left out (meters)
+MAX_SPREAD_M = 200000.0
+# Larger grids are built at a coarser resolution instead (cells; 4M float64 cells = 32 MB per raster)
+MAX_GRID_CELLS = 4000000
+
+
+def fit_path_loss(distances_m, snrs):
+    """(snr_at_1km, exponent) fitted to a node's links; falls back to defaults with fewer than 3 usable links."""
+    distances_m = np.maximum(np.asarray(distances_m, dtype=np.float64), 100.0)
+    snrs = np.asarray(snrs, dtype=np.float64)
+    x = 10.0 * np.log10(distances_m / REFERENCE_DISTANCE_M)
+    exponent = DEFAULT_EXPONENT
+    if len(x) >= 3 and np.ptp(x) > 1.0:
+        slope, _ = np.polyfit(x, snrs, 1)
+        exponent = float(np.clip(-slope, MIN_EXPONENT, MAX_EXPONENT))
+    if len(x) == 0:
+        return DEFAULT_REFERENCE_SNR, exponent
+    return float(np.mean(snrs + exponent * x)), exponent
+
+
+class CoverageModel:
+    """Positions and link SNR per node, plus cached coverage rasters per resolution."""
+
+    def __init__(self):
+        self.positions = {}       # node number -> (latitude, longitude)
+        self.links = {}           # node number -> {neighbor number: [snr_sum, count]}
+        self.versions = {}        # node number -> bumped when its model inputs change
+        self.last_position_id = 0
+        self.last_neighbor_id = 0
+        self._rasters = {}        # resolution -> raster cache dict
+
+    def _touch(self, node):
+        self.versions[node] = self.versions.get(node, 0) + 1
+
+    def refresh(self, database_path='messages.db'):
+        """Read positions and neighbor rows stored since the last refresh; returns the set of changed nodes."""
+        changed = set()
+        conn = connect(database_path)
+        c = conn.cursor()
+        c.execute('''SELECT id, node_id, latitude, longitude FROM positions
+                     WHERE id > ? AND latitude IS NOT NULL AND longitude IS NOT NULL ORDER BY id''',
+                  (self.last_position_id,))
+        for row_id, user_id, latitude, longitude in c.fetchall():
+            self.last_position_id = row_id
+            try:
+                node = node_num(user_id)
+            except ValueError:
+                continue
+            if self.positions.get(node) != (latitude, longitude):
+                self.positions[node] = (latitude, longitude)
+                changed.add(node)
+                # Link distances of its neighbors changed too
+                changed.update(self.links.get(node, {}))
+
+        c.execute('''SELECT id, node_id, neighbor_node_id, snr FROM neighbors WHERE id > ? ORDER BY id''',
+                  (self.last_neighbor_id,))
+        for row_id, node, neighbor, snr in c.fetchall():
+            self.last_neighbor_id = row_id
+            if snr is None:
+                continue
+            try:
+                node = node_num(node)
+                neighbor = node_num(neighbor)
+            except ValueError:
+                continue
+            for a, b in ((node, neighbor), (neighbor, node)):
+                stats = self.links.setdefault(a, {}).setdefault(b, [0.0, 0])
+                stats[0] += snr
+                stats[1] += 1
+            changed.update((node, neighbor))
+        conn.close()
+
+        for node in changed:
+            self._touch(node)
+        return changed
+
+    def model(self, node):
+        """Fitted (snr_at_1km, exponent) for a node with a known position."""
+        latitude, longitude = self.positions[node]
+        neighbors = [(n, stats) for n, stats in self.links.get(node, {}).items() if n in self.positions]
+        if not neighbors:
+            return DEFAULT_REFERENCE_SNR, DEFAULT_EXPONENT
+        coordinates = np.array([self.positions[n] for n, _ in neighbors])
+        snrs = np.array([stats[0] / stats[1] for _, stats in neighbors])
+        distances = haversine_np(latitude, longitude, coordinates[:, 0], coordinates[:, 1])
+        return fit_path_loss(distances, snrs)
+
+    def mapped_nodes(self):
+        """Nodes with a position within MAX_SPREAD_M of the median position; the others are not drawn."""
+        if not self.positions:
+            return []
+        nodes = list(self.positions)
+        coordinates = np.array([self.positions[node] for node in nodes])
+        median = np.median(coordinates, axis=0)
+        distances = haversine_np(median[0], median[1], coordinates[:, 0], coordinates[:, 1])
+        return [node for node, distance in zip(nodes, distances) if distance <= MAX_SPREAD_M]
+
+    def _new_grid(self, resolution, nodes):
+        coordinates = np.array([self.positions[node] for node in nodes])
+        lat0 = float(np.mean(coordinates[:, 0]))
+        x = np.radians(coordinates[:, 1]) * EARTH_RADIUS_M * math.cos(math.radians(lat0))
+        y = np.radians(coordinates[:, 0]) * EARTH_RADIUS_M
+        x_min = x.min() - MAX_RANGE_M
+        y_min = y.min() - MAX_RANGE_M
+        span_x = x.max() + MAX_RANGE_M - x_min
+        span_y = y.max() + MAX_RANGE_M - y_min
+        # Coarsen rather than allocate more than MAX_GRID_CELLS
+        resolution = max(resolution, math.sqrt(span_x * span_y / MAX_GRID_CELLS))
+        while math.ceil(span_x / resolution) * math.ceil(span_y / resolution) > MAX_GRID_CELLS:
+            resolution *= 1.01
+        width = int(math.ceil(span_x / resolution))
+        height = int(math.ceil(span_y / resolution))
+        return {
+            'resolution': resolution,
+            'lat0': lat0,
+            'x_min': x_min,
+            'y_min': y_min,
+            'x_max': x_min + width * resolution,
+            'y_max': y_min + height * resolution,
+            'shape': (height, width),
+            'layers': {},       # node -> (version, row slice, column slice, snr array)
+            'combined': None,
+            'points': None,
+        }
+
+    def _inside(self, grid, node):
+        latitude, longitude = self.positions[node]
+        x = math.radians(longitude) * EARTH_RADIUS_M * math.cos(math.radians(grid['lat0']))
+        y = math.radians(latitude) * EARTH_RADIUS_M
+        return grid['x_min'] + MAX_RANGE_M <= x <= grid['x_max'] - MAX_RANGE_M and \
+            grid['y_min'] + MAX_RANGE_M <= y <= grid['y_max'] - MAX_RANGE_M
+
+    def _layer(self, grid, node):
+        snr_1km, exponent = self.model(node)
+        reach = min(REFERENCE_DISTANCE_M * 10 ** ((snr_1km - SNR_FLOOR) / (10 * exponent)), MAX_RANGE_M)
+        latitude, longitude = self.positions[node]
+        resolution = grid['resolution']
+        x = math.radians(longitude) * EARTH_RADIUS_M * math.cos(math.radians(grid['lat0']))
+        y = math.radians(latitude) * EARTH_RADIUS_M
+        height, width = grid['shape']
+        col0 = max(int((x - reach - grid['x_min']) // resolution), 0)
+        col1 = min(int((x + reach - grid['x_min']) // resolution) + 1, width)
+        row0 = max(int((y - reach - grid['y_min']) // resolution), 0)
+        row1 = min(int((y + reach - grid['y_min']) // resolution) + 1, height)
+        # Distances from the node to every cell center in its window
+        xs = grid['x_min'] + (np.arange(col0, col1) + 0.5) * resolution - x
+        ys = grid['y_min'] + (np.arange(row0, row1) + 0.5) * resolution - y
+        distances = np.maximum(np.hypot(xs[np.newaxis, :], ys[:, np.newaxis]), 50.0)
+        snr = snr_1km - 10.0 * exponent * np.log10(distances / REFERENCE_DISTANCE_M)
+        snr[(snr < SNR_FLOOR) | (distances > reach)] = -np.inf
+        return slice(row0, row1), slice(col0, col1), snr
+
+    def raster(self, resolution=DEFAULT_RESOLUTION_M):
+        """Best predicted SNR per cell (-inf where nothing is heard), recomputing only changed nodes.
+
+        Returns the raster cache dict; 'combined' holds the array, row 0 is the southern edge, and
+        'resolution' the cell size used (coarser than asked for if the grid would exceed MAX_GRID_CELLS).
+        """
+        nodes = self.mapped_nodes()
+        if not nodes:
+            return None
+        grid = self._rasters.get(resolution)
+        if grid is None or any(not self._inside(grid, node) for node in nodes):
+            grid = self._new_grid(resolution, nodes)
+            self._rasters[resolution] = grid
+
+        layers = grid['layers']
+        # Drop the layers of nodes that became outliers
+        dropped = set(layers) - set(nodes)
+        for node in dropped:
+            del layers[node]
+        stale = [node for node in nodes
+                 if node not in layers or layers[node][0] != self.versions.get(node, 0)]
+        if stale or dropped or grid['combined'] is None:
+            for node in stale:
+                rows, cols, snr = self._layer(grid, node)
+                layers[node] = (self.versions.get(node, 0), rows, cols, snr)
+            combined = np.full(grid['shape'], -np.inf)
+            for _, rows, cols, snr in layers.values():
+                np.maximum(combined[rows, cols], snr, out=combined[rows, cols])
+            grid['combined'] = combined
+            grid['points'] = None
+        return grid
+
+    def heatmap_points(self, resolution=DEFAULT_RESOLUTION_M):
+        """[[latitude, longitude, weight], ...] for covered cells, weight 0..1 from SNR_FLOOR to the best SNR."""
+        grid = self.raster(resolution)
+        if grid is None:
+            return []
+        if grid['points'] is not None:
+            return grid['points']
+        combined = grid['combined']
+        rows, cols = np.nonzero(np.isfinite(combined))
+        if len(rows) == 0:
+            grid['points'] = []
+            return []
+        values = combined[rows, cols]
+        weights = (values - SNR_FLOOR) / max(values.max() - SNR_FLOOR, 1e-9)
+        x = grid['x_min'] + (cols + 0.5) * grid['resolution']
+        y = grid['y_min'] + (rows + 0.5) * grid['resolution']
+        latitudes = np.degrees(y / EARTH_RADIUS_M)
+        longitudes = np.degrees(x / (EARTH_RADIUS_M * math.cos(math.radians(grid['lat0']))))
+        grid['points'] = np.column_stack((latitudes, longitudes, np.round(weights, 3))).tolist()
+        return grid['points']
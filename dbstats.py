@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+"""Database statistics that stay fast on multi-GB databases.
+
+- Row counts come from table_counts, kept up to date by triggers (see
+  meshdb.initialize_db); tables without a counter fall back to the
+  AUTOINCREMENT sequence, an upper bound when rows were deleted.
+- Rows stored in the last hour/day come from a binary search over the id
+  (rowid) for the first row at or after the cutoff: ~30 index lookups per
+  table instead of a scan. Deleted ids inside the window still count.
+- Bytes per table and index come from the dbstat virtual table. That reads
+  every page, so it is only done with --bytes.
+
+    python3 dbstats.py
+    python3 dbstats.py --bytes
+"""
+import argparse
+import os
+import shutil
+import sqlite3
+import time as time_module
+
+from dictionary import logical_table
+from pragmas import connect
+
+# Tables whose row counts are maintained in table_counts (meshdb.initialize_db adds the triggers)
+COUNTED_TABLES = ['messages', 'telemetry', 'positions', 'environment', 'traceroute', 'neighbors', 'routing', 'nodes',
+                  'raw_packets', 'events']
+# Column with the unix time of each row, where it is not called timestamp
+TIME_COLUMNS = {
+    'raw_packets': 'rx_time',
+}
+# Tables without an id / time column to search
+NO_RATE = {'nodes'}
+
+
+def table_counts(database_path='messages.db'):
+    """{table: (rows, exact)}; exact is False for sequence-based estimates."""
+    conn = connect(database_path)
+    c = conn.cursor()
+    counts = {}
+    try:
+        c.execute('SELECT name, row_count FROM table_counts')
+        counts = {name: (row_count, True) for name, row_count in c.fetchall()}
+    except sqlite3.OperationalError:
+        pass
+    try:
+        c.execute('SELECT name, seq FROM sqlite_sequence')
+        for name, seq in c.fetchall():
+            counts.setdefault(logical_table(name), (seq, False))
+    except sqlite3.OperationalError:
+        pass
+    conn.close()
+    return counts
+
+
+def first_id_since(c, table, since, column='timestamp'):
+    """Smallest id whose row has column >= since (ids assumed to grow with time), or None."""
+    # ORDER BY id LIMIT 1 rather than MIN()/MAX(): through the view of a compacted table
+    # (see dictionary.py) only this form is an index lookup
+    c.execute(f'SELECT id FROM {table} ORDER BY id LIMIT 1')
+    row = c.fetchone()
+    if row is None:
+        return None
+    low = row[0]
+    c.execute(f'SELECT id FROM {table} ORDER BY id DESC LIMIT 1')
+    high = c.fetchone()[0]
+    c.execute(f'SELECT {column} FROM {table} WHERE id = ?', (high,))
+    newest = c.fetchone()[0]
+    if newest is None or newest < since:
+        return None
+    answer = high
+    while low <= high:
+        middle = (low + high) // 2
+        # Ids can have gaps; take the first row at or after middle
+        c.execute(f'SELECT id, {column} FROM {table} WHERE id >= ? ORDER BY id LIMIT 1', (middle,))
+        row_id, value = c.fetchone()
+        if row_id > high:
+            high = middle - 1
+        elif value is not None and value >= since:
+            answer = row_id
+            high = middle - 1
+        else:
+            low = row_id + 1
+    return answer
+
+
+def ingest_rates(database_path='messages.db', windows=(3600, 86400), now=None):
+    """{table: [rows stored in each window]}, counted from the rowid range rather than scanned."""
+    now = now if now is not None else time_module.time()
+    conn = connect(database_path)
+    c = conn.cursor()
+    rates = {}
+    for table in COUNTED_TABLES:
+        if table in NO_RATE:
+            continue
+        column = TIME_COLUMNS.get(table, 'timestamp')
+        try:
+            c.execute(f'SELECT id FROM {table} ORDER BY id DESC LIMIT 1')
+            newest_id = (c.fetchone() or (None,))[0]
+            counts = []
+            for window in windows:
+                first = first_id_since(c, table, now - window, column)
+                counts.append(0 if first is None else newest_id - first + 1)
+        except sqlite3.OperationalError:
+            continue
+        rates[table] = counts
+    conn.close()
+    return rates
+
+
+def file_size(database_path='messages.db'):
+    """(database bytes, free page bytes) from the page counters, without reading the file."""
+    conn = connect(database_path)
+    c = conn.cursor()
+    page_size = c.execute('PRAGMA page_size').fetchone()[0]
+    page_count = c.execute('PRAGMA page_count').fetchone()[0]
+    freelist = c.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.close()
+    return page_count * page_size, freelist * page_size
+
+
+def object_sizes(database_path='messages.db'):
+    """{table or index name: bytes} from dbstat (reads every page), or None if dbstat is not compiled in."""
+    conn = connect(database_path)
+    try:
+        rows = conn.execute("SELECT name, SUM(pgsize) FROM dbstat WHERE aggregate = TRUE GROUP BY name").fetchall()
+    except sqlite3.OperationalError:
+        try:
+            rows = conn.execute('SELECT name, SUM(pgsize) FROM dbstat GROUP BY name').fetchall()
+        except sqlite3.OperationalError:
+            return None
+    finally:
+        conn.close()
+    # Compacted tables under the name they are queried by
+    sizes = {}
+    for name, size in rows:
+        sizes[logical_table(name)] = sizes.get(logical_table(name), 0) + size
+    return sizes
+
+
+def project_growth(database_path='messages.db', rates=None, counts=None, sizes=None):
+    """(bytes per day, days until the disk is full or None) extrapolated from the longest ingest window."""
+    rates = rates if rates is not None else ingest_rates(database_path)
+    counts = counts if counts is not None else table_counts(database_path)
+    total_bytes, free_bytes = file_size(database_path)
+    total_rows = sum(rows for rows, _ in counts.values()) or 1
+    # Average bytes per row: per table with --bytes, otherwise the whole file
+    average = (total_bytes - free_bytes) / total_rows
+    per_day = 0.0
+    for table, windows in rates.items():
+        last_day = windows[-1]
+        rows = counts.get(table, (0, True))[0]
+        row_bytes = sizes[table] / rows if sizes and rows and table in sizes else average
+        per_day += last_day * row_bytes
+    disk_free = shutil.disk_usage(os.path.dirname(os.path.abspath(database_path))).free + free_bytes
+    days_left = disk_free / per_day if per_day > 0 else None
+    return per_day, days_left
+
+
+def _mb(value):
+    return f"{value / 1048576:.1f} MB"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Row counts, sizes and ingest rates of messages.db.")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    parser.add_argument('--bytes', action='store_true', help="Also report bytes per table and index (reads the whole file)")
+    args = parser.parse_args()
+
+    counts = table_counts(args.db)
+    rates = ingest_rates(args.db)
+    sizes = object_sizes(args.db) if args.bytes else None
+
+    print(f"{'Table':<14}{'Rows':>14}{'Last hour':>12}{'Last day':>12}" + (f"{'Size':>12}" if sizes else ""))
+    for table in COUNTED_TABLES:
+        if table not in counts:
+            continue
+        rows, exact = counts[table]
+        last_hour, last_day = rates.get(table, ('', ''))
+        line = f"{table:<14}{('' if exact else '~') + str(rows):>14}{last_hour:>12}{last_day:>12}"
+        if sizes:
+            line += f"{_mb(sizes.get(table, 0)):>12}"
+        print(line)
+    if sizes:
+        print("\nIndexes:")
+        for name, size in sorted(sizes.items(), key=lambda item: -item[1]):
+            if name.startswith(('idx_', 'sqlite_autoindex_')):
+                print(f"  {name:<50}{_mb(size):>12}")
+
+    total_bytes, free_bytes = file_size(args.db)
+    per_day, days_left = project_growth(args.db, rates, counts, sizes)
+    print(f"\nDatabase size: {_mb(total_bytes)} ({_mb(free_bytes)} free pages)")
+    print(f"Growth: {_mb(per_day)} per day, {_mb(per_day * 30)} per 30 days")
+    if days_left is not None:
+        print(f"Disk full in about {days_left:.0f} days at this rate")
+
+
+if __name__ == "__main__":
+    main()
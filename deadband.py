@@ -0,0 +1,141 @@
+"""Dead-band compression for telemetry and environment samples.
+
+Nodes repeat the same metrics for hours (battery 100, flat voltage). A sample
+is only written when one of its metrics leaves the tolerance band around the
+last stored value, or when max_interval has passed since the last stored row.
+When a change does get through, the last sample that was held back is written
+first, so straight lines between stored rows stay within tolerance of what
+was really sent. read_series() rebuilds regularly spaced values that way.
+"""
+import numpy as np
+
+from pragmas import connect
+
+# Store at least one row per node this often, even if nothing moved (seconds)
+DEFAULT_MAX_INTERVAL = 60 * 60
+
+TELEMETRY_TOLERANCES = {
+    'battery_level': 2,
+    'voltage': 0.05,
+    'channel_utilization': 2.0,
+    'air_util_tx': 1.0,
+    # uptime is compared against the value expected from the wall clock, so only reboots count
+    'uptime_seconds': 120,
+}
+
+ENVIRONMENT_TOLERANCES = {
+    'temperature': 0.5,
+    'humidity': 2.0,
+    'bar': 1.0,
+    'iaq': 10,
+}
+
+
+class DeadbandFilter:
+    """Per-node dead-band filter over a fixed set of metrics.
+
+    counters are metrics that are expected to grow by one per second (uptime).
+    """
+
+    def __init__(self, tolerances, max_interval=DEFAULT_MAX_INTERVAL, counters=('uptime_seconds',)):
+        self.tolerances = tolerances
+        self.max_interval = max_interval
+        self.counters = set(counters)
+        self._stored = {}   # node_id -> (timestamp, values) of the last row written
+        self._held = {}     # node_id -> (timestamp, values) of the last sample held back
+        self.accepted = 0
+        self.suppressed = 0
+
+    def _moved(self, stored, timestamp, values):
+        stored_timestamp, stored_values = stored
+        for metric, tolerance in self.tolerances.items():
+            value = values.get(metric)
+            previous = stored_values.get(metric)
+            if value is None and previous is None:
+                continue
+            if value is None or previous is None:
+                return True
+            if metric in self.counters:
+                previous = previous + (timestamp - stored_timestamp)
+            if abs(value - previous) > tolerance:
+                return True
+        return False
+
+    def filter(self, node_id, timestamp, values):
+        """Return the (timestamp, values) samples that should be written for this new sample, oldest first."""
+        stored = self._stored.get(node_id)
+        if stored is not None and timestamp - stored[0] < self.max_interval and not self._moved(stored, timestamp, values):
+            self._held[node_id] = (timestamp, values)
+            self.suppressed += 1
+            return []
+
+        rows = []
+        held = self._held.pop(node_id, None)
+        if held is not None:
+            rows.append(held)
+        rows.append((timestamp, values))
+        self._stored[node_id] = (timestamp, values)
+        self.accepted += 1
+        return rows
+
+    def forget(self, node_id):
+        """Drop state for a node so its next sample is always stored."""
+        self._stored.pop(node_id, None)
+        self._held.pop(node_id, None)
+
+    @property
+    def ratio(self):
+        """Fraction of samples that were not written."""
+        total = self.accepted + self.suppressed
+        return self.suppressed / total if total else 0.0
+
+
+def read_series(node_id, table, columns, start, end, step, max_interval=DEFAULT_MAX_INTERVAL, database_path='messages.db'):
+    """Rebuild evenly spaced values from dead-band compressed rows.
+
+    Values are linearly interpolated between stored rows. After the last stored
+    row the value is held (nothing moved, or a row would have been written).
+    Gaps much longer than max_interval, where the node was not heard, come back as NaN.
+    Returns a dict of numpy arrays keyed by 'timestamp' and each column.
+    """
+    column_list = ', '.join(columns)
+    conn = connect(database_path)
+    c = conn.cursor()
+    # Include the last row before start so the beginning of the window is covered
+    c.execute(f'''SELECT timestamp, {column_list} FROM {table}
+                  WHERE node_id = ? AND timestamp >= COALESCE(
+                      (SELECT MAX(timestamp) FROM {table} WHERE node_id = ? AND timestamp < ?), ?)
+                  AND timestamp <= ?
+                  ORDER BY timestamp''',
+              (node_id, node_id, start, start, end))
+    rows = c.fetchall()
+    conn.close()
+
+    times = np.arange(start, end, step, dtype=np.float64)
+    series = {'timestamp': times}
+    if not rows:
+        for column in columns:
+            series[column] = np.full(len(times), np.nan)
+        return series
+
+    data = np.array(rows, dtype=np.float64)  # None becomes nan
+    stored_times = data[:, 0]
+    # Stored rows are at most about max_interval apart while a node is heard; wider gaps
+    # mean it was not heard, not that nothing changed
+    max_gap = 2 * max_interval
+    index = np.searchsorted(stored_times, times, side='right') - 1
+    previous = stored_times[np.clip(index, 0, None)]
+    following = stored_times[np.clip(index + 1, None, len(stored_times) - 1)]
+    is_last = index + 1 >= len(stored_times)
+    covered = (index >= 0) & (times - previous <= max_gap)
+    covered &= is_last | (following - previous <= max_gap)
+
+    for i, column in enumerate(columns, start=1):
+        values = data[:, i]
+        known = ~np.isnan(values)
+        if not known.any():
+            series[column] = np.full(len(times), np.nan)
+            continue
+        interpolated = np.interp(times, stored_times[known], values[known])
+        series[column] = np.where(covered, interpolated, np.nan)
+    return series
@@ -0,0 +1,267 @@
+#!/usr/bin/env python3
+"""Dictionary encoding of the strings repeated on every row of the big tables (node ids, routes, event kinds).
+
+Every telemetry, position or neighbor row repeats its node id as text
+('!a1b2c3d4': 10 bytes in the row and again in each index). A compacted
+table keeps small integer codes instead and shows the readable columns
+through a view of the old name:
+
+    dictionary       (id, kind, value): one row per distinct string
+    telemetry_data   the rows; node_id holds a dictionary id
+    telemetry        VIEW of telemetry_data joined with dictionary, same columns as before
+
+Queries, exports and the archive keep reading `telemetry` unchanged. The
+view takes INSERT and DELETE through INSTEAD OF triggers that intern new
+strings, so the other writers (get-messages-to-db.py, sync.py) work as
+before; meshdb inserts into telemetry_data itself, encoding with the
+in-memory cache of Dictionary. Rows and indexes get smaller (about a
+quarter of a telemetry-heavy database), so scans, joins and GROUP BY read
+fewer pages. MIN(id)/MAX(id) through a view scan it; use ORDER BY id
+LIMIT 1 instead.
+
+New databases are compacted by initialize_db, existing ones with
+`python3 dictionary.py compact` (rewrites each table once; stop
+get-reply.py first, and run `VACUUM` or maintenance.py afterwards to
+return the freed pages).
+
+    python3 dictionary.py status
+"""
+import argparse
+import logging
+import re
+import threading
+
+from pragmas import connect
+
+logger = logging.getLogger(__name__)
+
+# table -> {column: dictionary kind}; columns of the same kind share codes, so they can be joined on them
+COMPACT_COLUMNS = {
+    'telemetry': {'node_id': 'node'},
+    'positions': {'node_id': 'node'},
+    'environment': {'node_id': 'node'},
+    'neighbors': {'node_id': 'node_number', 'neighbor_node_id': 'node_number'},
+    'traceroute': {'from_node': 'node', 'to_node': 'node', 'hop_node': 'node'},
+    'routing': {'from_node': 'node', 'to_node': 'node', 'routes': 'routes'},
+    'events': {'node_id': 'node', 'kind': 'event', 'metric': 'metric'},
+}
+# Suffix of the table holding the rows of a compacted table
+SUFFIX = '_data'
+
+
+def initialize_dictionary(c):
+    # (value, kind) rather than (kind, value): the views filter on value alone
+    c.execute('''CREATE TABLE IF NOT EXISTS dictionary (
+                    id INTEGER PRIMARY KEY,
+                    kind TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    UNIQUE (value, kind)
+                )''')
+
+
+def storage_table(c, table, schema='main'):
+    """Name of the table holding the rows of table: table + SUFFIX once it is compacted, else table itself."""
+    c.execute(f"SELECT 1 FROM {schema}.sqlite_master WHERE type = 'table' AND name = ?", (table + SUFFIX,))
+    return table + SUFFIX if c.fetchone() is not None else table
+
+
+def logical_table(name):
+    """The table name readers use for a storage table name (telemetry_data -> telemetry)."""
+    if name.endswith(SUFFIX) and name[:-len(SUFFIX)] in COMPACT_COLUMNS:
+        return name[:-len(SUFFIX)]
+    return name
+
+
+def table_definition(table, info, integer_columns=()):
+    """CREATE TABLE statement from PRAGMA table_info rows, with integer_columns declared INTEGER.
+
+    id is the primary key, also when info is that of a view (which has none).
+    """
+    columns = []
+    for _, name, declared, _, _, pk in info:
+        declared = 'INTEGER' if name in integer_columns else declared
+        columns.append(f'{name} {declared} PRIMARY KEY AUTOINCREMENT' if pk or name == 'id' else f'{name} {declared}')
+    return f"CREATE TABLE {table} ({', '.join(columns)})"
+
+
+def compact_table(c, table):
+    """Move the rows of table into table_data with its COMPACT_COLUMNS encoded and put a view in its place.
+
+    Ids and the AUTOINCREMENT sequence are kept; indexes and triggers (the
+    table_counts counters) move to table_data under the same names. Returns
+    False if table was already compacted. The caller commits.
+    """
+    encoded = COMPACT_COLUMNS[table]
+    data = table + SUFFIX
+    if storage_table(c, table) == data:
+        return False
+    info = c.execute(f'PRAGMA table_info({table})').fetchall()
+    columns = [row[1] for row in info]
+    c.execute("SELECT sql FROM sqlite_master WHERE type IN ('index', 'trigger') AND tbl_name = ? AND sql IS NOT NULL",
+              (table,))
+    dependents = [row[0] for row in c.fetchall()]
+    c.execute('SELECT seq FROM sqlite_sequence WHERE name = ?', (table,))
+    sequence = c.fetchone()
+
+    c.execute(table_definition(data, info, encoded))
+    for column, kind in encoded.items():
+        c.execute(f'''INSERT OR IGNORE INTO dictionary (kind, value)
+                      SELECT DISTINCT ?, {column} FROM {table} WHERE {column} IS NOT NULL''', (kind,))
+    select = []
+    joins = []
+    for index, column in enumerate(columns):
+        if column in encoded:
+            select.append(f'd{index}.id')
+            joins.append(f"LEFT JOIN dictionary d{index} ON d{index}.value = t.{column} AND d{index}.kind = '{encoded[column]}'")
+        else:
+            select.append(f't.{column}')
+    c.execute(f'''INSERT INTO {data} ({', '.join(columns)})
+                  SELECT {', '.join(select)} FROM {table} t {' '.join(joins)} ORDER BY t.id''')
+    if sequence is not None:
+        c.execute('DELETE FROM sqlite_sequence WHERE name = ?', (data,))
+        c.execute('INSERT INTO sqlite_sequence (name, seq) VALUES (?, ?)', (data, sequence[0]))
+
+    c.execute(f'DROP TABLE {table}')
+    select = []
+    joins = []
+    for index, column in enumerate(columns):
+        if column in encoded:
+            select.append(f'd{index}.value AS {column}')
+            joins.append(f'LEFT JOIN dictionary d{index} ON d{index}.id = t.{column}')
+        else:
+            select.append(f't.{column} AS {column}')
+    c.execute(f"CREATE VIEW {table} AS SELECT {', '.join(select)} FROM {data} t {' '.join(joins)}")
+
+    interns = ''.join(f"INSERT OR IGNORE INTO dictionary (kind, value) SELECT '{kind}', NEW.{column} "
+                      f"WHERE NEW.{column} IS NOT NULL; " for column, kind in encoded.items())
+    values = [f"(SELECT id FROM dictionary WHERE value = NEW.{column} AND kind = '{encoded[column]}')"
+              if column in encoded else f'NEW.{column}' for column in columns]
+    c.execute(f'''CREATE TRIGGER trg_{table}_view_insert INSTEAD OF INSERT ON {table}
+                  BEGIN {interns}INSERT INTO {data} ({', '.join(columns)}) VALUES ({', '.join(values)}); END''')
+    c.execute(f'''CREATE TRIGGER trg_{table}_view_delete INSTEAD OF DELETE ON {table}
+                  BEGIN DELETE FROM {data} WHERE id = OLD.id; END''')
+    for sql in dependents:
+        c.execute(re.sub(rf'\bON\s+{table}\b', f'ON {data}', sql, count=1))
+    logger.info(f"Compacted {table} into {data}")
+    return True
+
+
+class Dictionary:
+    """Two-way in-memory cache of the dictionary table, so ingest encodes without a lookup per row.
+
+    One instance per database. A code a transaction added is only cached
+    once it is seen committed, so a rolled back insert cannot leave a code
+    in the cache that the table does not have.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.codes = {}  # (kind, value) -> id
+        self.values = {}  # id -> value
+        self.uncommitted = {}
+        self.layouts = {}  # table -> {column: kind}, empty if the table is not compacted
+
+    def encode(self, c, kind, value):
+        """Dictionary id of value (added if new), None for None."""
+        if value is None:
+            return None
+        if not isinstance(value, str):
+            # What the TEXT column of the uncompacted table would have stored
+            value = str(value)
+        key = (kind, value)
+        code = self.codes.get(key)
+        if code is None:
+            c.execute('INSERT OR IGNORE INTO dictionary (kind, value) VALUES (?, ?)', key)
+            c.execute('SELECT id FROM dictionary WHERE value = ? AND kind = ?', (value, kind))
+            code = c.fetchone()[0]
+            self.uncommitted[key] = code
+        return code
+
+    def decode(self, c, code):
+        """The string behind a dictionary id, None if there is none."""
+        if code is None:
+            return None
+        if code not in self.values:
+            c.execute('SELECT value FROM dictionary WHERE id = ?', (code,))
+            row = c.fetchone()
+            if row is None:
+                return None
+            self.values[code] = row[0]
+        return self.values[code]
+
+    def _confirm(self, c):
+        """Cache the codes added by earlier transactions that were committed."""
+        for (kind, value), code in self.uncommitted.items():
+            c.execute('SELECT id FROM dictionary WHERE value = ? AND kind = ?', (value, kind))
+            row = c.fetchone()
+            if row is not None and row[0] == code:
+                self.codes[(kind, value)] = code
+                self.values[code] = value
+        self.uncommitted = {}
+
+    def insert(self, c, table, columns, rows, skip_older=None):
+        """INSERT rows (tuples in columns order) into table, or encoded into table_data once it is compacted.
+
+        skip_older=(key column, time column) leaves out rows that are not
+        newer than one already stored for the same key. Returns c.lastrowid,
+        which an INSERT through the view would not set.
+        """
+        with self.lock:
+            if table not in self.layouts:
+                self.layouts[table] = COMPACT_COLUMNS[table] if storage_table(c, table) != table else {}
+            encoded = self.layouts[table]
+            target = table
+            if encoded:
+                if not c.connection.in_transaction:
+                    self._confirm(c)
+                rows = [tuple(self.encode(c, encoded[column], value) if column in encoded else value
+                              for column, value in zip(columns, row)) for row in rows]
+                target = table + SUFFIX
+            query = f"INSERT INTO {target} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+            if skip_older is not None:
+                key, time = skip_older
+                query = (f"INSERT INTO {target} ({', '.join(columns)}) SELECT {', '.join('?' * len(columns))} "
+                         f"WHERE NOT EXISTS (SELECT 1 FROM {target} WHERE {key} = ? AND {time} >= ?)")
+                positions = (columns.index(key), columns.index(time))
+                rows = [tuple(row) + tuple(row[index] for index in positions) for row in rows]
+            if len(rows) == 1:
+                c.execute(query, rows[0])
+            else:
+                c.executemany(query, rows)
+        return c.lastrowid
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact the big tables of messages.db with dictionary encoding.")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    commands = parser.add_subparsers(dest='command', required=True)
+    compact = commands.add_parser('compact', help="Compact tables (stop get-reply.py first)")
+    compact.add_argument('--tables', nargs='+', default=list(COMPACT_COLUMNS), choices=list(COMPACT_COLUMNS))
+    commands.add_parser('status', help="Show which tables are compacted")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    conn = connect(args.db)
+    c = conn.cursor()
+    initialize_dictionary(c)
+    conn.commit()
+    if args.command == 'compact':
+        for table in args.tables:
+            if not c.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (table,)).fetchone():
+                continue
+            c.execute('BEGIN IMMEDIATE')
+            changed = compact_table(c, table)
+            conn.commit()
+            print(f"{table}: {'compacted' if changed else 'already compacted'}")
+        print("Run VACUUM (or python3 maintenance.py run --tasks vacuum) to return the freed pages")
+    else:
+        for table in COMPACT_COLUMNS:
+            print(f"{table:<14}{'compacted' if storage_table(c, table) != table else 'plain'}")
+        c.execute('SELECT kind, COUNT(*) FROM dictionary GROUP BY kind ORDER BY kind')
+        for kind, count in c.fetchall():
+            print(f"  {kind}: {count} strings")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
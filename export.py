@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""Export tables from messages.db to JSONL, CSV or GeoJSON.
+
+Rows are streamed with fetchmany() and written as they arrive, so memory use
+is one batch however large the export is. A time range is first narrowed to
+an id range (binary search, see dbstats.first_id_since), so exporting the
+last day of a multi-GB table does not scan it.
+
+    python3 export.py telemetry telemetry.jsonl.gz --since 2024-08-01
+    python3 export.py positions positions.geojson --nodes '!a1b2c3d4'
+    python3 export.py messages - --format csv
+"""
+import argparse
+import csv
+import datetime
+import gzip
+import json
+import sys
+
+from dbstats import first_id_since
+from pragmas import connect
+from topology import node_num
+
+BATCH_SIZE = 1000
+FORMATS = ('jsonl', 'csv', 'geojson')
+
+# table -> columns the node filter applies to
+TABLES = {
+    'messages': ('sender', 'recipient'),
+    'telemetry': ('node_id',),
+    'positions': ('node_id',),
+    'environment': ('node_id',),
+    'neighbors': ('node_id', 'neighbor_node_id'),
+}
+# Tables that store node numbers as decimal text instead of '!a1b2c3d4'
+DECIMAL_NODE_TABLES = {'neighbors'}
+
+
+def build_query(c, table, nodes=None, since=None, until=None):
+    """Parameterized SELECT over table in id order, restricted to nodes and [since, until)."""
+    if table not in TABLES:
+        raise ValueError(f"Unknown table {table!r}, expected one of {', '.join(TABLES)}")
+    query = f'SELECT * FROM {table} WHERE 1 = 1'
+    params = []
+    if nodes:
+        if table in DECIMAL_NODE_TABLES:
+            nodes = [str(node_num(node)) for node in nodes]
+        placeholders = ', '.join('?' * len(nodes))
+        query += ' AND (' + ' OR '.join(f'{column} IN ({placeholders})' for column in TABLES[table]) + ')'
+        params.extend(list(nodes) * len(TABLES[table]))
+    if since is not None:
+        first = first_id_since(c, table, since)
+        # Nothing at or after since: keep the query, it just returns no rows
+        query += ' AND id >= ? AND timestamp >= ?'
+        params.extend((first if first is not None else sys.maxsize, since))
+    if until is not None:
+        first = first_id_since(c, table, until)
+        if first is not None:
+            query += ' AND id < ?'
+            params.append(first)
+        query += ' AND timestamp < ?'
+        params.append(until)
+    return query + ' ORDER BY id', params
+
+
+def stream_rows(table, nodes=None, since=None, until=None, batch_size=BATCH_SIZE, database_path='messages.db'):
+    """(column names, generator of row tuples); the connection closes when the generator is exhausted."""
+    conn = connect(database_path)
+    c = conn.cursor()
+    query, params = build_query(c, table, nodes, since, until)
+    c.execute(query, params)
+    columns = [description[0] for description in c.description]
+
+    def rows():
+        try:
+            while True:
+                batch = c.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield from batch
+        finally:
+            conn.close()
+
+    return columns, rows()
+
+
+def write_jsonl(columns, rows, f):
+    count = 0
+    for row in rows:
+        f.write(json.dumps(dict(zip(columns, row)), ensure_ascii=False) + '\n')
+        count += 1
+    return count
+
+
+def write_csv(columns, rows, f):
+    writer = csv.writer(f)
+    writer.writerow(columns)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_geojson(columns, rows, f):
+    """FeatureCollection of Points, one per row with latitude/longitude; the other columns become properties."""
+    f.write('{"type": "FeatureCollection", "features": [\n')
+    count = 0
+    for row in rows:
+        properties = dict(zip(columns, row))
+        latitude = properties.pop('latitude')
+        longitude = properties.pop('longitude')
+        if latitude is None or longitude is None:
+            continue
+        coordinates = [longitude, latitude]
+        if properties.get('altitude') is not None:
+            coordinates.append(properties['altitude'])
+        feature = {'type': 'Feature', 'geometry': {'type': 'Point', 'coordinates': coordinates}, 'properties': properties}
+        f.write((',\n' if count else '') + json.dumps(feature, ensure_ascii=False))
+        count += 1
+    f.write('\n]}\n')
+    return count
+
+
+WRITERS = {'jsonl': write_jsonl, 'csv': write_csv, 'geojson': write_geojson}
+
+
+def guess_format(path):
+    name = path[:-3] if path.endswith('.gz') else path
+    for extension, fmt in (('.jsonl', 'jsonl'), ('.ndjson', 'jsonl'), ('.csv', 'csv'), ('.geojson', 'geojson')):
+        if name.endswith(extension):
+            return fmt
+    return 'jsonl'
+
+
+def export(table, path, fmt=None, nodes=None, since=None, until=None, compress=None, batch_size=BATCH_SIZE,
+           database_path='messages.db'):
+    """Stream table to path ('-' for stdout) and return the number of rows written.
+
+    fmt and compress default from the file name (.csv/.geojson/.jsonl, .gz).
+    """
+    fmt = fmt or guess_format(path)
+    if fmt not in WRITERS:
+        raise ValueError(f"Unknown format {fmt!r}, expected one of {', '.join(FORMATS)}")
+    compress = path.endswith('.gz') if compress is None else compress
+    columns, rows = stream_rows(table, nodes, since, until, batch_size, database_path)
+    if fmt == 'geojson' and not {'latitude', 'longitude'} <= set(columns):
+        rows.close()
+        raise ValueError("GeoJSON export needs a table with latitude/longitude (positions)")
+    try:
+        if path == '-':
+            if compress:
+                with gzip.open(sys.stdout.buffer, 'wt', encoding='utf-8', newline='') as f:
+                    return WRITERS[fmt](columns, rows, f)
+            return WRITERS[fmt](columns, rows, sys.stdout)
+        opener = gzip.open if compress else open
+        with opener(path, 'wt', encoding='utf-8', newline='') as f:
+            return WRITERS[fmt](columns, rows, f)
+    finally:
+        rows.close()
+
+
+def _timestamp(value):
+    if not value:
+        return None
+    try:
+        return int(datetime.datetime.fromisoformat(value).timestamp())
+    except ValueError:
+        return int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export a table from messages.db without loading it into memory.")
+    parser.add_argument('table', choices=sorted(TABLES))
+    parser.add_argument('output', help="Output file ('-' for stdout); .gz compresses")
+    parser.add_argument('--format', choices=FORMATS, help="Default: from the file extension, else jsonl")
+    parser.add_argument('--nodes', nargs='+', help="Only rows from/to these nodes")
+    parser.add_argument('--since', help="Start (YYYY-MM-DD[ HH:MM], local time, or unix time)")
+    parser.add_argument('--until', help="End (YYYY-MM-DD[ HH:MM], local time, or unix time)")
+    parser.add_argument('--gzip', action='store_true', default=None, help="Compress even without a .gz name")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    args = parser.parse_args()
+
+    try:
+        count = export(args.table, args.output, args.format, args.nodes, _timestamp(args.since), _timestamp(args.until),
+                       args.gzip, args.batch_size, args.db)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f"Exported {count} rows from {args.table}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
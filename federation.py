@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""Query several gateways' messages.db files as one database.
+
+connect_federated() ATTACHes every gateway database read-only to an
+in-memory connection and creates TEMP views named like the tables
+(nodes, positions, neighbors, messages, ...), so existing queries run
+unchanged against the whole region. Nothing is copied; every query reads
+the gateway files directly.
+
+The same packet is usually stored by more than one gateway, so the views
+de-duplicate:
+- messages by message_id (the copy received first is kept),
+- nodes by user_id (the entry heard most recently wins),
+- positions by node and the node's own fix time (position.time),
+- links (per-gateway link stats) are merged by summing the SNR totals.
+Telemetry, environment, neighbors and traceroute are plain unions. Ids
+are only unique per gateway, so incremental readers that remember the last
+id (topology.py, coverage.py, battery.py) should keep using one database.
+
+    python3 federation.py gw-north/messages.db gw-south/messages.db
+"""
+import argparse
+import sqlite3
+
+# Views created over the attached gateways; the key picks one row out of copies of the same record
+# (None: keep every row), order decides which copy wins
+DEDUPLICATED = {
+    'messages': ('message_id', 'timestamp ASC'),
+    'nodes': ('user_id', 'last_heard DESC'),
+    'positions': ("node_id || ':' || time", 'timestamp ASC'),
+    'telemetry': (None, None),
+    'environment': (None, None),
+    'neighbors': (None, None),
+    'traceroute': (None, None),
+}
+
+
+def _columns(conn, schema, table):
+    return [row[1] for row in conn.execute(f'PRAGMA {schema}.table_info({table})').fetchall()]
+
+
+def _union(conn, schemas, table, columns):
+    """UNION ALL of table over the gateways that have it, with the gateway index and missing columns as NULL."""
+    parts = []
+    for index, schema in enumerate(schemas):
+        present = set(_columns(conn, schema, table))
+        if not present:
+            continue
+        select = ', '.join(column if column in present else f'NULL AS {column}' for column in columns)
+        parts.append(f'SELECT {index} AS gateway, {select} FROM {schema}.{table}')
+    return '\nUNION ALL\n'.join(parts)
+
+
+def connect_federated(database_paths):
+    """In-memory connection with database_paths attached as gw0, gw1, ... and the federated TEMP views."""
+    conn = sqlite3.connect(':memory:', uri=True)
+    limit = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    if len(database_paths) > limit:
+        conn.close()
+        raise ValueError(f"SQLite can attach at most {limit} databases, got {len(database_paths)}")
+    schemas = []
+    for index, path in enumerate(database_paths):
+        schema = f'gw{index}'
+        conn.execute(f'ATTACH DATABASE ? AS {schema}', (f'file:{path}?mode=ro',))
+        schemas.append(schema)
+
+    for table, (key, order) in DEDUPLICATED.items():
+        columns = next((_columns(conn, schema, table) for schema in schemas if _columns(conn, schema, table)), None)
+        if columns is None:
+            continue
+        union = _union(conn, schemas, table, columns)
+        select = ', '.join(columns)
+        if key is None:
+            conn.execute(f'CREATE TEMP VIEW {table} AS SELECT {select} FROM ({union})')
+            continue
+        # Rows without a key (e.g. positions without a fix time) are never merged
+        partition = f"COALESCE({key}, gateway || '#' || id)" if 'id' in columns else key
+        conn.execute(f'''CREATE TEMP VIEW {table} AS
+                         SELECT {select} FROM (
+                             SELECT *, ROW_NUMBER() OVER (PARTITION BY {partition} ORDER BY {order}) AS copy
+                             FROM ({union})
+                         ) WHERE copy = 1''')
+
+    _create_summary_views(conn, schemas)
+    return conn
+
+
+def _create_summary_views(conn, schemas):
+    # Latest position per node: each gateway answers from its (node_id, timestamp) index, then the newest wins
+    parts = [f'''SELECT node_id, latitude, longitude, altitude, MAX(timestamp) AS timestamp
+                 FROM {schema}.positions WHERE latitude IS NOT NULL GROUP BY node_id'''
+             for schema in schemas if _columns(conn, schema, 'positions')]
+    if parts:
+        conn.execute(f'''CREATE TEMP VIEW latest_positions AS
+                         SELECT node_id, latitude, longitude, altitude, MAX(timestamp) AS timestamp
+                         FROM ({' UNION ALL '.join(parts)}) GROUP BY node_id''')
+
+    # Link stats from every gateway's links table (see link_geometry.py)
+    parts = [f'SELECT * FROM {schema}.links' for schema in schemas if _columns(conn, schema, 'links')]
+    if parts:
+        conn.execute(f'''CREATE TEMP VIEW links AS
+                         SELECT node_id, neighbor_node_id, SUM(snr_sum) AS snr_sum, SUM(record_count) AS record_count,
+                                SUM(snr_sum) / SUM(record_count) AS average_snr, MIN(min_snr) AS min_snr,
+                                MAX(max_snr) AS max_snr, MAX(last_seen) AS last_seen, MAX(distance_m) AS distance_m,
+                                MAX(bearing) AS bearing
+                         FROM ({' UNION ALL '.join(parts)}) GROUP BY node_id, neighbor_node_id''')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize several gateway databases as one.")
+    parser.add_argument('databases', nargs='+', help="messages.db of each gateway")
+    args = parser.parse_args()
+
+    conn = connect_federated(args.databases)
+    for index, path in enumerate(args.databases):
+        nodes = conn.execute(f'SELECT COUNT(*) FROM gw{index}.nodes').fetchone()[0]
+        print(f"gw{index}: {path} ({nodes} nodes)")
+    for view in ('nodes', 'latest_positions', 'links', 'messages'):
+        try:
+            print(f"{view}: {conn.execute(f'SELECT COUNT(*) FROM {view}').fetchone()[0]} combined")
+        except sqlite3.OperationalError:
+            pass
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
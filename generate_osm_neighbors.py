@@ -1,14 +1,14 @@
 #!/usr/bin/env python3
-import sqlite3
 import folium
 from folium.plugins import MarkerCluster
 from datetime import datetime, timedelta
+from pragmas import connect
 
 # Define the cutoff for "active" nodes (last 1 day)
 active_cutoff = datetime.now() - timedelta(days=1)
 
 # Connect to the SQLite database
-conn = sqlite3.connect('messages.db')
+conn = connect('messages.db')
 cursor = conn.cursor()
 
 # Combined query to fetch nodes, neighbors, positions, and SNR details
@@ -0,0 +1,47 @@
+"""Distance and bearing helpers shared by the position, track and link code."""
+import math
+
+import numpy as np
+
+EARTH_RADIUS_M = 6371008.8
+
+
+def haversine_m(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters between two points (scalar version for per-packet use)."""
+    phi1 = math.radians(lat1)
+    phi2 = math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+def haversine_np(lat1, lon1, lat2, lon2):
+    """Great-circle distance in meters, element-wise over numpy arrays (or broadcastable scalars)."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * np.cos(phi2) * np.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.minimum(1.0, np.sqrt(a)))
+
+
+def bearing_np(lat1, lon1, lat2, lon2):
+    """Initial bearing in degrees (0-360, clockwise from north), element-wise over numpy arrays."""
+    phi1 = np.radians(lat1)
+    phi2 = np.radians(lat2)
+    dlambda = np.radians(np.asarray(lon2) - np.asarray(lon1))
+    x = np.sin(dlambda) * np.cos(phi2)
+    y = np.cos(phi1) * np.sin(phi2) - np.sin(phi1) * np.cos(phi2) * np.cos(dlambda)
+    return (np.degrees(np.arctan2(x, y)) + 360.0) % 360.0
+
+
+def project_m(lat, lon, lat0=None):
+    """Project coordinates to a local equirectangular plane in meters (good enough over a few hundred km)."""
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    if lat0 is None:
+        lat0 = float(np.mean(lat)) if lat.size else 0.0
+    x = np.radians(lon) * EARTH_RADIUS_M * math.cos(math.radians(lat0))
+    y = np.radians(lat) * EARTH_RADIUS_M
+    return x, y
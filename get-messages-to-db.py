@@ -5,9 +5,12 @@ from pubsub import pub
 import time as time_module
 import sqlite3
 
+import inbox
+from pragmas import connect
+
 # Initialize the database
 def initialize_db():
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     # Create necessary tables
     c.execute('''CREATE TABLE IF NOT EXISTS messages (
@@ -72,12 +75,13 @@ def initialize_db():
                     routes TEXT,
                     timestamp INTEGER
                 )''')
+    inbox.initialize_inbox(c)
     conn.commit()
     conn.close()
 
 # Store functions
 def store_message(message_id, sender, recipient, message, timestamp, channel):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     try:
         c.execute('''INSERT INTO messages (message_id, sender, recipient, message, timestamp, channel) VALUES (?, ?, ?, ?, ?, ?)''', 
@@ -88,7 +92,7 @@ def store_message(message_id, sender, recipient, message, timestamp, channel):
     conn.close()
 
 def store_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO telemetry (node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp)
                  VALUES (?, ?, ?, ?, ?, ?, ?)''', 
@@ -97,7 +101,7 @@ def store_telemetry(node_id, battery_level, voltage, channel_utilization, air_ut
     conn.close()
 
 def store_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO positions (node_id, latitude, longitude, altitude, time, sats_in_view, timestamp)
                  VALUES (?, ?, ?, ?, ?, ?, ?)''', 
@@ -106,7 +110,7 @@ def store_position(node_id, latitude, longitude, altitude, time, sats_in_view, t
     conn.close()
 
 def store_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO environment (node_id, temperature, humidity, bar, iaq, timestamp)
                  VALUES (?, ?, ?, ?, ?, ?)''', 
@@ -115,7 +119,7 @@ def store_environment(node_id, temperature, relative_humidity, barometric_pressu
     conn.close()
 
 def store_traceroute(from_node, to_node, hops, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     hop_id = 0
     for hop in hops:
@@ -129,7 +133,7 @@ def store_traceroute(from_node, to_node, hops, timestamp):
     conn.close()
 
 def store_routing(from_node, to_node, routes, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO routing (from_node, to_node, routes, timestamp)
                  VALUES (?, ?, ?, ?)''', 
@@ -141,7 +145,7 @@ def upsert_node(node_id, short_name, long_name, hw_model, last_heard):
     if node_id is None:
         print(f"Skipping upsert for node with None node_id: {short_name}, {long_name}, {hw_model}, {last_heard}")
         return
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO nodes (node_id, short_name, long_name, hw_model, last_heard)
                  VALUES (?, ?, ?, ?, ?)
@@ -290,20 +294,15 @@ def on_receive(packet, interface):
 
 # Mark message as read
 def mark_message_as_read(message_id):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('UPDATE messages SET read = 1 WHERE message_id = ?', (message_id,))
-    conn.commit()
-    conn.close()
+    inbox.mark_read(message_ids=[message_id])
 
-# Get unread messages
-def get_unread_messages():
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('SELECT * FROM messages WHERE read = 0')
-    messages = c.fetchall()
-    conn.close()
-    return messages
+# Mark many messages as read in one transaction
+def mark_messages_as_read(message_ids):
+    return inbox.mark_read(message_ids=message_ids)
+
+# Get unread messages (rows in table column order), read page by page through the unread index
+def get_unread_messages(recipient=None):
+    return [tuple(message[column] for column in inbox.COLUMNS) for message in inbox.iter_unread(recipient)]
 
 def print_meshtastic_banner():
     banner = """
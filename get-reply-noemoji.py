@@ -14,6 +14,7 @@ import sqlite3
 import logging
 import serial.tools.list_ports
 import codecs
+from pragmas import connect
 
 # Set up logging configuration
 logging.basicConfig(
@@ -34,7 +35,7 @@ logger = logging.getLogger(__name__)
 
 # Initialize the database
 def initialize_db():
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     # Create necessary tables
     c.execute('''CREATE TABLE IF NOT EXISTS messages (
@@ -160,7 +161,7 @@ def initialize_db():
 
 # Store functions (from the second script)
 def store_message(message_id, sender, recipient, message, timestamp, channel):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     try:
         c.execute('''INSERT INTO messages (message_id, sender, recipient, message, timestamp, channel) VALUES (?, ?, ?, ?, ?, ?)''', 
@@ -171,7 +172,7 @@ def store_message(message_id, sender, recipient, message, timestamp, channel):
     conn.close()
 
 def store_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO telemetry (node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp)
                  VALUES (?, ?, ?, ?, ?, ?, ?)''', 
@@ -181,7 +182,7 @@ def store_telemetry(node_id, battery_level, voltage, channel_utilization, air_ut
     logger.info(f"Stored telemetry data for node {node_id}.")
 
 def store_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO positions (node_id, latitude, longitude, altitude, time, sats_in_view, timestamp)
                  VALUES (?, ?, ?, ?, ?, ?, ?)''', 
@@ -191,7 +192,7 @@ def store_position(node_id, latitude, longitude, altitude, time, sats_in_view, t
     logger.info(f"Stored position data for node {node_id}.")
 
 def store_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO environment (node_id, temperature, humidity, bar, iaq, timestamp)
                  VALUES (?, ?, ?, ?, ?, ?)''', 
@@ -201,7 +202,7 @@ def store_environment(node_id, temperature, relative_humidity, barometric_pressu
     logger.info(f"Stored environmental data for node {node_id}.")
 
 def store_traceroute(from_node, to_node, hops, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     hop_id = 0
     for hop in hops:
@@ -216,7 +217,7 @@ def store_traceroute(from_node, to_node, hops, timestamp):
     logger.info(f"Stored traceroute data from {from_node} to {to_node}.")
 
 def store_routing(from_node, to_node, routes, timestamp):
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO routing (from_node, to_node, routes, timestamp)
                  VALUES (?, ?, ?, ?)''', 
@@ -238,7 +239,7 @@ def upsert_node(user_id, node_number, short_name, long_name, hw_model, last_hear
         logger.warning(f"Skipping upsert for node {user_id} because node_number is None or empty.")
         return
     
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     try:
         c.execute('''INSERT INTO nodes (user_id, node_number, short_name, long_name, hw_model, last_heard)
@@ -257,7 +258,7 @@ def upsert_node(user_id, node_number, short_name, long_name, hw_model, last_hear
 
 def store_neighbors(node_id, neighbor_node_id, snr, timestamp):
     """Store neighbor information in the database."""
-    conn = sqlite3.connect('messages.db')
+    conn = connect('messages.db')
     c = conn.cursor()
     c.execute('''INSERT INTO neighbors (node_id, neighbor_node_id, snr, timestamp)
                  VALUES (?, ?, ?, ?)''',
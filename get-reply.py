@@ -9,12 +9,24 @@ from meshtastic import BROADCAST_ADDR
 #from meshtastic.protobufs.config_pb2 import LoRaConfig
 from meshtastic.protobuf import mesh_pb2, portnums_pb2, config_pb2
 from pubsub import pub
+import threading
 import time as time_module
 import datetime
 from google.protobuf.json_format import MessageToDict
-import sqlite3
 import logging
 import serial.tools.list_ports
+from meshdb import (initialize_db, store_message, store_traceroute, store_routing, upsert_node, store_neighbors,
+                    sync_nodedb, store_raw_packet, store_events, filter_telemetry, filter_environment, filter_position,
+                    write_telemetry, write_environment, write_position)
+from link_geometry import refresh_links
+from outbound import OutboundQueue
+from alerts import AlertEngine, LogSink, WebhookSink, MeshSink
+from presence import PresenceTracker
+from archive import archive_closed_partitions
+from spool import Spool
+from maintenance import MaintenanceScheduler
+from mqtt_ingest import MqttSource, PacketDeduper
+import meshdb
 
 # Set up logging configuration
 logging.basicConfig(
@@ -34,92 +46,90 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-# Initialize the database
-def initialize_db():
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    # Create necessary tables
-    c.execute('''CREATE TABLE IF NOT EXISTS messages (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    message_id INTEGER UNIQUE,
-                    sender TEXT,
-                    recipient TEXT,
-                    message TEXT,
-                    timestamp INTEGER,
-                    channel INTEGER,
-                    read INTEGER DEFAULT 0
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS telemetry (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    node_id TEXT,
-                    battery_level INTEGER,
-                    voltage REAL,
-                    channel_utilization REAL,
-                    air_util_tx REAL,
-                    uptime_seconds INTEGER,
-                    timestamp INTEGER
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS nodes (
-                    user_id TEXT PRIMARY KEY,
-                    node_number TEXT,
-                    short_name TEXT,
-                    long_name TEXT,
-                    hw_model TEXT,
-                    last_heard INTEGER
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS positions (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    node_id TEXT,
-                    latitude REAL,
-                    longitude REAL,
-                    altitude REAL,
-                    time INTEGER,
-                    sats_in_view INTEGER,
-                    timestamp INTEGER
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS environment (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    node_id TEXT,
-                    temperature REAL,
-                    humidity REAL,
-                    bar REAL,
-                    iaq REAL,
-                    timestamp INTEGER
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS traceroute (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_node TEXT,
-                    to_node TEXT,
-                    hop_id INTEGER,
-                    hop_node TEXT,
-                    hop_snr REAL,
-                    timestamp INTEGER
-                )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS neighbors (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                node_id TEXT,
-                neighbor_node_id TEXT,
-                snr REAL,
-                timestamp INTEGER
-            )''')
-    c.execute('''CREATE TABLE IF NOT EXISTS routing (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    from_node TEXT,
-                    to_node TEXT,
-                    routes TEXT,
-                    timestamp INTEGER
-                )''')
-    # Index the database for faster lookups
-    # Create indexes to optimize query performance
-    c.execute('''CREATE INDEX IF NOT EXISTS idx_positions_node_id_timestamp ON positions(node_id, timestamp);''')
-    c.execute('''CREATE INDEX IF NOT EXISTS idx_neighbors_node_id_neighbor_node_id ON neighbors(node_id, neighbor_node_id);''')
-    c.execute('''CREATE INDEX IF NOT EXISTS idx_neighbors_timestamp ON neighbors(timestamp);''')
-    c.execute('''CREATE INDEX IF NOT EXISTS idx_nodes_node_number ON nodes(node_number);''')
-    c.execute('''CREATE INDEX IF NOT EXISTS idx_positions_node_id ON positions(node_id);''')
-
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized successfully.")
+# How often the radio's NodeDB snapshot is re-synced into the database (seconds)
+NODEDB_SYNC_INTERVAL = 15 * 60
+# How often link distances and SNR stats are brought up to date (seconds)
+LINK_REFRESH_INTERVAL = 60
+
+# Also keep the original protobuf of every packet in raw_packets (see raw_packets.py)
+STORE_RAW_PACKETS = False
+
+# Move closed months of telemetry/environment/positions/neighbors to Parquet files and delete
+# them from the database (see archive.py, needs pyarrow)
+ARCHIVE_COLD_DATA = False
+# How often to look for months to archive (seconds)
+ARCHIVE_INTERVAL = 24 * 60 * 60
+
+# Also ingest what other gateways uplink to this MQTT broker (see mqtt_ingest.py, needs paho-mqtt)
+MQTT_BROKER = None
+MQTT_PORT = 1883
+MQTT_USERNAME = None
+MQTT_PASSWORD = None
+MQTT_TOPICS = ['msh/EU_868/#']
+# Channel name -> base64 PSK of encrypted channels seen on MQTT (the default key "AQ==" is always tried)
+MQTT_CHANNEL_KEYS = {'LongFast': 'AQ=='}
+
+# Alert rules, evaluated on every packet (see alerts.py)
+ALERT_RULES = [
+    {'name': 'Low battery', 'metric': 'battery_level', 'below': 15},
+    {'name': 'Low voltage', 'metric': 'voltage', 'below': 3.4},
+    {'name': 'Weak link', 'metric': 'link_snr', 'below': -15},
+    {'name': 'Node offline', 'offline_after': 6 * 60 * 60},
+]
+# Also POST alerts to this URL as JSON
+ALERT_WEBHOOK_URL = None
+# Also send alerts as a direct message to this node id (e.g. '!a1b2c3d4')
+ALERT_DM_DESTINATION = None
+
+# Messages the script sends on its own, sent from the main loop at a limited rate
+outbound = OutboundQueue()
+
+alert_sinks = {'log': LogSink()}
+if ALERT_WEBHOOK_URL:
+    alert_sinks['webhook'] = WebhookSink(ALERT_WEBHOOK_URL)
+if ALERT_DM_DESTINATION:
+    alert_sinks['mesh'] = MeshSink(outbound, ALERT_DM_DESTINATION)
+alert_engine = AlertEngine(ALERT_RULES, alert_sinks)
+
+# Last heard / SNR / hops of every node, shared with webmap.py through presence.bin (see presence.py)
+presence = PresenceTracker()
+
+# The same packet arrives from the radio and from every MQTT gateway that heard it
+seen_packets = PacketDeduper()
+
+# on_receive only appends what it stores to the spool; its drain thread writes it to messages.db and
+# retries while the database is locked (see spool.py).
+spool = Spool({store.__name__: store for store in (store_message, store_traceroute, store_routing, upsert_node,
+                                                   store_neighbors, store_raw_packet, store_events, write_telemetry,
+                                                   write_environment, write_position)})
+
+
+# The dead-band filters and anomaly detectors keep per-node state, so they run here, once per sample;
+# only the writes are spooled, which the drain thread may retry.
+def spool_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp):
+    events, samples = filter_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx,
+                                       uptime_seconds, timestamp)
+    if events:
+        spool.put('store_events', events)
+    if samples:
+        spool.put('write_telemetry', node_id, samples)
+
+
+def spool_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp):
+    events, samples = filter_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp)
+    if events:
+        spool.put('store_events', events)
+    if samples:
+        spool.put('write_environment', node_id, samples)
+
+
+def spool_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp):
+    if filter_position(node_id, latitude, longitude, timestamp):
+        spool.put('write_position', node_id, latitude, longitude, altitude, time, sats_in_view, timestamp)
+
+# WAL checkpoints, ANALYZE and incremental vacuum of messages.db when no packets are coming in
+# (see maintenance.py). Set to None to turn maintenance off.
+maintenance = MaintenanceScheduler()
 
 # Connection setup function (temporary removed - NEED TO FIX)
 # def get_interface(interface_type='serial', port=None, hostname=None):
@@ -168,115 +178,6 @@ def initialize_db():
 #             time_module.sleep(5)
 
 
-# Store functions (from the second script)
-def store_message(message_id, sender, recipient, message, timestamp, channel):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    try:
-        c.execute('''INSERT INTO messages (message_id, sender, recipient, message, timestamp, channel) VALUES (?, ?, ?, ?, ?, ?)''', 
-                  (message_id, sender, recipient, message, timestamp, channel))
-        conn.commit()
-    except sqlite3.IntegrityError:
-        logger.warning(f"Duplicate message with ID {message_id} detected. Ignoring...")
-    conn.close()
-
-def store_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO telemetry (node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''', 
-              (node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp))
-    conn.commit()
-    conn.close()
-    logger.info(f"Stored telemetry data for node {node_id}.")
-
-def store_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO positions (node_id, latitude, longitude, altitude, time, sats_in_view, timestamp)
-                 VALUES (?, ?, ?, ?, ?, ?, ?)''', 
-              (node_id, latitude, longitude, altitude, time, sats_in_view, timestamp))
-    conn.commit()
-    conn.close()
-    logger.info(f"Stored position data for node {node_id}.")
-
-def store_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO environment (node_id, temperature, humidity, bar, iaq, timestamp)
-                 VALUES (?, ?, ?, ?, ?, ?)''', 
-              (node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp))
-    conn.commit()
-    conn.close()
-    logger.info(f"Stored environmental data for node {node_id}.")
-
-def store_traceroute(from_node, to_node, hops, timestamp):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    hop_id = 0
-    for hop in hops:
-        hop_id += 1
-        hop_node = hop.get('nodeId')
-        hop_snr = hop.get('snr')
-        c.execute('''INSERT INTO traceroute (from_node, to_node, hop_id, hop_node, hop_snr, timestamp)
-                     VALUES (?, ?, ?, ?, ?, ?)''', 
-                  (from_node, to_node, hop_id, hop_node, hop_snr, timestamp))
-    conn.commit()
-    conn.close()
-    logger.info(f"Stored traceroute data from {from_node} to {to_node}.")
-
-def store_routing(from_node, to_node, routes, timestamp):
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO routing (from_node, to_node, routes, timestamp)
-                 VALUES (?, ?, ?, ?)''', 
-              (from_node, to_node, routes, timestamp))
-    conn.commit()
-    conn.close()
-    logger.info(f"Stored routing data from {from_node} to {to_node}.")
-
-def upsert_node(user_id, node_number, short_name, long_name, hw_model, last_heard):
-    if user_id is None:
-        logger.warning(f"Skipping upsert for node with None user_id: {short_name}, {long_name}, {hw_model}, {last_heard}")
-        return
-    
-    # Log the values being upserted
-    logger.info(f"Upserting node: user_id={user_id}, node_number={node_number}, short_name={short_name}, long_name={long_name}, hw_model={hw_model}, last_heard={last_heard}")
-    
-    # Ensure node_number is not None or an empty string
-    if node_number is None or node_number == '':
-        logger.warning(f"Skipping upsert for node {user_id} because node_number is None or empty.")
-        return
-    
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    try:
-        c.execute('''INSERT INTO nodes (user_id, node_number, short_name, long_name, hw_model, last_heard)
-                     VALUES (?, ?, ?, ?, ?, ?)
-                     ON CONFLICT(user_id) DO UPDATE SET
-                     node_number=excluded.node_number, short_name=excluded.short_name,
-                     long_name=excluded.long_name, hw_model=excluded.hw_model,
-                     last_heard=excluded.last_heard''',
-                  (user_id, node_number, short_name, long_name, hw_model, last_heard))
-        conn.commit()
-    except Exception as e:
-        logger.error(f"Error upserting node {user_id}: {e}")
-    finally:
-        conn.close()
-    logger.info(f"Upserted node information for {short_name} ({user_id} #{node_number}).")
-
-
-def store_neighbors(node_id, neighbor_node_id, snr, timestamp):
-    """Store neighbor information in the database."""
-    conn = sqlite3.connect('messages.db')
-    c = conn.cursor()
-    c.execute('''INSERT INTO neighbors (node_id, neighbor_node_id, snr, timestamp)
-                 VALUES (?, ?, ?, ?)''',
-              (node_id, neighbor_node_id, snr, timestamp))
-    conn.commit()
-    conn.close()
-    logger.info(f"Stored neighbor information: {node_id} -> {neighbor_node_id} with SNR {snr}.")
-
 # Function to send a message (from the first script)
 def send_message(interface, fromId, text, channel, toId):
     """Function to send a message to a specific node or channel."""
@@ -316,15 +217,39 @@ def on_response_trace_route(p):
     routeStr += " --> " + f'{p["from"]:08x}'
     logger.info(f"Route traced: {routeStr}")
 
-# on_receive function (merged from both scripts)
+# The radio's reader thread and the MQTT worker both deliver packets. The deduper, the dead-band and
+# position filters and the anomaly detectors keep per-node state without locks of their own, so
+# packets are handled one at a time.
+receive_lock = threading.Lock()
+
 def on_receive(packet, interface):
     """Callback function to handle received messages."""
+    with receive_lock:
+        handle_packet(packet, interface)
+
+# handle_packet function (merged from both scripts)
+def handle_packet(packet, interface):
+    """Store, forward and answer one received packet; only called with receive_lock held."""
     timestamp = int(time_module.time())
 
+    if not seen_packets.first(packet, timestamp):
+        logger.debug(f"Duplicate packet {packet.get('id')} from {packet.get('fromId')} ignored")
+        return
+    if maintenance is not None:
+        maintenance.activity(timestamp)
+
     # Initialize node_number variables to None
     from_node_number = None
     to_node_number = None
 
+    if STORE_RAW_PACKETS and 'raw' in packet:
+        raw = packet['raw']
+        portnum_value = raw.decoded.portnum if raw.HasField('decoded') else None
+        try:
+            spool.put('store_raw_packet', packet.get('from'), portnum_value, packet.get('rxTime') or timestamp, raw.SerializeToString())
+        except Exception as e:
+            logger.error(f"Error storing raw packet {packet.get('id')}: {e}")
+
     if 'decoded' in packet:
         portnum = packet['decoded'].get('portnum')
         text = packet['decoded'].get('text')
@@ -340,8 +265,11 @@ def on_receive(packet, interface):
         rx_snr = packet.get('rxSnr', None)  # Signal-to-Noise Ratio
         rx_rssi = packet.get('rxRssi', None)  # Received Signal Strength Indicator
 
+        alert_engine.heard(from_node_number, timestamp)
+
         # Calculate hops away
         hops_away = hop_start - hop_limit
+        presence.update(from_node_number, timestamp, rx_snr, hops_away if hop_start else None, rx_rssi)
 
         # Convert rx_time to human-readable format
         rx_time_human = datetime.datetime.fromtimestamp(rx_time).strftime("%Y-%m-%d %H:%M:%S")
@@ -361,14 +289,14 @@ def on_receive(packet, interface):
 
         # Upsert node information if available
         if from_node_number is not None:
-            upsert_node(fromId, from_node_number, from_short_name, from_long_name, from_hw_model, from_last_heard)
+            spool.put('upsert_node', fromId, from_node_number, from_short_name, from_long_name, from_hw_model, from_last_heard)
         if to_node_number is not None:
-            upsert_node(toId, to_node_number, to_short_name, to_long_name, to_hw_model, to_last_heard)
+            spool.put('upsert_node', toId, to_node_number, to_short_name, to_long_name, to_hw_model, to_last_heard)
 
         # Handle different message types
         if portnum == 'TEXT_MESSAGE_APP' and text:
             logger.info(f"✉️  Plain text message received from {from_short_name} ({fromId}) to {to_short_name} ({toId}) on channel {channel}: {text}")
-            store_message(message_id, fromId, toId, text, timestamp, channel)
+            spool.put('store_message', message_id, fromId, toId, text, timestamp, channel)
 
             # Respond to specific messages
             if text == 'Ping':
@@ -407,7 +335,9 @@ def on_receive(packet, interface):
             uptime_seconds = telemetry.get('deviceMetrics', {}).get('uptimeSeconds', None)
             
             logger.info(f"📊 Telemetry data received from {from_short_name} ({fromId}): battery_level={battery_level}, voltage={voltage}, channel_utilization={channel_utilization}, air_util_tx={air_util_tx}, uptime_seconds={uptime_seconds}")
-            store_telemetry(fromId, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp)
+            spool_telemetry(fromId, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp)
+            alert_engine.observe(from_node_number, {'battery_level': battery_level, 'voltage': voltage,
+                                                    'channel_utilization': channel_utilization, 'air_util_tx': air_util_tx}, timestamp)
             # Check if environmental data is present in telemetry
             environment_metrics = telemetry.get('environmentMetrics', {})
             if environment_metrics:
@@ -417,7 +347,9 @@ def on_receive(packet, interface):
                 iaq = environment_metrics.get('iaq', None)  # Assuming IAQ (Indoor Air Quality) might be included
 
                 logger.info(f"🌲 Environment data found in telemetry from {from_short_name} ({fromId}): temperature={temperature}, relative_humidity={relative_humidity}, barometric_pressure={barometric_pressure}, iaq={iaq}")
-                store_environment(fromId, temperature, relative_humidity, barometric_pressure, iaq, timestamp)
+                spool_environment(fromId, temperature, relative_humidity, barometric_pressure, iaq, timestamp)
+                alert_engine.observe(from_node_number, {'temperature': temperature, 'humidity': relative_humidity,
+                                                        'bar': barometric_pressure, 'iaq': iaq}, timestamp)
 
         elif portnum == 'POSITION_APP':
             position = packet['decoded'].get('position', {})
@@ -428,7 +360,7 @@ def on_receive(packet, interface):
             sats_in_view = position.get('satsInView', None)
             
             logger.info(f"📌 Position data received from {from_short_name} ({fromId}): latitude={latitude}, longitude={longitude}, altitude={altitude}, time={time}, sats_in_view={sats_in_view}")
-            store_position(fromId, latitude, longitude, altitude, time, sats_in_view, timestamp)
+            spool_position(fromId, latitude, longitude, altitude, time, sats_in_view, timestamp)
 
         elif portnum == 'ENVIRONMENTAL_MEASUREMENT_APP':
             environment = packet['decoded'].get('environment', {})
@@ -438,7 +370,7 @@ def on_receive(packet, interface):
             iaq = environment.get('iaq', None)
 
             logger.info(f"🌲 Environment data received from {from_short_name} ({fromId}): temperature={temperature}, humidity={humidity}, bar={bar}, iaq={iaq}")
-            store_environment(fromId, temperature, humidity, bar, iaq, timestamp)
+            spool_environment(fromId, temperature, humidity, bar, iaq, timestamp)
 
         elif portnum == 'NODEINFO_APP':
             node_info = packet['decoded'].get('user', {})
@@ -456,17 +388,17 @@ def on_receive(packet, interface):
             uptime_seconds = device_metrics.get('uptimeSeconds', None)
             
             logger.info(f"🕸️ Node info received from {from_short_name} ({fromId}): long_name={long_name}, short_name={short_name}, hw_model={hw_model}, snr={snr}, last_heard={last_heard}, battery_level={battery_level}, voltage={voltage}, channel_utilization={channel_utilization}, air_util_tx={air_util_tx}, uptime_seconds={uptime_seconds}")
-            upsert_node(fromId, number, short_name, long_name, hw_model, last_heard)
+            spool.put('upsert_node', fromId, number, short_name, long_name, hw_model, last_heard)
 
         elif portnum == 'TRACEROUTE_APP':
             hops = packet['decoded'].get('hops', [])
             logger.info(f"🧭 Traceroute data received from {from_short_name} ({fromId}) to {to_short_name} ({toId}): hops={hops}")
-            store_traceroute(fromId, toId, hops, timestamp)
+            spool.put('store_traceroute', fromId, toId, hops, timestamp)
 
         elif portnum == 'ROUTING_APP':
             routes = packet['decoded'].get('routes', [])
             logger.info(f"🚏 Routing data received from {from_short_name} ({fromId}) to {to_short_name} ({toId}): routes={routes}")
-            store_routing(fromId, toId, str(routes), timestamp)
+            spool.put('store_routing', fromId, toId, str(routes), timestamp)
 
         elif portnum == 'NEIGHBORINFO_APP':
             neighbor_info = packet['decoded'].get('neighborinfo', {})
@@ -477,7 +409,8 @@ def on_receive(packet, interface):
             for neighbor in neighbors:
                 neighbor_node_number = neighbor.get('nodeId')
                 snr = neighbor.get('snr')
-                store_neighbors(node_id, neighbor_node_number, snr, timestamp)
+                spool.put('store_neighbors', node_id, neighbor_node_number, snr, timestamp)
+                alert_engine.observe_link(node_id, neighbor_node_number, snr, timestamp)
                 logger.info(f"🏘️ Stored neighbor info: {node_id} has neighbor {neighbor_node_number} with SNR {snr}")
 
     elif 'encrypted' in packet:
@@ -489,6 +422,9 @@ def on_receive(packet, interface):
         to_node_number = packet.get('to', None)  # Destination Node number from the packet, default to None
         channel = packet.get('channel', 0)  # Default to 0 if channel is not found
 
+        alert_engine.heard(from_node_number, timestamp)
+        presence.update(from_node_number, timestamp, packet.get('rxSnr'), None, packet.get('rxRssi'))
+
         from_node_info = interface.nodes.get(fromId, {})
         from_short_name = from_node_info.get('user', {}).get('shortName', '')
         from_long_name = from_node_info.get('user', {}).get('longName', '')
@@ -501,12 +437,12 @@ def on_receive(packet, interface):
         to_last_heard = to_node_info.get('lastHeard', 0)
         
         if from_node_number is not None:
-            upsert_node(fromId, from_node_number, from_short_name, from_long_name, from_hw_model, from_last_heard)
+            spool.put('upsert_node', fromId, from_node_number, from_short_name, from_long_name, from_hw_model, from_last_heard)
         if to_node_number is not None:
-            upsert_node(toId, to_node_number, to_short_name, to_long_name, to_hw_model, to_last_heard)
+            spool.put('upsert_node', toId, to_node_number, to_short_name, to_long_name, to_hw_model, to_last_heard)
 
         logger.info(f"📧 Encrypted message received from {from_short_name} ({fromId}) to {to_short_name} ({toId}) on channel {channel}: {encrypted_text}")
-        store_message(message_id, fromId, toId, encrypted_text, timestamp, channel)
+        spool.put('store_message', message_id, fromId, toId, encrypted_text, timestamp, channel)
 
     else:
         logger.error(f"🚨 Unknown message format: {packet}")
@@ -526,6 +462,8 @@ def print_meshtastic_banner():
 def main():
     # Initialize the database
     initialize_db()
+    # Apply what the last run left in the spool, then keep draining
+    spool.start()
     # INFO: Using the serial interface for now NEED TO FIX
     # PROBLEMS REPORTED WITH CONNECTION!!!! RETURNING BACK TO SERIAL
     # Initialize the serial interface
@@ -533,6 +471,24 @@ def main():
 
     # Subscribe to messages
     pub.subscribe(on_receive, "meshtastic.receive")
+
+    # Load the radio's NodeDB so the map is complete right after a restart
+    sync_nodedb(interface.nodes)
+    last_nodedb_sync = time_module.time()
+    last_link_refresh = 0
+    last_archive = 0
+
+    # Packets uplinked to MQTT go through the same on_receive, with the MQTT source as the interface
+    mqtt_source = None
+    if MQTT_BROKER:
+        mqtt_source = MqttSource(lambda packet: on_receive(packet, mqtt_source), MQTT_CHANNEL_KEYS)
+        mqtt_source.connect(MQTT_BROKER, MQTT_PORT, MQTT_TOPICS, MQTT_USERNAME, MQTT_PASSWORD)
+
+    # Start the offline timers and presence from when the radio last heard each node
+    for n in (interface.nodes or {}).values():
+        if n.get('num') is not None and n.get('lastHeard'):
+            alert_engine.heard(n['num'], n['lastHeard'])
+            presence.update(n['num'], n['lastHeard'], n.get('snr'), n.get('hopsAway'))
     
     if interface.nodes:
         for n in interface.nodes.values():
@@ -567,8 +523,45 @@ def main():
         while True:
             # Keep the script running to listen for messages
             time_module.sleep(1)
+
+            # Periodically re-sync the nodes of the NodeDB snapshot
+            if time_module.time() - last_nodedb_sync >= NODEDB_SYNC_INTERVAL:
+                sync_nodedb(interface.nodes, bootstrap=False)
+                last_nodedb_sync = time_module.time()
+
+            # Fold new neighbor reports and positions into the links table
+            if time_module.time() - last_link_refresh >= LINK_REFRESH_INTERVAL:
+                try:
+                    refresh_links()
+                except Exception as e:
+                    logger.error(f"Error refreshing links: {e}")
+                last_link_refresh = time_module.time()
+
+            # Archive old rows so the tables the ingest writes to stay small
+            if ARCHIVE_COLD_DATA and time_module.time() - last_archive >= ARCHIVE_INTERVAL:
+                try:
+                    archive_closed_partitions()
+                except Exception as e:
+                    logger.error(f"Error archiving old rows: {e}")
+                last_archive = time_module.time()
+
+            # Retry change feed records a failed write (disk full) left in memory
+            if meshdb.change_feed is not None:
+                meshdb.change_feed.flush()
+
+            # Checkpoint / analyze / vacuum when due and the mesh is quiet
+            if maintenance is not None:
+                maintenance.tick()
+
+            # Offline alerts and queued outgoing messages
+            alert_engine.tick()
+            outbound.drain(lambda text, destination, channel_index: interface.sendText(
+                text, destinationId=destination, wantAck=True, channelIndex=channel_index))
     except KeyboardInterrupt:
         print("Stopping message listener...")
+        if mqtt_source is not None:
+            mqtt_source.close()
+        spool.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,103 @@
+"""Unread-message inbox for bots and UIs built on messages.db.
+
+Unread rows are found through partial indexes that only contain rows with
+read = 0, so they stay small however many messages have been read. Readers
+page through the inbox by id (keyset), and marking messages read is one
+transaction per call, whether by a list of ids or everything up to an id.
+
+    for message in iter_unread(recipient='!a1b2c3d4'):
+        handle(message)
+    mark_read(up_to_id=message['id'], recipient='!a1b2c3d4')
+"""
+from pragmas import connect
+
+PAGE_SIZE = 500
+# Ids per UPDATE ... IN (...) statement, below SQLite's bound-variable limit
+CHUNK_SIZE = 500
+
+COLUMNS = ('id', 'message_id', 'sender', 'recipient', 'message', 'timestamp', 'channel', 'read')
+
+
+def initialize_inbox(c):
+    """Partial indexes over unread messages plus the unread_by_recipient view."""
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_unread ON messages(id) WHERE read = 0;''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_unread_recipient ON messages(recipient, id) WHERE read = 0;''')
+    c.execute('''CREATE VIEW IF NOT EXISTS unread_by_recipient AS
+                    SELECT recipient, COUNT(*) AS unread, MIN(id) AS oldest_id, MAX(id) AS newest_id,
+                           MAX(timestamp) AS newest_timestamp
+                    FROM messages WHERE read = 0 GROUP BY recipient''')
+
+
+def iter_unread(recipient=None, after_id=0, page_size=PAGE_SIZE, database_path='messages.db'):
+    """Yield unread messages as dicts, oldest first, reading page_size rows at a time.
+
+    The connection is only held while a page is read, so messages can be
+    marked read (or stored) between pages.
+    """
+    query = f"SELECT {', '.join(COLUMNS)} FROM messages WHERE read = 0 AND id > ?"
+    if recipient is not None:
+        query += ' AND recipient = ?'
+    query += ' ORDER BY id LIMIT ?'
+    while True:
+        params = [after_id] + ([recipient] if recipient is not None else []) + [page_size]
+        conn = connect(database_path)
+        rows = conn.execute(query, params).fetchall()
+        conn.close()
+        for row in rows:
+            yield dict(zip(COLUMNS, row))
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1][0]
+
+
+def get_unread_messages(recipient=None, limit=None, database_path='messages.db'):
+    """List of unread messages (dicts), oldest first; limit caps how many are loaded."""
+    messages = []
+    for message in iter_unread(recipient, page_size=min(limit or PAGE_SIZE, PAGE_SIZE), database_path=database_path):
+        messages.append(message)
+        if limit is not None and len(messages) >= limit:
+            break
+    return messages
+
+
+def unread_counts(database_path='messages.db'):
+    """{recipient: {'unread', 'oldest_id', 'newest_id', 'newest_timestamp'}} from unread_by_recipient."""
+    conn = connect(database_path)
+    rows = conn.execute('SELECT recipient, unread, oldest_id, newest_id, newest_timestamp FROM unread_by_recipient').fetchall()
+    conn.close()
+    return {recipient: {'unread': unread, 'oldest_id': oldest, 'newest_id': newest, 'newest_timestamp': newest_timestamp}
+            for recipient, unread, oldest, newest, newest_timestamp in rows}
+
+
+def mark_read(ids=None, message_ids=None, up_to_id=None, recipient=None, database_path='messages.db'):
+    """Mark messages read in one transaction and return how many changed.
+
+    ids are messages.id values, message_ids the mesh packet ids; up_to_id
+    marks every unread message with id <= up_to_id (for one recipient if
+    given), the usual way to acknowledge a page read with iter_unread().
+    """
+    conn = connect(database_path)
+    c = conn.cursor()
+    changed = 0
+    with conn:
+        for column, values in (('id', ids), ('message_id', message_ids)):
+            values = list(values or ())
+            for start in range(0, len(values), CHUNK_SIZE):
+                chunk = values[start:start + CHUNK_SIZE]
+                query = f"UPDATE messages SET read = 1 WHERE read = 0 AND {column} IN ({','.join('?' * len(chunk))})"
+                params = list(chunk)
+                if recipient is not None:
+                    query += ' AND recipient = ?'
+                    params.append(recipient)
+                c.execute(query, params)
+                changed += c.rowcount
+        if up_to_id is not None:
+            query = 'UPDATE messages SET read = 1 WHERE read = 0 AND id <= ?'
+            params = [up_to_id]
+            if recipient is not None:
+                query += ' AND recipient = ?'
+                params.append(recipient)
+            c.execute(query, params)
+            changed += c.rowcount
+    conn.close()
+    return changed
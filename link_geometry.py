@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""Link statistics and geometry (distance, bearing) for every (node, neighbor) pair.
+
+refresh_links() folds neighbors rows stored since the last run into the
+links table, then recomputes distance and bearing, in one numpy pass, for
+links whose endpoints got a new position or that were just heard. Queries
+like "longest links" or "links over 20 km" then read links directly.
+
+    python3 link_geometry.py --over-km 20
+    python3 link_geometry.py --order snr --limit 10
+"""
+import argparse
+
+import numpy as np
+
+from geo import haversine_np, bearing_np
+from pragmas import connect
+from topology import node_num, node_id
+
+# SQLite limits the number of ? parameters per statement
+CHUNK_SIZE = 500
+
+
+def _state(c, name):
+    c.execute('SELECT value FROM links_state WHERE name = ?', (name,))
+    row = c.fetchone()
+    return row[0] if row else 0
+
+
+def _set_state(c, name, value):
+    c.execute('''INSERT INTO links_state (name, value) VALUES (?, ?)
+                 ON CONFLICT(name) DO UPDATE SET value = excluded.value''', (name, value))
+
+
+def _latest_positions(c, user_ids):
+    """{user_id: (latitude, longitude)} of the latest stored fix for each user id."""
+    positions = {}
+    user_ids = list(user_ids)
+    for i in range(0, len(user_ids), CHUNK_SIZE):
+        chunk = user_ids[i:i + CHUNK_SIZE]
+        placeholders = ', '.join('?' * len(chunk))
+        c.execute(f'''SELECT p.node_id, p.latitude, p.longitude FROM positions p
+                      JOIN (SELECT node_id, MAX(timestamp) AS timestamp FROM positions
+                            WHERE node_id IN ({placeholders}) AND latitude IS NOT NULL AND longitude IS NOT NULL
+                            GROUP BY node_id) latest
+                      ON p.node_id = latest.node_id AND p.timestamp = latest.timestamp''', chunk)
+        for user_id, latitude, longitude in c.fetchall():
+            positions[user_id] = (latitude, longitude)
+    return positions
+
+
+def refresh_links(database_path='messages.db'):
+    """Bring links up to date with new neighbors and positions rows; returns the number of links re-measured."""
+    conn = connect(database_path)
+    c = conn.cursor()
+    try:
+        last_neighbor_id = _state(c, 'last_neighbor_id')
+        last_position_id = _state(c, 'last_position_id')
+        # Not MAX(id), which scans the view of a compacted table (see dictionary.py)
+        c.execute('SELECT id FROM neighbors ORDER BY id DESC LIMIT 1')
+        max_neighbor_id = (c.fetchone() or (0,))[0]
+        c.execute('SELECT id FROM positions ORDER BY id DESC LIMIT 1')
+        max_position_id = (c.fetchone() or (0,))[0]
+
+        # Merge SNR stats of the new neighbor rows
+        c.execute('''INSERT INTO links (node_id, neighbor_node_id, snr_sum, record_count, average_snr, min_snr, max_snr, last_seen)
+                     SELECT node_id, neighbor_node_id, SUM(snr), COUNT(snr), AVG(snr), MIN(snr), MAX(snr), MAX(timestamp)
+                     FROM neighbors WHERE id > ? AND id <= ?
+                     GROUP BY node_id, neighbor_node_id
+                     ON CONFLICT(node_id, neighbor_node_id) DO UPDATE SET
+                     snr_sum = COALESCE(links.snr_sum, 0) + COALESCE(excluded.snr_sum, 0),
+                     record_count = links.record_count + excluded.record_count,
+                     average_snr = (COALESCE(links.snr_sum, 0) + COALESCE(excluded.snr_sum, 0))
+                                   / NULLIF(links.record_count + excluded.record_count, 0),
+                     min_snr = MIN(COALESCE(links.min_snr, excluded.min_snr), COALESCE(excluded.min_snr, links.min_snr)),
+                     max_snr = MAX(COALESCE(links.max_snr, excluded.max_snr), COALESCE(excluded.max_snr, links.max_snr)),
+                     last_seen = MAX(links.last_seen, excluded.last_seen)''',
+                  (last_neighbor_id, max_neighbor_id))
+
+        # Nodes whose links need measuring again: new positions, plus both ends of new neighbor rows
+        c.execute('SELECT DISTINCT node_id FROM positions WHERE id > ? AND id <= ?', (last_position_id, max_position_id))
+        changed = set()
+        for (user_id,) in c.fetchall():
+            try:
+                changed.add(str(node_num(user_id)))
+            except (TypeError, ValueError):
+                continue
+        c.execute('''SELECT DISTINCT node_id, neighbor_node_id FROM neighbors WHERE id > ? AND id <= ?''',
+                  (last_neighbor_id, max_neighbor_id))
+        for pair in c.fetchall():
+            changed.update(str(n) for n in pair if n is not None)
+
+        pairs = set()
+        changed = list(changed)
+        for i in range(0, len(changed), CHUNK_SIZE):
+            chunk = changed[i:i + CHUNK_SIZE]
+            placeholders = ', '.join('?' * len(chunk))
+            c.execute(f'''SELECT node_id, neighbor_node_id FROM links
+                          WHERE node_id IN ({placeholders}) OR neighbor_node_id IN ({placeholders})''', chunk + chunk)
+            pairs.update(c.fetchall())
+
+        measured = 0
+        if pairs:
+            pairs = list(pairs)
+            user_ids = {}
+            for pair in pairs:
+                for number in pair:
+                    try:
+                        user_ids[number] = node_id(node_num(number))
+                    except (TypeError, ValueError):
+                        user_ids[number] = None
+            positions = _latest_positions(c, {u for u in user_ids.values() if u})
+            nan = (np.nan, np.nan)
+            a = np.array([positions.get(user_ids[n], nan) for n, _ in pairs], dtype=np.float64)
+            b = np.array([positions.get(user_ids[n], nan) for _, n in pairs], dtype=np.float64)
+            distances = haversine_np(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+            bearings = bearing_np(a[:, 0], a[:, 1], b[:, 0], b[:, 1])
+            known = ~np.isnan(distances)
+            rows = [(float(distances[i]), float(bearings[i]), pairs[i][0], pairs[i][1]) for i in np.flatnonzero(known)]
+            c.executemany('UPDATE links SET distance_m = ?, bearing = ? WHERE node_id = ? AND neighbor_node_id = ?', rows)
+            measured = len(rows)
+
+        _set_state(c, 'last_neighbor_id', max_neighbor_id)
+        _set_state(c, 'last_position_id', max_position_id)
+        conn.commit()
+        return measured
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def query_links(min_distance_km=None, order='distance', limit=20, database_path='messages.db'):
+    """Links with known geometry, longest first (order='distance') or best SNR first (order='snr').
+
+    Rows are (node long name, neighbor long name, distance km, bearing, average SNR, min SNR, max SNR, records).
+    """
+    order_by = {'distance': 'l.distance_m DESC', 'snr': 'l.average_snr DESC, l.distance_m DESC'}[order]
+    query = f'''SELECT COALESCE(n1.long_name, l.node_id), COALESCE(n2.long_name, l.neighbor_node_id),
+                       l.distance_m / 1000.0, l.bearing, l.average_snr, l.min_snr, l.max_snr, l.record_count
+                FROM links l
+                LEFT JOIN nodes n1 ON l.node_id = n1.node_number
+                LEFT JOIN nodes n2 ON l.neighbor_node_id = n2.node_number
+                WHERE l.distance_m IS NOT NULL AND l.distance_m >= ?
+                ORDER BY {order_by}
+                LIMIT ?'''
+    conn = connect(database_path)
+    rows = conn.execute(query, ((min_distance_km or 0) * 1000.0, limit)).fetchall()
+    conn.close()
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show link distances and SNR from messages.db.")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    parser.add_argument('--over-km', type=float, help="Only links longer than this")
+    parser.add_argument('--order', choices=['distance', 'snr'], default='distance')
+    parser.add_argument('--limit', type=int, default=20)
+    args = parser.parse_args()
+
+    measured = refresh_links(args.db)
+    print(f"Re-measured {measured} links.")
+    for node, neighbor, distance_km, bearing, average_snr, min_snr, max_snr, count in query_links(
+            args.over_km, args.order, args.limit, args.db):
+        snr = f"SNR avg {average_snr:.2f} (min {min_snr:.2f}, max {max_snr:.2f})" if average_snr is not None else "no SNR"
+        print(f"{node} -> {neighbor}: {distance_km:.1f} km at {bearing:.0f}°, {snr} over {count} records")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+"""Periodic upkeep of messages.db: WAL checkpoints, query planner statistics, returning free pages.
+
+- checkpoint: PRAGMA wal_checkpoint(TRUNCATE) copies the WAL into the
+  database and truncates it, so the -wal file does not keep growing while
+  readers (webmap.py) hold old snapshots.
+- optimize:   PRAGMA optimize, which re-runs ANALYZE on tables whose stats
+  are stale (a full ANALYZE the first time, when there are none).
+- vacuum:     PRAGMA incremental_vacuum returns free pages (after archive.py
+  deleted old months) to the file system. Only possible once the database
+  has auto_vacuum = INCREMENTAL: new databases get it from initialize_db,
+  existing ones with `python3 maintenance.py enable-vacuum` (a full VACUUM).
+
+MaintenanceScheduler runs each task once its interval has passed, at a
+quiet time: no packet for QUIET_SECONDS. On a mesh that is never quiet a
+task runs anyway when it is overdue by its interval again.
+
+    python3 maintenance.py run
+    python3 maintenance.py run --tasks checkpoint
+"""
+import argparse
+import logging
+import time as time_module
+
+from pragmas import connect
+
+logger = logging.getLogger(__name__)
+
+# task -> seconds between runs
+INTERVALS = {
+    'checkpoint': 15 * 60,
+    'optimize': 6 * 60 * 60,
+    'vacuum': 24 * 60 * 60,
+}
+# Seconds without a packet that count as quiet
+QUIET_SECONDS = 20
+# Pages freed per incremental_vacuum run (4 KB each)
+VACUUM_PAGES = 25000
+
+
+def checkpoint(conn):
+    busy, wal_pages, copied = conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchone()
+    return {'busy': bool(busy), 'wal_pages': wal_pages, 'copied': copied}
+
+
+def optimize(conn):
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone() is None:
+        conn.execute('ANALYZE')
+        return {'analyze': True}
+    conn.execute('PRAGMA analysis_limit = 1000')
+    conn.execute('PRAGMA optimize')
+    return {'analyze': False}
+
+
+def vacuum(conn, pages=VACUUM_PAGES):
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+        return {'freed': 0, 'enabled': False}
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    conn.execute(f'PRAGMA incremental_vacuum({pages})')
+    return {'freed': free - conn.execute('PRAGMA freelist_count').fetchone()[0], 'enabled': True}
+
+
+TASKS = {'checkpoint': checkpoint, 'optimize': optimize, 'vacuum': vacuum}
+
+
+def run_maintenance(tasks=tuple(TASKS), database_path='messages.db'):
+    """Run tasks in order; returns {task: result dict with 'seconds'}."""
+    results = {}
+    conn = connect(database_path)
+    try:
+        for task in tasks:
+            start = time_module.perf_counter()
+            results[task] = TASKS[task](conn)
+            conn.commit()
+            results[task]['seconds'] = time_module.perf_counter() - start
+            logger.info(f"Maintenance {task}: {results[task]}")
+    finally:
+        conn.close()
+    return results
+
+
+def enable_incremental_vacuum(database_path='messages.db'):
+    """Switch an existing database to auto_vacuum = INCREMENTAL; rewrites the whole file once."""
+    conn = connect(database_path)
+    conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+    conn.execute('VACUUM')
+    conn.close()
+
+
+class MaintenanceScheduler:
+    """Runs the maintenance tasks from the ingest loop when they are due and the mesh is quiet."""
+
+    def __init__(self, intervals=INTERVALS, quiet_seconds=QUIET_SECONDS, database_path='messages.db'):
+        self.intervals = dict(intervals)
+        self.quiet_seconds = quiet_seconds
+        self.database_path = database_path
+        now = time_module.time()
+        self.last_run = {task: now for task in self.intervals}
+        self.last_activity = 0
+
+    def activity(self, now=None):
+        """Call for every packet received."""
+        self.last_activity = now if now is not None else time_module.time()
+
+    def due(self, now=None):
+        now = now if now is not None else time_module.time()
+        quiet = now - self.last_activity >= self.quiet_seconds
+        return [task for task, interval in self.intervals.items()
+                if now - self.last_run[task] >= (interval if quiet else 2 * interval)]
+
+    def tick(self, now=None):
+        """Run the due tasks; returns their results."""
+        tasks = self.due(now)
+        if not tasks:
+            return {}
+        try:
+            results = run_maintenance(tasks, self.database_path)
+        except Exception as e:
+            logger.error(f"Error during database maintenance ({', '.join(tasks)}): {e}")
+            results = {}
+        finished = time_module.time()
+        for task in tasks:
+            self.last_run[task] = finished
+        return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkpoint, analyze and vacuum messages.db.")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    commands = parser.add_subparsers(dest='command', required=True)
+    run = commands.add_parser('run', help="Run maintenance tasks now")
+    run.add_argument('--tasks', nargs='+', default=list(TASKS), choices=list(TASKS))
+    commands.add_parser('enable-vacuum', help="Switch the database to incremental vacuum (full VACUUM, takes a while)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.command == 'enable-vacuum':
+        enable_incremental_vacuum(args.db)
+        print("auto_vacuum = INCREMENTAL")
+        return
+    for task, result in run_maintenance(args.tasks, args.db).items():
+        details = ', '.join(f"{key}={value}" for key, value in result.items() if key != 'seconds')
+        print(f"{task}: {details} ({result['seconds']:.2f} s)")
+
+
+if __name__ == "__main__":
+    main()
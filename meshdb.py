@@ -0,0 +1,516 @@
+"""SQLite storage layer shared by the ingest scripts (messages.db)."""
+import sqlite3
+import time as time_module
+import logging
+
+from deadband import DeadbandFilter, TELEMETRY_TOLERANCES, ENVIRONMENT_TOLERANCES
+from tracks import PositionFilter
+from anomaly import AnomalyDetector, TELEMETRY_RULES, ENVIRONMENT_RULES
+from inbox import initialize_inbox
+from changefeed import ChangeFeed
+from pragmas import connect, keep_open
+from dictionary import Dictionary, COMPACT_COLUMNS, initialize_dictionary, compact_table, storage_table
+from dbstats import COUNTED_TABLES
+
+logger = logging.getLogger(__name__)
+
+# Only store telemetry/environment samples that moved beyond tolerance (see deadband.py).
+# Set to None to store every sample.
+telemetry_filter = DeadbandFilter(TELEMETRY_TOLERANCES)
+environment_filter = DeadbandFilter(ENVIRONMENT_TOLERANCES)
+# Only store positions of nodes that moved, plus a periodic heartbeat (see tracks.py)
+position_filter = PositionFilter()
+# Flag outliers (voltage sag, utilization spikes, reboots, environment jumps) into the events table
+# as samples arrive (see anomaly.py). Set to None to turn detection off.
+telemetry_detector = AnomalyDetector(TELEMETRY_RULES)
+environment_detector = AnomalyDetector(ENVIRONMENT_RULES, counter=None)
+# Committed inserts/upserts are appended to the change feed for downstream consumers (see changefeed.py).
+# Set to None to turn it off.
+change_feed = ChangeFeed()
+# Encodes the node ids, routes and event kinds of compacted tables at ingest (see dictionary.py)
+codes = Dictionary()
+
+TELEMETRY_COLUMNS = ('node_id', 'battery_level', 'voltage', 'channel_utilization', 'air_util_tx', 'uptime_seconds', 'timestamp')
+POSITION_COLUMNS = ('node_id', 'latitude', 'longitude', 'altitude', 'time', 'sats_in_view', 'timestamp')
+ENVIRONMENT_COLUMNS = ('node_id', 'temperature', 'humidity', 'bar', 'iaq', 'timestamp')
+EVENT_COLUMNS = ('node_id', 'kind', 'metric', 'value', 'expected', 'score', 'timestamp')
+# User ids per SELECT ... IN (...) statement, below SQLite's bound-variable limit
+NODE_CHUNK_SIZE = 500
+
+# Initialize the database
+def initialize_db():
+    conn = connect()
+    c = conn.cursor()
+    # Lets maintenance.py return free pages to the file system; a new, empty database is rebuilt
+    # (instantly) so the setting takes effect
+    new = c.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()[0] == 0
+    if new:
+        c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+        c.execute('VACUUM')
+    # Create necessary tables
+    c.execute('''CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    message_id INTEGER UNIQUE,
+                    sender TEXT,
+                    recipient TEXT,
+                    message TEXT,
+                    timestamp INTEGER,
+                    channel INTEGER,
+                    read INTEGER DEFAULT 0
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS telemetry (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT,
+                    battery_level INTEGER,
+                    voltage REAL,
+                    channel_utilization REAL,
+                    air_util_tx REAL,
+                    uptime_seconds INTEGER,
+                    timestamp INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS nodes (
+                    user_id TEXT PRIMARY KEY,
+                    node_number TEXT,
+                    short_name TEXT,
+                    long_name TEXT,
+                    hw_model TEXT,
+                    last_heard INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS positions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT,
+                    latitude REAL,
+                    longitude REAL,
+                    altitude REAL,
+                    time INTEGER,
+                    sats_in_view INTEGER,
+                    timestamp INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS environment (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT,
+                    temperature REAL,
+                    humidity REAL,
+                    bar REAL,
+                    iaq REAL,
+                    timestamp INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS traceroute (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_node TEXT,
+                    to_node TEXT,
+                    hop_id INTEGER,
+                    hop_node TEXT,
+                    hop_snr REAL,
+                    timestamp INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS neighbors (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                node_id TEXT,
+                neighbor_node_id TEXT,
+                snr REAL,
+                timestamp INTEGER
+            )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS routing (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_node TEXT,
+                    to_node TEXT,
+                    routes TEXT,
+                    timestamp INTEGER
+                )''')
+    # Original MeshPacket protobuf bytes, so derived tables can be backfilled later (see raw_packets.py)
+    c.execute('''CREATE TABLE IF NOT EXISTS raw_packets (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    from_node INTEGER,
+                    portnum INTEGER,
+                    rx_time INTEGER,
+                    packet BLOB
+                )''')
+    # Per-link SNR stats and geometry, maintained incrementally by link_geometry.py
+    c.execute('''CREATE TABLE IF NOT EXISTS links (
+                    node_id TEXT,
+                    neighbor_node_id TEXT,
+                    snr_sum REAL,
+                    record_count INTEGER,
+                    average_snr REAL,
+                    min_snr REAL,
+                    max_snr REAL,
+                    last_seen INTEGER,
+                    distance_m REAL,
+                    bearing REAL,
+                    PRIMARY KEY (node_id, neighbor_node_id)
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS links_state (
+                    name TEXT PRIMARY KEY,
+                    value INTEGER
+                )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    node_id TEXT,
+                    kind TEXT,
+                    metric TEXT,
+                    value REAL,
+                    expected REAL,
+                    score REAL,
+                    timestamp INTEGER
+                )''')
+    initialize_dictionary(c)
+    # Index the database for faster lookups
+    # Create indexes to optimize query performance
+    # (on the _data tables of compacted tables, a view cannot be indexed)
+    positions, neighbors, telemetry, events = (storage_table(c, table) for table in ('positions', 'neighbors', 'telemetry', 'events'))
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_positions_node_id_timestamp ON {positions}(node_id, timestamp);''')
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_neighbors_node_id_neighbor_node_id ON {neighbors}(node_id, neighbor_node_id);''')
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_neighbors_timestamp ON {neighbors}(timestamp);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_nodes_node_number ON nodes(node_number);''')
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_positions_node_id ON {positions}(node_id);''')
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_telemetry_node_id_timestamp ON {telemetry}(node_id, timestamp);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_raw_packets_from_node_portnum_rx_time ON raw_packets(from_node, portnum, rx_time);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_raw_packets_portnum_rx_time ON raw_packets(portnum, rx_time);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_links_neighbor_node_id ON links(neighbor_node_id);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_links_distance_m ON links(distance_m);''')
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_events_node_id_timestamp ON {events}(node_id, timestamp);''')
+    c.execute(f'''CREATE INDEX IF NOT EXISTS idx_events_kind_timestamp ON {events}(kind, timestamp);''')
+
+    # Row counters kept up to date by triggers, so dbstats.py/countrecords.py never need COUNT(*)
+    c.execute('''CREATE TABLE IF NOT EXISTS table_counts (
+                    name TEXT PRIMARY KEY,
+                    row_count INTEGER
+                )''')
+    for table in COUNTED_TABLES:
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_count_insert AFTER INSERT ON {table}
+                      BEGIN UPDATE table_counts SET row_count = row_count + 1 WHERE name = '{table}'; END''')
+        c.execute(f'''CREATE TRIGGER IF NOT EXISTS trg_{table}_count_delete AFTER DELETE ON {table}
+                      BEGIN UPDATE table_counts SET row_count = row_count - 1 WHERE name = '{table}'; END''')
+        c.execute('SELECT 1 FROM table_counts WHERE name = ?', (table,))
+        if c.fetchone() is None:
+            # One full count when the counter is first installed
+            c.execute(f"INSERT INTO table_counts (name, row_count) SELECT '{table}', COUNT(*) FROM {table}")
+
+    # Message search (see search.py)
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_timestamp ON messages(timestamp);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_sender_timestamp ON messages(sender, timestamp);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_recipient_timestamp ON messages(recipient, timestamp);''')
+    c.execute('''CREATE INDEX IF NOT EXISTS idx_messages_channel_timestamp ON messages(channel, timestamp);''')
+    initialize_message_fts(c)
+    # Unread inbox (see inbox.py)
+    initialize_inbox(c)
+    # Integer codes instead of repeated strings in the big tables; existing databases: python3 dictionary.py compact
+    if new:
+        for table in COMPACT_COLUMNS:
+            compact_table(c, table)
+
+    conn.commit()
+    conn.close()
+    # The store functions connect per call; keep the WAL from being checkpointed away after each one
+    keep_open()
+    logger.info("Database initialized successfully.")
+
+
+def initialize_message_fts(c):
+    """Full-text index over messages.message, kept in sync by triggers; skipped if SQLite lacks FTS5."""
+    c.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'")
+    if c.fetchone() is not None:
+        return
+    try:
+        c.execute('''CREATE VIRTUAL TABLE messages_fts USING fts5(
+                        message, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+                    )''')
+    except sqlite3.OperationalError as e:
+        logger.warning(f"Full-text search not available ({e}); search.py will fall back to LIKE.")
+        return
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_messages_fts_insert AFTER INSERT ON messages BEGIN
+                    INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_messages_fts_delete AFTER DELETE ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+                 END''')
+    c.execute('''CREATE TRIGGER IF NOT EXISTS trg_messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+                    INSERT INTO messages_fts (messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+                    INSERT INTO messages_fts (rowid, message) VALUES (new.id, new.message);
+                 END''')
+    # Index the messages stored before the index existed
+    c.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+
+
+def publish_changes(table, op, rows):
+    """Hand committed rows (dicts) to the change feed."""
+    if change_feed is not None and rows:
+        change_feed.publish(table, op, rows)
+
+
+# Store functions
+def store_message(message_id, sender, recipient, message, timestamp, channel):
+    conn = connect()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO messages (message_id, sender, recipient, message, timestamp, channel) VALUES (?, ?, ?, ?, ?, ?)''', 
+                  (message_id, sender, recipient, message, timestamp, channel))
+        conn.commit()
+        publish_changes('messages', 'insert', [{'id': c.lastrowid, 'message_id': message_id, 'sender': sender,
+                                                'recipient': recipient, 'message': message, 'timestamp': timestamp,
+                                                'channel': channel}])
+    except sqlite3.IntegrityError:
+        logger.warning(f"Duplicate message with ID {message_id} detected. Ignoring...")
+    conn.close()
+
+# The filters and detectors keep per-node state, so each sample must go through them exactly once: the
+# filter_* functions run them, the write_* functions only write (and can be retried, see spool.py).
+def filter_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp):
+    """Run the anomaly detector and dead-band filter on a telemetry sample; returns (events, samples to write)."""
+    values = {'battery_level': battery_level, 'voltage': voltage, 'channel_utilization': channel_utilization,
+              'air_util_tx': air_util_tx, 'uptime_seconds': uptime_seconds}
+    events = [] if telemetry_detector is None else telemetry_detector.observe(node_id, timestamp, values)
+    samples = [(timestamp, values)] if telemetry_filter is None else telemetry_filter.filter(node_id, timestamp, values)
+    if not samples:
+        logger.info(f"Telemetry for node {node_id} within dead-band, not stored.")
+    return events, samples
+
+def filter_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp):
+    """Run the anomaly detector and dead-band filter on an environment sample; returns (events, samples to write)."""
+    values = {'temperature': temperature, 'humidity': relative_humidity, 'bar': barometric_pressure, 'iaq': iaq}
+    events = [] if environment_detector is None else environment_detector.observe(node_id, timestamp, values)
+    samples = [(timestamp, values)] if environment_filter is None else environment_filter.filter(node_id, timestamp, values)
+    if not samples:
+        logger.info(f"Environmental data for node {node_id} within dead-band, not stored.")
+    return events, samples
+
+def filter_position(node_id, latitude, longitude, timestamp):
+    """True if the position should be written (the node moved, or the heartbeat is due)."""
+    if position_filter is not None and not position_filter.should_store(node_id, latitude, longitude, timestamp):
+        logger.info(f"Node {node_id} has not moved, position not stored.")
+        return False
+    return True
+
+def store_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp):
+    events, samples = filter_telemetry(node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds,
+                                       timestamp)
+    if events:
+        store_events(events)
+    if samples:
+        write_telemetry(node_id, samples)
+
+def write_telemetry(node_id, samples):
+    """Write [(timestamp, values)] samples returned by filter_telemetry."""
+    conn = connect()
+    c = conn.cursor()
+    codes.insert(c, 'telemetry', TELEMETRY_COLUMNS,
+                 [(node_id, v['battery_level'], v['voltage'], v['channel_utilization'], v['air_util_tx'], v['uptime_seconds'], ts)
+                  for ts, v in samples])
+    conn.commit()
+    conn.close()
+    publish_changes('telemetry', 'insert', [dict(v, node_id=node_id, timestamp=ts) for ts, v in samples])
+    logger.info(f"Stored telemetry data for node {node_id}.")
+
+def store_events(events):
+    conn = connect()
+    c = conn.cursor()
+    codes.insert(c, 'events', EVENT_COLUMNS, [tuple(event[column] for column in EVENT_COLUMNS) for event in events])
+    conn.commit()
+    conn.close()
+    publish_changes('events', 'insert', events)
+    for event in events:
+        logger.warning(f"Anomaly on node {event['node_id']}: {event['kind']} ({event['metric']}={event['value']}, expected {event['expected']})")
+
+def store_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp):
+    if filter_position(node_id, latitude, longitude, timestamp):
+        write_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp)
+
+def write_position(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp):
+    conn = connect()
+    c = conn.cursor()
+    codes.insert(c, 'positions', POSITION_COLUMNS, [(node_id, latitude, longitude, altitude, time, sats_in_view, timestamp)])
+    conn.commit()
+    publish_changes('positions', 'insert', [{'id': c.lastrowid, 'node_id': node_id, 'latitude': latitude, 'longitude': longitude,
+                                             'altitude': altitude, 'time': time, 'sats_in_view': sats_in_view,
+                                             'timestamp': timestamp}])
+    conn.close()
+    logger.info(f"Stored position data for node {node_id}.")
+
+def store_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp):
+    events, samples = filter_environment(node_id, temperature, relative_humidity, barometric_pressure, iaq, timestamp)
+    if events:
+        store_events(events)
+    if samples:
+        write_environment(node_id, samples)
+
+def write_environment(node_id, samples):
+    """Write [(timestamp, values)] samples returned by filter_environment."""
+    conn = connect()
+    c = conn.cursor()
+    codes.insert(c, 'environment', ENVIRONMENT_COLUMNS,
+                 [(node_id, v['temperature'], v['humidity'], v['bar'], v['iaq'], ts) for ts, v in samples])
+    conn.commit()
+    conn.close()
+    publish_changes('environment', 'insert', [dict(v, node_id=node_id, timestamp=ts) for ts, v in samples])
+    logger.info(f"Stored environmental data for node {node_id}.")
+
+def store_traceroute(from_node, to_node, hops, timestamp):
+    conn = connect()
+    c = conn.cursor()
+    hop_id = 0
+    rows = []
+    for hop in hops:
+        hop_id += 1
+        hop_node = hop.get('nodeId')
+        hop_snr = hop.get('snr')
+        codes.insert(c, 'traceroute', ('from_node', 'to_node', 'hop_id', 'hop_node', 'hop_snr', 'timestamp'),
+                     [(from_node, to_node, hop_id, hop_node, hop_snr, timestamp)])
+        rows.append({'id': c.lastrowid, 'from_node': from_node, 'to_node': to_node, 'hop_id': hop_id,
+                     'hop_node': hop_node, 'hop_snr': hop_snr, 'timestamp': timestamp})
+    conn.commit()
+    conn.close()
+    publish_changes('traceroute', 'insert', rows)
+    logger.info(f"Stored traceroute data from {from_node} to {to_node}.")
+
+def store_routing(from_node, to_node, routes, timestamp):
+    conn = connect()
+    c = conn.cursor()
+    codes.insert(c, 'routing', ('from_node', 'to_node', 'routes', 'timestamp'), [(from_node, to_node, routes, timestamp)])
+    conn.commit()
+    publish_changes('routing', 'insert', [{'id': c.lastrowid, 'from_node': from_node, 'to_node': to_node, 'routes': routes,
+                                           'timestamp': timestamp}])
+    conn.close()
+    logger.info(f"Stored routing data from {from_node} to {to_node}.")
+
+def upsert_node(user_id, node_number, short_name, long_name, hw_model, last_heard):
+    if user_id is None:
+        logger.warning(f"Skipping upsert for node with None user_id: {short_name}, {long_name}, {hw_model}, {last_heard}")
+        return
+    
+    # Log the values being upserted
+    logger.info(f"Upserting node: user_id={user_id}, node_number={node_number}, short_name={short_name}, long_name={long_name}, hw_model={hw_model}, last_heard={last_heard}")
+    
+    # Ensure node_number is not None or an empty string
+    if node_number is None or node_number == '':
+        logger.warning(f"Skipping upsert for node {user_id} because node_number is None or empty.")
+        return
+    
+    conn = connect()
+    c = conn.cursor()
+    try:
+        c.execute('''INSERT INTO nodes (user_id, node_number, short_name, long_name, hw_model, last_heard)
+                     VALUES (?, ?, ?, ?, ?, ?)
+                     ON CONFLICT(user_id) DO UPDATE SET
+                     node_number=excluded.node_number, short_name=excluded.short_name,
+                     long_name=excluded.long_name, hw_model=excluded.hw_model,
+                     last_heard=COALESCE(excluded.last_heard, nodes.last_heard)''',
+                  (user_id, node_number, short_name, long_name, hw_model, last_heard))
+        if last_heard is None:
+            # Publish the last_heard the row kept
+            last_heard = c.execute('SELECT last_heard FROM nodes WHERE user_id = ?', (user_id,)).fetchone()[0]
+        conn.commit()
+        publish_changes('nodes', 'upsert', [{'user_id': user_id, 'node_number': node_number, 'short_name': short_name,
+                                             'long_name': long_name, 'hw_model': hw_model, 'last_heard': last_heard}])
+    except sqlite3.OperationalError:
+        # Locked or busy: let the caller (the spool) retry
+        raise
+    except Exception as e:
+        logger.error(f"Error upserting node {user_id}: {e}")
+    finally:
+        conn.close()
+    logger.info(f"Upserted node information for {short_name} ({user_id} #{node_number}).")
+
+
+def store_raw_packet(from_node, portnum, rx_time, packet):
+    """Store the serialized MeshPacket as-is; decoding is left to raw_packets.py."""
+    conn = connect()
+    c = conn.cursor()
+    c.execute('''INSERT INTO raw_packets (from_node, portnum, rx_time, packet)
+                 VALUES (?, ?, ?, ?)''',
+              (from_node, portnum, rx_time, packet))
+    conn.commit()
+    conn.close()
+
+
+def store_neighbors(node_id, neighbor_node_id, snr, timestamp):
+    """Store neighbor information in the database."""
+    conn = connect()
+    c = conn.cursor()
+    codes.insert(c, 'neighbors', ('node_id', 'neighbor_node_id', 'snr', 'timestamp'), [(node_id, neighbor_node_id, snr, timestamp)])
+    conn.commit()
+    publish_changes('neighbors', 'insert', [{'id': c.lastrowid, 'node_id': node_id, 'neighbor_node_id': neighbor_node_id,
+                                             'snr': snr, 'timestamp': timestamp}])
+    conn.close()
+    logger.info(f"Stored neighbor information: {node_id} -> {neighbor_node_id} with SNR {snr}.")
+
+
+def _insert_newer(c, table, columns, rows):
+    """Insert the rows newer than the latest stored one of their node; returns the rows added, with their ids."""
+    c.execute(f'SELECT id FROM {table} ORDER BY id DESC LIMIT 1')
+    last = c.fetchone()
+    codes.insert(c, table, columns, rows, skip_older=('node_id', 'timestamp'))
+    c.execute(f"SELECT id, {', '.join(columns)} FROM {table} WHERE id > ? ORDER BY id", (last[0] if last else 0,))
+    return [dict(zip(('id',) + columns, row)) for row in c.fetchall()]
+
+
+def sync_nodedb(nodes, bootstrap=True):
+    """Bulk-load the radio's NodeDB snapshot (nodes, latest positions and device metrics) in one transaction.
+
+    Positions and device metrics are only added with bootstrap (at startup). Later re-syncs only upsert
+    nodes: the snapshot re-dates a node's last values to lastHeard, which would get past the position
+    and dead-band filters that keep packets of unchanged values out.
+    """
+    timestamp = int(time_module.time())
+    node_rows = []
+    position_rows = []
+    telemetry_rows = []
+
+    for n in list((nodes or {}).values()):
+        user = n.get('user', {})
+        user_id = user.get('id')
+        node_number = n.get('num')
+        if user_id is None or node_number is None:
+            continue
+        last_heard = n.get('lastHeard', 0)
+        node_rows.append((user_id, node_number, user.get('shortName', ''), user.get('longName', ''),
+                          user.get('hwModel', ''), last_heard))
+
+        # The snapshot only holds the latest values, so date them by when the node was last heard
+        seen = last_heard or timestamp
+
+        if not bootstrap:
+            continue
+        position = n.get('position', {})
+        if position.get('latitude') is not None and position.get('longitude') is not None:
+            position_rows.append((user_id, position.get('latitude'), position.get('longitude'), position.get('altitude'),
+                                  position.get('time'), position.get('satsInView'), seen))
+
+        metrics = n.get('deviceMetrics', {})
+        if metrics:
+            telemetry_rows.append((user_id, metrics.get('batteryLevel'), metrics.get('voltage'),
+                                   metrics.get('channelUtilization'), metrics.get('airUtilTx'),
+                                   metrics.get('uptimeSeconds'), seen))
+
+    conn = connect()
+    c = conn.cursor()
+    try:
+        c.executemany('''INSERT INTO nodes (user_id, node_number, short_name, long_name, hw_model, last_heard)
+                         VALUES (?, ?, ?, ?, ?, ?)
+                         ON CONFLICT(user_id) DO UPDATE SET
+                         node_number=excluded.node_number, short_name=excluded.short_name,
+                         long_name=excluded.long_name, hw_model=excluded.hw_model,
+                         last_heard=MAX(COALESCE(nodes.last_heard, 0), COALESCE(excluded.last_heard, 0))''',
+                      node_rows)
+        # last_heard as stored: the upsert keeps the newer of the stored and the snapshot value
+        nodes_stored = []
+        user_ids = [row[0] for row in node_rows]
+        for start in range(0, len(user_ids), NODE_CHUNK_SIZE):
+            chunk = user_ids[start:start + NODE_CHUNK_SIZE]
+            c.execute(f"""SELECT user_id, node_number, short_name, long_name, hw_model, last_heard FROM nodes
+                          WHERE user_id IN ({', '.join('?' * len(chunk))})""", chunk)
+            nodes_stored.extend(dict(zip(('user_id', 'node_number', 'short_name', 'long_name', 'hw_model', 'last_heard'),
+                                         row)) for row in c.fetchall())
+        # Only add snapshot rows that are newer than what packets already stored, then read back what went in
+        positions_added = _insert_newer(c, 'positions', POSITION_COLUMNS, position_rows)
+        telemetry_added = _insert_newer(c, 'telemetry', TELEMETRY_COLUMNS, telemetry_rows)
+        conn.commit()
+        publish_changes('nodes', 'upsert', nodes_stored)
+        publish_changes('positions', 'insert', positions_added)
+        publish_changes('telemetry', 'insert', telemetry_added)
+        logger.info(f"Synced NodeDB snapshot: {len(node_rows)} nodes, {len(positions_added)} positions, {len(telemetry_added)} telemetry records.")
+    except Exception as e:
+        conn.rollback()
+        logger.error(f"Error syncing NodeDB snapshot: {e}")
+    finally:
+        conn.close()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""Ingest Meshtastic packets from an MQTT broker instead of (or next to) the local radio.
+
+Gateways that uplink to MQTT publish every packet they hear to
+
+    msh/<region>/2/e/<channel>/<gateway id>      ServiceEnvelope protobuf
+    msh/<region>/2/json/<channel>/<gateway id>   JSON (when the gateway has JSON output enabled)
+
+MqttSource subscribes to those topics and turns both formats into the same
+packet dicts the meshtastic library passes to on_receive, decrypting
+encrypted packets with the channel's key (MQTT_CHANNEL_KEYS, name -> base64
+PSK; the default channel key "AQ==" is always known). Packets that cannot
+be decrypted are counted and dropped.
+
+The network thread only puts messages on a bounded queue; a worker thread
+decodes them in batches and calls on_packet, so a burst of traffic never
+stalls the MQTT connection. When the queue is full new messages are dropped
+and counted.
+
+The same packet arrives once per gateway that heard it, and again from the
+local radio. PacketDeduper remembers (from, id) pairs for a while and
+drops the repeats; get-reply.py runs one in on_receive for both sources.
+
+handle_message() is the whole decode path without a broker, so recorded
+payloads can be replayed in tests:
+
+    source = MqttSource(print)
+    source.handle_message('msh/EU_868/2/e/LongFast/!a1b2c3d4', payload)
+
+    python3 mqtt_ingest.py mqtt.example.org --topic 'msh/EU_868/#'
+
+Connecting needs paho-mqtt (pip install paho-mqtt).
+"""
+import argparse
+import base64
+import json
+import logging
+import queue
+import struct
+import threading
+import time as time_module
+from collections import OrderedDict
+
+from protowire import BROADCAST_NUM, DATA, decode_message, decode_payload, decode_service_envelope, enum_name, node_id
+
+try:
+    import paho.mqtt.client as mqtt
+except ImportError:
+    mqtt = None
+
+try:
+    from cryptography.hazmat.primitives.ciphers import Cipher, algorithms, modes
+except ImportError:
+    Cipher = None
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_TOPICS = ['msh/#']
+# Key of the default channel; one-byte PSKs ("AQ==" is 1) select variants of it
+DEFAULT_KEY = bytes.fromhex('d4f1bb3a20290759f0bcffabcf4e6901')
+# Messages waiting for the worker; more than this are dropped
+QUEUE_SIZE = 10000
+# Messages decoded per batch
+BATCH_SIZE = 500
+# A packet id seen again within this many seconds is a duplicate
+DEDUPE_SECONDS = 10 * 60
+# At most this many recent packet ids are remembered
+DEDUPE_SIZE = 100000
+
+# JSON uplink 'type' -> portnum
+JSON_TYPES = {
+    'text': 'TEXT_MESSAGE_APP',
+    'telemetry': 'TELEMETRY_APP',
+    'position': 'POSITION_APP',
+    'nodeinfo': 'NODEINFO_APP',
+    'neighborinfo': 'NEIGHBORINFO_APP',
+    'traceroute': 'TRACEROUTE_APP',
+}
+# JSON telemetry payload keys -> (group, key) in decoded['telemetry']
+JSON_TELEMETRY = {
+    'battery_level': ('deviceMetrics', 'batteryLevel'),
+    'voltage': ('deviceMetrics', 'voltage'),
+    'channel_utilization': ('deviceMetrics', 'channelUtilization'),
+    'air_util_tx': ('deviceMetrics', 'airUtilTx'),
+    'uptime_seconds': ('deviceMetrics', 'uptimeSeconds'),
+    'temperature': ('environmentMetrics', 'temperature'),
+    'relative_humidity': ('environmentMetrics', 'relativeHumidity'),
+    'barometric_pressure': ('environmentMetrics', 'barometricPressure'),
+    'iaq': ('environmentMetrics', 'iaq'),
+}
+
+
+def expand_key(psk):
+    """AES key for a base64 channel PSK; None for an unencrypted channel."""
+    key = base64.b64decode(psk)
+    if len(key) == 0 or key == b'\x00':
+        return None
+    if len(key) == 1:
+        return DEFAULT_KEY[:-1] + bytes([(DEFAULT_KEY[-1] + key[0] - 1) & 0xFF])
+    if len(key) not in (16, 32):
+        raise ValueError(f"Channel key must be 1, 16 or 32 bytes, got {len(key)}")
+    return key
+
+
+def decrypt_packet(packet, key):
+    """Replace packet['encrypted'] by packet['decoded'] if key decrypts it; returns whether it did."""
+    if Cipher is None:
+        raise RuntimeError("Decrypting MQTT packets needs cryptography: pip install cryptography")
+    nonce = struct.pack('<QI', packet.get('id', 0), packet.get('from', 0)) + bytes(4)
+    decryptor = Cipher(algorithms.AES(key), modes.CTR(nonce)).decryptor()
+    plain = decryptor.update(packet['encrypted']) + decryptor.finalize()
+    try:
+        decoded = decode_message(plain, DATA)
+    except (ValueError, IndexError, struct.error):
+        return False
+    # A wrong key gives random bytes, which rarely parse as Data with a known port
+    if not isinstance(decoded.get('portnum'), str):
+        return False
+    packet['decoded'] = decode_payload(decoded)
+    del packet['encrypted']
+    return True
+
+
+def packet_from_json(message):
+    """Packet dict like the meshtastic library's from a JSON uplink message; None for types we do not store."""
+    portnum = JSON_TYPES.get(message.get('type'))
+    if portnum is None or message.get('from') is None:
+        return None
+    payload = message.get('payload') or {}
+    decoded = {'portnum': portnum}
+    if portnum == 'TEXT_MESSAGE_APP':
+        decoded['text'] = payload.get('text', '') if isinstance(payload, dict) else str(payload)
+    elif portnum == 'TELEMETRY_APP':
+        telemetry = {}
+        for key, (group, name) in JSON_TELEMETRY.items():
+            if payload.get(key) is not None:
+                telemetry.setdefault(group, {})[name] = payload[key]
+        decoded['telemetry'] = telemetry
+    elif portnum == 'POSITION_APP':
+        position = {'latitudeI': payload.get('latitude_i'), 'longitudeI': payload.get('longitude_i'),
+                    'altitude': payload.get('altitude'), 'time': payload.get('time'),
+                    'satsInView': payload.get('sats_in_view')}
+        if position['latitudeI'] is not None and position['longitudeI'] is not None:
+            position['latitude'] = position['latitudeI'] * 1e-7
+            position['longitude'] = position['longitudeI'] * 1e-7
+        decoded['position'] = {key: value for key, value in position.items() if value is not None}
+    elif portnum == 'NODEINFO_APP':
+        decoded['user'] = {'id': payload.get('id'), 'longName': payload.get('longname'),
+                           'shortName': payload.get('shortname'), 'hwModel': enum_name('HardwareModel', payload.get('hardware'))}
+    elif portnum == 'NEIGHBORINFO_APP':
+        decoded['neighborinfo'] = {'nodeId': payload.get('node_id'),
+                                   'neighbors': [{'nodeId': neighbor.get('node_id'), 'snr': neighbor.get('snr')}
+                                                 for neighbor in payload.get('neighbors', [])]}
+    elif portnum == 'TRACEROUTE_APP':
+        decoded['traceroute'] = {'route': payload.get('route', [])}
+
+    to = message.get('to', BROADCAST_NUM)
+    packet = {'from': message['from'], 'to': to, 'fromId': node_id(message['from']), 'toId': node_id(to),
+              'id': message.get('id', 0), 'channel': message.get('channel', 0), 'decoded': decoded}
+    for key, name in (('timestamp', 'rxTime'), ('snr', 'rxSnr'), ('rssi', 'rxRssi'), ('hop_start', 'hopStart')):
+        if message.get(key) is not None:
+            packet[name] = message[key]
+    if message.get('hop_start') is not None and message.get('hops_away') is not None:
+        packet['hopLimit'] = message['hop_start'] - message['hops_away']
+    return packet
+
+
+class PacketDeduper:
+    """Remembers (from, id) of recent packets; first() is False for a packet already seen."""
+
+    def __init__(self, window=DEDUPE_SECONDS, max_size=DEDUPE_SIZE):
+        self.window = window
+        self.max_size = max_size
+        self.seen = OrderedDict()
+        self.lock = threading.Lock()
+
+    def first(self, packet, now=None):
+        if not packet.get('id'):
+            return True
+        now = now if now is not None else time_module.time()
+        key = (packet.get('from'), packet['id'])
+        with self.lock:
+            while self.seen and (len(self.seen) >= self.max_size or next(iter(self.seen.values())) < now - self.window):
+                self.seen.popitem(last=False)
+            if key in self.seen:
+                return False
+            self.seen[key] = now
+            return True
+
+
+class MqttSource:
+    """Packets from an MQTT broker, handed to on_packet(packet) from a worker thread.
+
+    Also stands in for the radio interface in on_receive: nodes is filled
+    from the NODEINFO packets seen, and sendText/sendData only log, since
+    nothing is transmitted over MQTT.
+    """
+
+    def __init__(self, on_packet, channel_keys=None, deduper=None, queue_size=QUEUE_SIZE, batch_size=BATCH_SIZE):
+        self.on_packet = on_packet
+        self.keys = {name: expand_key(psk) for name, psk in (channel_keys or {}).items()}
+        # Channel names in configuration order stand in for the channel index of decrypted packets
+        self.channel_index = {name: index for index, name in enumerate(self.keys)}
+        self.deduper = deduper
+        self.batch_size = batch_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.nodes = {}
+        self.stats = {'received': 0, 'packets': 0, 'duplicates': 0, 'undecryptable': 0, 'skipped': 0, 'dropped': 0}
+        self.client = None
+        self.topics = []
+        self.worker = None
+
+    def decode(self, topic, payload):
+        """Packet dict from one MQTT message, or None if it is not a packet we can use."""
+        parts = topic.split('/')
+        if 'json' in parts[2:4]:
+            try:
+                return packet_from_json(json.loads(payload))
+            except (ValueError, AttributeError, TypeError) as e:
+                logger.debug(f"Bad JSON on {topic}: {e}")
+                return None
+        try:
+            envelope = decode_service_envelope(payload)
+        except (ValueError, IndexError, struct.error) as e:
+            logger.debug(f"Bad ServiceEnvelope on {topic}: {e}")
+            return None
+        packet = envelope.get('packet')
+        if packet is None:
+            return None
+        if 'encrypted' in packet:
+            key = self.keys.get(envelope.get('channelId'), DEFAULT_KEY)
+            if key is None or not decrypt_packet(packet, key):
+                self.stats['undecryptable'] += 1
+                return None
+            packet['channel'] = self.channel_index.get(envelope.get('channelId'), 0)
+        return packet
+
+    def handle_message(self, topic, payload):
+        """Decode, de-duplicate and deliver one message; returns the packet passed to on_packet or None."""
+        self.stats['received'] += 1
+        packet = self.decode(topic, payload)
+        if packet is None:
+            return None
+        if 'decoded' not in packet:
+            self.stats['skipped'] += 1
+            return None
+        if self.deduper is not None and not self.deduper.first(packet):
+            self.stats['duplicates'] += 1
+            return None
+        self._learn_node(packet)
+        self.stats['packets'] += 1
+        try:
+            self.on_packet(packet)
+        except Exception as e:
+            logger.error(f"Error handling MQTT packet {packet.get('id')} from {packet.get('fromId')}: {e}")
+        return packet
+
+    def _learn_node(self, packet):
+        node = self.nodes.setdefault(packet['fromId'], {'num': packet['from']})
+        node['lastHeard'] = packet.get('rxTime') or int(time_module.time())
+        user = packet['decoded'].get('user')
+        if packet['decoded'].get('portnum') == 'NODEINFO_APP' and user:
+            node['user'] = {key: value for key, value in user.items() if value is not None}
+
+    def sendText(self, text, destinationId=None, **kwargs):
+        logger.info(f"Not replying to {destinationId} over MQTT (receive only): {text}")
+
+    def sendData(self, data, destinationId=None, **kwargs):
+        logger.info(f"Not sending {kwargs.get('portNum')} to {destinationId} over MQTT (receive only)")
+
+    def put(self, topic, payload):
+        """Queue a message for the worker; called on the MQTT network thread."""
+        try:
+            self.queue.put_nowait((topic, payload))
+        except queue.Full:
+            self.stats['dropped'] += 1
+            if self.stats['dropped'] % 1000 == 1:
+                logger.warning(f"MQTT queue full, {self.stats['dropped']} messages dropped so far")
+
+    def process_batch(self, timeout=None):
+        """Handle up to batch_size queued messages, waiting up to timeout for the first; returns how many."""
+        try:
+            batch = [self.queue.get(timeout=timeout)]
+        except queue.Empty:
+            return 0
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        for topic, payload in batch:
+            self.handle_message(topic, payload)
+        return len(batch)
+
+    def _work(self):
+        while True:
+            self.process_batch()
+
+    def _on_connect(self, client, userdata, *args):
+        logger.info(f"Connected to MQTT broker, subscribing to {', '.join(self.topics)}")
+        for topic in self.topics:
+            client.subscribe(topic)
+
+    def _on_message(self, client, userdata, message):
+        self.put(message.topic, message.payload)
+
+    def connect(self, host, port=1883, topics=DEFAULT_TOPICS, username=None, password=None, tls=False):
+        """Connect to the broker and start the network and worker threads."""
+        if mqtt is None:
+            raise RuntimeError("MQTT ingest needs paho-mqtt: pip install paho-mqtt")
+        self.topics = list(topics)
+        if hasattr(mqtt, 'CallbackAPIVersion'):
+            self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2)
+        else:
+            self.client = mqtt.Client()
+        if username:
+            self.client.username_pw_set(username, password)
+        if tls:
+            self.client.tls_set()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.reconnect_delay_set(1, 60)
+        self.worker = threading.Thread(target=self._work, name='mqtt-ingest', daemon=True)
+        self.worker.start()
+        self.client.connect_async(host, port)
+        self.client.loop_start()
+
+    def close(self):
+        if self.client is not None:
+            self.client.loop_stop()
+            self.client.disconnect()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Print the packets published to a Meshtastic MQTT broker.")
+    parser.add_argument('host')
+    parser.add_argument('--port', type=int, default=1883)
+    parser.add_argument('--topic', nargs='+', default=DEFAULT_TOPICS)
+    parser.add_argument('--username')
+    parser.add_argument('--password')
+    parser.add_argument('--tls', action='store_true')
+    parser.add_argument('--key', nargs=2, action='append', default=[], metavar=('CHANNEL', 'PSK'),
+                        help="Base64 key of a channel (repeatable)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    def show(packet):
+        decoded = packet['decoded']
+        print(f"{packet['fromId']} -> {packet['toId']} {decoded.get('portnum')}: "
+              f"{decoded.get('text') or {k: v for k, v in decoded.items() if k not in ('portnum', 'payload')}}")
+
+    source = MqttSource(show, dict(args.key), PacketDeduper())
+    try:
+        source.connect(args.host, args.port, args.topic, args.username, args.password, args.tls)
+    except RuntimeError as e:
+        parser.error(str(e))
+    try:
+        while True:
+            time_module.sleep(60)
+            logger.info(f"MQTT: {source.stats}, {source.queue.qsize()} queued")
+    except KeyboardInterrupt:
+        source.close()
+
+
+if __name__ == "__main__":
+    main()
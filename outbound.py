@@ -0,0 +1,51 @@
+"""Rate-limited queue for messages the daemon sends on its own (alerts, reports).
+
+Replies to Ping/Alive? still go out immediately from on_receive. Everything
+else is put() here and drained from the main loop, at most one message every
+min_interval seconds so automatic traffic cannot flood the channel.
+"""
+import logging
+import threading
+import time as time_module
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Seconds between two queued messages
+DEFAULT_MIN_INTERVAL = 30
+# Oldest messages are dropped once this many are waiting
+DEFAULT_MAX_SIZE = 100
+
+
+class OutboundQueue:
+    """FIFO of (text, destination, channel_index) drained at a limited rate."""
+
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, max_size=DEFAULT_MAX_SIZE):
+        self.min_interval = min_interval
+        self.queue = deque(maxlen=max_size)
+        self.last_sent = 0
+        self.lock = threading.Lock()
+
+    def put(self, text, destination, channel_index=0):
+        with self.lock:
+            if len(self.queue) == self.queue.maxlen:
+                logger.warning(f"Outbound queue full, dropping oldest message to {self.queue[0][1]}")
+            self.queue.append((text, destination, channel_index))
+
+    def __len__(self):
+        return len(self.queue)
+
+    def drain(self, send, now=None):
+        """Send the next message with send(text, destination, channel_index) if min_interval has passed."""
+        now = now if now is not None else time_module.time()
+        with self.lock:
+            if not self.queue or now - self.last_sent < self.min_interval:
+                return False
+            text, destination, channel_index = self.queue.popleft()
+            self.last_sent = now
+        try:
+            send(text, destination, channel_index)
+            logger.info(f"Queued message sent to {destination} on channel {channel_index}: {text}")
+        except Exception as e:
+            logger.error(f"Error sending queued message to {destination}: {e}")
+        return True
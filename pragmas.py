@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""SQLite pragma profiles for messages.db, applied by connect() to every connection.
+
+Profiles (PROFILE selects the one every script uses):
+- default: SQLite's own settings (rollback journal, synchronous=FULL).
+- sdcard:  WAL with synchronous=NORMAL, so a commit is one sequential
+           append to the WAL and fsyncs only happen at checkpoints, which
+           also means less flash wear; small cache and mmap for a
+           Raspberry Pi.
+- ssd:     the same with a 64 MB cache and 256 MB mmap.
+- durable: WAL with synchronous=FULL; a commit survives power loss, at
+           one fsync per commit.
+
+With synchronous=NORMAL in WAL mode the last commits before a power loss
+(not a crash of the script) can be rolled back; the database itself stays
+consistent. journal_mode is stored in the file, so switching back to
+'default' leaves a database in WAL mode (PRAGMA journal_mode = DELETE
+changes it).
+
+    python3 pragmas.py --dir /mnt/sdcard --dir /mnt/ssd    # compare the profiles on each disk
+"""
+import argparse
+import logging
+import os
+import sqlite3
+import tempfile
+import time as time_module
+
+logger = logging.getLogger(__name__)
+
+PROFILE = 'sdcard'
+# Seconds a connection waits for a lock held by another connection (webmap.py, a sqlite3 shell) before
+# failing with "database is locked"
+BUSY_TIMEOUT = 30
+
+PROFILES = {
+    'default': {},
+    'sdcard': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+        'mmap_size': 64 * 1024 * 1024,
+        'cache_size': -8 * 1024,  # negative: KiB
+        'journal_size_limit': 16 * 1024 * 1024,
+    },
+    'ssd': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'temp_store': 'MEMORY',
+        'mmap_size': 256 * 1024 * 1024,
+        'cache_size': -64 * 1024,
+        'journal_size_limit': 64 * 1024 * 1024,
+    },
+    'durable': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'temp_store': 'MEMORY',
+        'mmap_size': 64 * 1024 * 1024,
+        'cache_size': -8 * 1024,
+        'journal_size_limit': 16 * 1024 * 1024,
+    },
+}
+
+# database path -> connection kept open by keep_open()
+_held = {}
+
+
+def apply_profile(conn, profile=None):
+    """Run the pragmas of profile (default PROFILE) on conn."""
+    for name, value in PROFILES[profile or PROFILE].items():
+        try:
+            conn.execute(f'PRAGMA {name} = {value}')
+        except sqlite3.OperationalError as e:
+            # Switching to WAL needs a moment without other connections; the next connection retries
+            logger.debug(f"Could not set {name} = {value}: {e}")
+
+
+def connect(database_path='messages.db', profile=None, **kwargs):
+    """sqlite3.connect() with BUSY_TIMEOUT and the pragmas of profile (default PROFILE)."""
+    kwargs.setdefault('timeout', BUSY_TIMEOUT)
+    conn = sqlite3.connect(database_path, **kwargs)
+    apply_profile(conn, profile)
+    return conn
+
+
+def keep_open(database_path='messages.db'):
+    """Hold an idle connection to database_path for the life of the process.
+
+    SQLite checkpoints and deletes the WAL whenever the last connection to a
+    database closes, and the store functions open one per call. With this
+    connection open the WAL stays, commits stay appends to it, and
+    checkpoints run every wal_autocheckpoint pages and from maintenance.py.
+    """
+    if database_path not in _held:
+        _held[database_path] = connect(database_path)
+    return _held[database_path]
+
+
+def fsync_latency(directory, count=50):
+    """Milliseconds one small write + fsync takes on the disk of directory (SD cards: often 5-20 ms)."""
+    fd, path = tempfile.mkstemp(dir=directory)
+    try:
+        start = time_module.perf_counter()
+        for _ in range(count):
+            os.write(fd, b'x' * 512)
+            os.fsync(fd)
+        return (time_module.perf_counter() - start) / count * 1000
+    finally:
+        os.close(fd)
+        os.remove(path)
+
+
+def benchmark(directory, profile, rows=2000, batch=1):
+    """Ingest-like write and read timings of profile on a fresh database in directory.
+
+    rows telemetry rows are written by separate connections committing
+    batch rows each, the way meshdb's store functions do, then read back
+    with a per-node aggregate like the map's.
+    """
+    fd, path = tempfile.mkstemp(suffix='.db', dir=directory)
+    os.close(fd)
+    try:
+        conn = connect(path, profile)
+        conn.execute('''CREATE TABLE telemetry (id INTEGER PRIMARY KEY AUTOINCREMENT, node_id TEXT, battery_level INTEGER,
+                        voltage REAL, channel_utilization REAL, air_util_tx REAL, uptime_seconds INTEGER, timestamp INTEGER)''')
+        conn.execute('CREATE INDEX idx_telemetry_node_id_timestamp ON telemetry(node_id, timestamp)')
+        conn.commit()
+        # Keep the WAL between connections, like keep_open() does in the ingest process
+        held = connect(path, profile)
+
+        start = time_module.perf_counter()
+        for first in range(0, rows, batch):
+            conn = connect(path, profile)
+            conn.executemany('''INSERT INTO telemetry (node_id, battery_level, voltage, channel_utilization, air_util_tx,
+                                uptime_seconds, timestamp) VALUES (?, ?, ?, ?, ?, ?, ?)''',
+                             [(f'!{i % 50:08x}', i % 100, 3.3 + i % 10 / 10, 1.5, 0.2, i, 1700000000 + i)
+                              for i in range(first, min(first + batch, rows))])
+            conn.commit()
+            conn.close()
+        write = time_module.perf_counter() - start
+
+        start = time_module.perf_counter()
+        conn = connect(path, profile)
+        for _ in range(20):
+            conn.execute('''SELECT node_id, MAX(timestamp), AVG(voltage) FROM telemetry
+                            WHERE timestamp >= ? GROUP BY node_id''', (1700000000 + rows // 2,)).fetchall()
+        conn.close()
+        held.close()
+        read = (time_module.perf_counter() - start) / 20
+        return {'profile': profile, 'rows_per_second': rows / write, 'commit_ms': write / (rows / batch) * 1000,
+                'query_ms': read * 1000}
+    finally:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare the pragma profiles on one or more disks.")
+    parser.add_argument('--dir', action='append', help="Directory on the disk to test (repeatable, default .)")
+    parser.add_argument('--profiles', nargs='+', default=list(PROFILES), choices=list(PROFILES))
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=1, help="Rows per commit")
+    args = parser.parse_args()
+
+    for directory in args.dir or ['.']:
+        print(f"{directory} (fsync {fsync_latency(directory):.2f} ms):")
+        print(f"  {'Profile':<10}{'Rows/s':>10}{'ms/commit':>12}{'ms/query':>10}")
+        for profile in args.profiles:
+            result = benchmark(directory, profile, args.rows, args.batch)
+            print(f"  {profile:<10}{result['rows_per_second']:>10.0f}{result['commit_ms']:>12.2f}{result['query_ms']:>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+"""Node presence (last heard, last SNR, hops away) shared between get-reply.py and webmap.py.
+
+The ingest process owns a PresenceTracker and updates one fixed-size record
+per node on every packet, in a small memory-mapped file (PRESENCE_PATH). The
+web server opens the same file with PresenceReader and answers "who was heard
+in the last N minutes" from a numpy snapshot, without touching the database.
+
+A sequence counter in the header is made odd while a record is written and
+even again afterwards; readers retry when it was odd or moved while they
+copied, so they never see a half-written record.
+"""
+import os
+import threading
+import time as time_module
+
+import numpy as np
+
+PRESENCE_PATH = 'presence.bin'
+DEFAULT_CAPACITY = 16384
+MAGIC = b'MSHPRES1'
+
+HEADER = np.dtype([('magic', 'S8'), ('sequence', '<u8'), ('count', '<u4'), ('capacity', '<u4'), ('reserved', '<u8')])
+RECORD = np.dtype([('node_number', '<u4'), ('hops_away', '<i2'), ('reserved', '<i2'),
+                   ('last_heard', '<f8'), ('last_snr', '<f4'), ('last_rssi', '<f4')])
+
+
+class PresenceTracker:
+    """Writer side, used by the ingest process."""
+
+    def __init__(self, path=PRESENCE_PATH, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.lock = threading.Lock()
+        if not self._open_existing(capacity):
+            self._create(capacity)
+        self.slots = {int(n): i for i, n in enumerate(self.records['node_number'][:int(self.header['count'][0])])}
+
+    def _open_existing(self, capacity):
+        """Reuse the file left by a previous run, so presence survives a restart."""
+        if not os.path.exists(self.path) or os.path.getsize(self.path) != HEADER.itemsize + capacity * RECORD.itemsize:
+            return False
+        header = np.memmap(self.path, dtype=HEADER, mode='r+', shape=(1,))
+        if header['magic'][0] != MAGIC or header['capacity'][0] != capacity:
+            return False
+        self.header = header
+        self.records = np.memmap(self.path, dtype=RECORD, mode='r+', offset=HEADER.itemsize, shape=(capacity,))
+        # A crash mid-write could leave the counter odd
+        self.header['sequence'] += self.header['sequence'] % 2
+        return True
+
+    def _create(self, capacity):
+        # Build the new file aside and swap it in, so a reader never maps a half-initialized file
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            f.truncate(HEADER.itemsize + capacity * RECORD.itemsize)
+        header = np.memmap(temporary, dtype=HEADER, mode='r+', shape=(1,))
+        header['magic'] = MAGIC
+        header['capacity'] = capacity
+        header.flush()
+        del header
+        os.replace(temporary, self.path)
+        self.header = np.memmap(self.path, dtype=HEADER, mode='r+', shape=(1,))
+        self.records = np.memmap(self.path, dtype=RECORD, mode='r+', offset=HEADER.itemsize, shape=(capacity,))
+
+    def update(self, node_number, last_heard=None, snr=None, hops_away=None, rssi=None):
+        """Record that node_number was heard; older last_heard values do not overwrite newer ones."""
+        if node_number is None:
+            return
+        node_number = int(node_number)
+        last_heard = last_heard if last_heard is not None else time_module.time()
+        with self.lock:
+            slot = self.slots.get(node_number)
+            if slot is None:
+                slot = self._new_slot(node_number)
+            elif self.records['last_heard'][slot] > last_heard:
+                return
+            record = (node_number, hops_away if hops_away is not None else -1, 0, last_heard,
+                      snr if snr is not None else np.nan, rssi if rssi is not None else np.nan)
+            self.header['sequence'] += 1
+            self.records[slot] = record
+            self.header['sequence'] += 1
+
+    def _new_slot(self, node_number):
+        count = int(self.header['count'][0])
+        if count < len(self.records):
+            slot = count
+            self.header['sequence'] += 1
+            self.header['count'] = count + 1
+            self.header['sequence'] += 1
+        else:
+            # Full: reuse the slot of the node heard longest ago
+            slot = int(np.argmin(self.records['last_heard']))
+            del self.slots[int(self.records['node_number'][slot])]
+        self.slots[node_number] = slot
+        return slot
+
+    def flush(self):
+        """Write the mapping back to disk (other processes see updates without this)."""
+        self.records.flush()
+        self.header.flush()
+
+
+class PresenceReader:
+    """Reader side, used by the web server; reopens the file if the tracker recreated it."""
+
+    def __init__(self, path=PRESENCE_PATH):
+        self.path = path
+        self._identity = None
+        self.header = None
+        self.records = None
+
+    def _map(self):
+        try:
+            stat = os.stat(self.path)
+        except FileNotFoundError:
+            self.header = self.records = self._identity = None
+            return False
+        identity = (stat.st_ino, stat.st_size)
+        if identity != self._identity:
+            header = np.memmap(self.path, dtype=HEADER, mode='r', shape=(1,))
+            if header['magic'][0] != MAGIC:
+                return False
+            capacity = int(header['capacity'][0])
+            self.header = header
+            self.records = np.memmap(self.path, dtype=RECORD, mode='r', offset=HEADER.itemsize, shape=(capacity,))
+            self._identity = identity
+        return True
+
+    def snapshot(self, retries=100):
+        """Consistent copy of all records as a numpy structured array, or None when no tracker is running."""
+        if not self._map():
+            return None
+        for _ in range(retries):
+            before = int(self.header['sequence'][0])
+            if before % 2:
+                time_module.sleep(0)
+                continue
+            records = np.array(self.records[:int(self.header['count'][0])])
+            if int(self.header['sequence'][0]) == before:
+                return records
+        return None
+
+    def online(self, seconds, now=None):
+        """{node_number: {'last_heard', 'last_snr', 'last_rssi', 'hops_away'}} of nodes heard in the last seconds."""
+        records = self.snapshot()
+        if records is None:
+            return None
+        now = now if now is not None else time_module.time()
+        records = records[records['last_heard'] >= now - seconds]
+        return {int(r['node_number']): {
+            'last_heard': float(r['last_heard']),
+            'last_snr': None if np.isnan(r['last_snr']) else round(float(r['last_snr']), 2),
+            'last_rssi': None if np.isnan(r['last_rssi']) else float(r['last_rssi']),
+            'hops_away': None if r['hops_away'] < 0 else int(r['hops_away']),
+        } for r in records}
+
+    def last_heard(self):
+        """{node_number: last_heard} for every tracked node, or None when no tracker is running."""
+        records = self.snapshot()
+        if records is None:
+            return None
+        return dict(zip(records['node_number'].tolist(), records['last_heard'].tolist()))
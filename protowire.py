@@ -0,0 +1,453 @@
+"""Minimal protobuf wire-format decoder for the Meshtastic messages we persist.
+
+Only the fields the storage layer uses are described below; anything else is
+skipped without being decoded. The output mirrors the dicts produced by
+MessageToDict in the meshtastic library (camelCase keys, enum names, fields at
+their default value left out) so the same handlers can consume both.
+"""
+import struct
+
+WIRE_VARINT = 0
+WIRE_FIXED64 = 1
+WIRE_LEN = 2
+WIRE_FIXED32 = 5
+
+BROADCAST_NUM = 0xFFFFFFFF
+
+PORTNUM_NAMES = {
+    0: 'UNKNOWN_APP',
+    1: 'TEXT_MESSAGE_APP',
+    2: 'REMOTE_HARDWARE_APP',
+    3: 'POSITION_APP',
+    4: 'NODEINFO_APP',
+    5: 'ROUTING_APP',
+    6: 'ADMIN_APP',
+    7: 'TEXT_MESSAGE_COMPRESSED_APP',
+    8: 'WAYPOINT_APP',
+    9: 'AUDIO_APP',
+    10: 'DETECTION_SENSOR_APP',
+    32: 'REPLY_APP',
+    33: 'IP_TUNNEL_APP',
+    34: 'PAXCOUNTER_APP',
+    64: 'SERIAL_APP',
+    65: 'STORE_FORWARD_APP',
+    66: 'RANGE_TEST_APP',
+    67: 'TELEMETRY_APP',
+    68: 'ZPS_APP',
+    69: 'SIMULATOR_APP',
+    70: 'TRACEROUTE_APP',
+    71: 'NEIGHBORINFO_APP',
+    72: 'ATAK_PLUGIN',
+    73: 'MAP_REPORT_APP',
+    256: 'PRIVATE_APP',
+    257: 'ATAK_FORWARDER',
+}
+PORTNUM_VALUES = {name: value for value, name in PORTNUM_NAMES.items()}
+
+# Message schemas: field number -> (dict key, kind[, repeated])
+# A kind is a scalar type name, ('enum', name) or another schema dict.
+USER = {
+    1: ('id', 'string'),
+    2: ('longName', 'string'),
+    3: ('shortName', 'string'),
+    5: ('hwModel', ('enum', 'HardwareModel')),
+    6: ('isLicensed', 'bool'),
+}
+
+POSITION = {
+    1: ('latitudeI', 'sfixed32'),
+    2: ('longitudeI', 'sfixed32'),
+    3: ('altitude', 'int32'),
+    4: ('time', 'fixed32'),
+    7: ('timestamp', 'fixed32'),
+    15: ('groundSpeed', 'uint'),
+    16: ('groundTrack', 'uint'),
+    19: ('satsInView', 'uint'),
+    23: ('precisionBits', 'uint'),
+}
+
+DEVICE_METRICS = {
+    1: ('batteryLevel', 'uint'),
+    2: ('voltage', 'float'),
+    3: ('channelUtilization', 'float'),
+    4: ('airUtilTx', 'float'),
+    5: ('uptimeSeconds', 'uint'),
+}
+
+ENVIRONMENT_METRICS = {
+    1: ('temperature', 'float'),
+    2: ('relativeHumidity', 'float'),
+    3: ('barometricPressure', 'float'),
+    4: ('gasResistance', 'float'),
+    5: ('voltage', 'float'),
+    6: ('current', 'float'),
+    7: ('iaq', 'uint'),
+    8: ('distance', 'float'),
+    9: ('lux', 'float'),
+    10: ('whiteLux', 'float'),
+    11: ('irLux', 'float'),
+    12: ('uvLux', 'float'),
+    13: ('windDirection', 'uint'),
+    14: ('windSpeed', 'float'),
+    15: ('weight', 'float'),
+    16: ('windGust', 'float'),
+    17: ('windLull', 'float'),
+}
+
+AIR_QUALITY_METRICS = {
+    1: ('pm10Standard', 'uint'),
+    2: ('pm25Standard', 'uint'),
+    3: ('pm100Standard', 'uint'),
+    4: ('pm10Environmental', 'uint'),
+    5: ('pm25Environmental', 'uint'),
+    6: ('pm100Environmental', 'uint'),
+}
+
+POWER_METRICS = {
+    1: ('ch1Voltage', 'float'),
+    2: ('ch1Current', 'float'),
+    3: ('ch2Voltage', 'float'),
+    4: ('ch2Current', 'float'),
+    5: ('ch3Voltage', 'float'),
+    6: ('ch3Current', 'float'),
+}
+
+TELEMETRY = {
+    1: ('time', 'fixed32'),
+    2: ('deviceMetrics', DEVICE_METRICS),
+    3: ('environmentMetrics', ENVIRONMENT_METRICS),
+    4: ('airQualityMetrics', AIR_QUALITY_METRICS),
+    5: ('powerMetrics', POWER_METRICS),
+}
+
+NEIGHBOR = {
+    1: ('nodeId', 'uint'),
+    2: ('snr', 'float'),
+    3: ('lastRxTime', 'fixed32'),
+    4: ('nodeBroadcastIntervalSecs', 'uint'),
+}
+
+NEIGHBOR_INFO = {
+    1: ('nodeId', 'uint'),
+    2: ('lastSentById', 'uint'),
+    3: ('nodeBroadcastIntervalSecs', 'uint'),
+    4: ('neighbors', NEIGHBOR, True),
+}
+
+ROUTE_DISCOVERY = {
+    1: ('route', 'fixed32', True),
+    2: ('snrTowards', 'int32', True),
+    3: ('routeBack', 'fixed32', True),
+    4: ('snrBack', 'int32', True),
+}
+
+ROUTING = {
+    1: ('routeRequest', ROUTE_DISCOVERY),
+    2: ('routeReply', ROUTE_DISCOVERY),
+    3: ('errorReason', ('enum', 'Routing.Error')),
+}
+
+DATA = {
+    1: ('portnum', ('enum', 'PortNum')),
+    2: ('payload', 'bytes'),
+    3: ('wantResponse', 'bool'),
+    4: ('dest', 'fixed32'),
+    5: ('source', 'fixed32'),
+    6: ('requestId', 'fixed32'),
+    7: ('replyId', 'fixed32'),
+    8: ('emoji', 'fixed32'),
+}
+
+MESH_PACKET = {
+    1: ('from', 'fixed32'),
+    2: ('to', 'fixed32'),
+    3: ('channel', 'uint'),
+    4: ('decoded', DATA),
+    5: ('encrypted', 'bytes'),
+    6: ('id', 'fixed32'),
+    7: ('rxTime', 'fixed32'),
+    8: ('rxSnr', 'float'),
+    9: ('hopLimit', 'uint'),
+    10: ('wantAck', 'bool'),
+    11: ('priority', ('enum', 'MeshPacket.Priority')),
+    12: ('rxRssi', 'int32'),
+    14: ('viaMqtt', 'bool'),
+    15: ('hopStart', 'uint'),
+}
+
+NODE_INFO = {
+    1: ('num', 'uint'),
+    2: ('user', USER),
+    3: ('position', POSITION),
+    4: ('snr', 'float'),
+    5: ('lastHeard', 'fixed32'),
+    6: ('deviceMetrics', DEVICE_METRICS),
+    7: ('channel', 'uint'),
+    8: ('viaMqtt', 'bool'),
+    9: ('hopsAway', 'uint'),
+}
+
+MY_NODE_INFO = {
+    1: ('myNodeNum', 'uint'),
+}
+
+FROM_RADIO = {
+    1: ('id', 'uint'),
+    2: ('packet', MESH_PACKET),
+    3: ('myInfo', MY_NODE_INFO),
+    4: ('nodeInfo', NODE_INFO),
+    7: ('configCompleteId', 'uint'),
+    8: ('rebooted', 'bool'),
+}
+
+# What gateways publish to MQTT (msh/<region>/2/e/<channel>/<gateway id>)
+SERVICE_ENVELOPE = {
+    1: ('packet', MESH_PACKET),
+    2: ('channelId', 'string'),
+    3: ('gatewayId', 'string'),
+}
+
+# Where each port's payload ends up in the decoded dict, and how to parse it
+PAYLOAD_SCHEMAS = {
+    'POSITION_APP': ('position', POSITION),
+    'NODEINFO_APP': ('user', USER),
+    'ROUTING_APP': ('routing', ROUTING),
+    'TELEMETRY_APP': ('telemetry', TELEMETRY),
+    'TRACEROUTE_APP': ('traceroute', ROUTE_DISCOVERY),
+    'NEIGHBORINFO_APP': ('neighborinfo', NEIGHBOR_INFO),
+}
+
+_unpack_fixed32 = struct.Struct('<I').unpack_from
+_unpack_sfixed32 = struct.Struct('<i').unpack_from
+_unpack_float = struct.Struct('<f').unpack_from
+_pack_float = struct.Struct('<f').pack
+_unpack_double = struct.Struct('<d').unpack_from
+
+_enum_names = {'PortNum': PORTNUM_NAMES}
+
+
+def enum_name(enum, value):
+    """Translate an enum value to its name, using the meshtastic protobufs when they are installed."""
+    names = _enum_names.get(enum)
+    if names is None:
+        names = {}
+        try:
+            from meshtastic.protobuf import mesh_pb2
+            descriptor = mesh_pb2.DESCRIPTOR
+            for part in enum.split('.')[:-1]:
+                descriptor = descriptor.message_types_by_name[part]
+            descriptor = descriptor.enum_types_by_name[enum.split('.')[-1]]
+            names = {v.number: v.name for v in descriptor.values}
+        except Exception:
+            pass
+        _enum_names[enum] = names
+    return names.get(value, value)
+
+
+def read_varint(buf, pos):
+    """Read a base-128 varint from buf at pos, returning (value, new_pos)."""
+    result = 0
+    shift = 0
+    while True:
+        b = buf[pos]
+        pos += 1
+        result |= (b & 0x7F) << shift
+        if not b & 0x80:
+            return result, pos
+        shift += 7
+
+
+def encode_varint(value):
+    """Encode a non-negative integer as a base-128 varint."""
+    out = bytearray()
+    while True:
+        b = value & 0x7F
+        value >>= 7
+        if value:
+            out.append(b | 0x80)
+        else:
+            out.append(b)
+            return bytes(out)
+
+
+def iter_fields(buf):
+    """Yield (field_number, wire_type, value) for each field in a serialized message.
+
+    Varints are returned as ints, everything else as memoryview slices of buf (no copies).
+    """
+    buf = memoryview(buf)
+    pos = 0
+    end = len(buf)
+    while pos < end:
+        key, pos = read_varint(buf, pos)
+        field_number = key >> 3
+        wire_type = key & 7
+        if wire_type == WIRE_VARINT:
+            value, pos = read_varint(buf, pos)
+        elif wire_type == WIRE_LEN:
+            length, pos = read_varint(buf, pos)
+            value = buf[pos:pos + length]
+            pos += length
+        elif wire_type == WIRE_FIXED32:
+            value = buf[pos:pos + 4]
+            pos += 4
+        elif wire_type == WIRE_FIXED64:
+            value = buf[pos:pos + 8]
+            pos += 8
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type} for field {field_number}")
+        if pos > end:
+            raise ValueError("Truncated protobuf message")
+        yield field_number, wire_type, value
+
+
+def _shortest_float(value):
+    """Shortest decimal that round-trips through float32 (4.1 rather than 4.099999904632568), as protobuf does."""
+    for precision in range(6, 10):
+        rounded = float(f'{value:.{precision}g}')
+        if _unpack_float(_pack_float(rounded))[0] == value:
+            return rounded
+    return value
+
+
+def _scalar(kind, wire_type, value):
+    if kind == 'uint':
+        return value
+    if kind == 'bool':
+        return bool(value)
+    if kind == 'int32':
+        # Negative int32 values are sign-extended to 64 bits on the wire
+        return value - (1 << 64) if value >= (1 << 63) else value
+    if kind == 'sint':
+        return (value >> 1) ^ -(value & 1)
+    if kind == 'fixed32':
+        return _unpack_fixed32(value)[0]
+    if kind == 'sfixed32':
+        return _unpack_sfixed32(value)[0]
+    if kind == 'float':
+        return _shortest_float(_unpack_float(value)[0])
+    if kind == 'double':
+        return _unpack_double(value)[0]
+    if kind == 'string':
+        return str(value, 'utf-8', 'replace')
+    if kind == 'bytes':
+        return bytes(value)
+    if isinstance(kind, tuple):
+        return enum_name(kind[1], value)
+    raise ValueError(f"Unknown field kind {kind}")
+
+
+def _packed(kind, value):
+    if kind == 'fixed32':
+        return list(struct.unpack(f'<{len(value) // 4}I', value))
+    if kind == 'float':
+        return [_shortest_float(x) for x in struct.unpack(f'<{len(value) // 4}f', value)]
+    values = []
+    pos = 0
+    while pos < len(value):
+        item, pos = read_varint(value, pos)
+        values.append(_scalar(kind, WIRE_VARINT, item))
+    return values
+
+
+def decode_message(buf, schema):
+    """Decode the fields listed in schema from a serialized message into a dict."""
+    result = {}
+    for field_number, wire_type, value in iter_fields(buf):
+        spec = schema.get(field_number)
+        if spec is None:
+            continue
+        name, kind = spec[0], spec[1]
+        repeated = len(spec) > 2 and spec[2]
+        if isinstance(kind, dict):
+            item = decode_message(value, kind)
+        elif repeated and wire_type == WIRE_LEN and kind not in ('string', 'bytes'):
+            result.setdefault(name, []).extend(_packed(kind, value))
+            continue
+        else:
+            item = _scalar(kind, wire_type, value)
+        if repeated:
+            result.setdefault(name, []).append(item)
+        else:
+            result[name] = item
+    return result
+
+
+def node_id(num):
+    """Format a node number the way the meshtastic library does (!a1b2c3d4, ^all for broadcast)."""
+    if num is None:
+        return None
+    if num == BROADCAST_NUM:
+        return '^all'
+    return f'!{num:08x}'
+
+
+def fixup_position(position):
+    """Add float latitude/longitude next to the integer fields, like the meshtastic library does."""
+    if 'latitudeI' in position:
+        position['latitude'] = position['latitudeI'] * 1e-7
+    if 'longitudeI' in position:
+        position['longitude'] = position['longitudeI'] * 1e-7
+    return position
+
+
+def decode_payload(decoded):
+    """Parse decoded['payload'] according to its portnum and attach the result to decoded."""
+    portnum = decoded.get('portnum')
+    payload = decoded.get('payload', b'')
+    if portnum == 'TEXT_MESSAGE_APP':
+        decoded['text'] = str(payload, 'utf-8', 'replace')
+        return decoded
+    target = PAYLOAD_SCHEMAS.get(portnum)
+    if target is None:
+        return decoded
+    key, schema = target
+    try:
+        value = decode_message(payload, schema)
+    except (ValueError, IndexError, struct.error):
+        return decoded
+    if key == 'position':
+        fixup_position(value)
+    decoded[key] = value
+    return decoded
+
+
+def decode_mesh_packet(buf, with_payload=True):
+    """Decode a serialized MeshPacket into a meshtastic-style packet dict."""
+    packet = decode_message(buf, MESH_PACKET)
+    packet['fromId'] = node_id(packet.get('from'))
+    packet['toId'] = node_id(packet.get('to', 0))
+    if with_payload and 'decoded' in packet:
+        decode_payload(packet['decoded'])
+    return packet
+
+
+def decode_from_radio(buf):
+    """Decode a serialized FromRadio frame; packets and node infos are turned into meshtastic-style dicts.
+
+    message['packetBytes'] is a view into buf holding the undecoded MeshPacket, only valid as long as buf is.
+    """
+    message = {}
+    for field_number, wire_type, value in iter_fields(buf):
+        if field_number == 2:
+            message['packet'] = decode_mesh_packet(value)
+            message['packetBytes'] = value
+        elif field_number in FROM_RADIO:
+            name, kind = FROM_RADIO[field_number][:2]
+            message[name] = decode_message(value, kind) if isinstance(kind, dict) else _scalar(kind, wire_type, value)
+    node_info = message.get('nodeInfo')
+    if node_info and 'position' in node_info:
+        fixup_position(node_info['position'])
+    return message
+
+
+def decode_service_envelope(buf):
+    """Decode an MQTT ServiceEnvelope; the packet is turned into a meshtastic-style dict like in decode_from_radio."""
+    envelope = {}
+    for field_number, wire_type, value in iter_fields(buf):
+        if field_number == 1:
+            envelope['packet'] = decode_mesh_packet(value)
+        elif field_number in SERVICE_ENVELOPE:
+            name, kind = SERVICE_ENVELOPE[field_number][:2]
+            envelope[name] = _scalar(kind, wire_type, value)
+    return envelope
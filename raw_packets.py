@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Lazy access to the raw_packets table.
+
+Rows hold the original MeshPacket protobuf bytes. Nothing is decoded until a
+field is asked for, so a backfill that only needs, say, power metrics from
+TELEMETRY_APP packets pays for exactly that:
+
+    for raw in iter_raw_packets(portnum='TELEMETRY_APP', since=1722470400):
+        power = raw.payload.get('powerMetrics')
+"""
+import argparse
+from collections import Counter
+
+import protowire
+from pragmas import connect
+
+
+class RawPacket:
+    """One raw_packets row; the protobuf is only decoded on first access to packet/payload."""
+
+    __slots__ = ('id', 'from_node', 'portnum', 'rx_time', 'data', '_packet')
+
+    def __init__(self, id, from_node, portnum, rx_time, data):
+        self.id = id
+        self.from_node = from_node
+        self.portnum = portnum
+        self.rx_time = rx_time
+        self.data = data
+        self._packet = None
+
+    @property
+    def portnum_name(self):
+        return protowire.PORTNUM_NAMES.get(self.portnum, self.portnum)
+
+    @property
+    def from_id(self):
+        return protowire.node_id(self.from_node)
+
+    @property
+    def packet(self):
+        """The whole packet as a meshtastic-style dict."""
+        if self._packet is None:
+            self._packet = protowire.decode_mesh_packet(self.data)
+        return self._packet
+
+    @property
+    def payload(self):
+        """Just the decoded application payload (telemetry, position, ...), or {} if there is none."""
+        decoded = self.packet.get('decoded', {})
+        target = protowire.PAYLOAD_SCHEMAS.get(decoded.get('portnum'))
+        if target is None:
+            return {'text': decoded['text']} if 'text' in decoded else {}
+        return decoded.get(target[0], {})
+
+
+def iter_raw_packets(database_path='messages.db', from_node=None, portnum=None, since=None, until=None, batch_size=500):
+    """Yield RawPacket objects in id order, reading batch_size rows at a time.
+
+    from_node is a node number, portnum a number or a name such as 'TELEMETRY_APP',
+    since/until are rx_time bounds (inclusive/exclusive).
+    """
+    if isinstance(portnum, str):
+        portnum = protowire.PORTNUM_VALUES[portnum]
+    conditions = ['id > ?']
+    params = []
+    if from_node is not None:
+        conditions.append('from_node = ?')
+        params.append(from_node)
+    if portnum is not None:
+        conditions.append('portnum = ?')
+        params.append(portnum)
+    if since is not None:
+        conditions.append('rx_time >= ?')
+        params.append(since)
+    if until is not None:
+        conditions.append('rx_time < ?')
+        params.append(until)
+    query = f"""SELECT id, from_node, portnum, rx_time, packet FROM raw_packets
+                WHERE {' AND '.join(conditions)} ORDER BY id LIMIT ?"""
+
+    conn = connect(database_path)
+    try:
+        last_id = 0
+        while True:
+            rows = conn.execute(query, [last_id] + params + [batch_size]).fetchall()
+            if not rows:
+                break
+            for row in rows:
+                yield RawPacket(*row)
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+
+def backfill(handler, database_path='messages.db', **filters):
+    """Call handler(raw_packet) for every stored packet matching filters; returns how many were handled."""
+    count = 0
+    for raw in iter_raw_packets(database_path, **filters):
+        handler(raw)
+        count += 1
+    return count
+
+
+def summarize(database_path='messages.db'):
+    """Count stored raw packets per port."""
+    conn = connect(database_path)
+    rows = conn.execute('SELECT portnum, COUNT(*), SUM(LENGTH(packet)) FROM raw_packets GROUP BY portnum').fetchall()
+    conn.close()
+    return {protowire.PORTNUM_NAMES.get(portnum, portnum): (count, size) for portnum, count, size in rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect raw packets stored in messages.db.")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    parser.add_argument('--portnum', help="Only show this port, e.g. TELEMETRY_APP")
+    parser.add_argument('--limit', type=int, default=20, help="Number of packets to print")
+    args = parser.parse_args()
+
+    if not args.portnum:
+        for portnum, (count, size) in summarize(args.db).items():
+            print(f"{portnum}: {count} packets, {size} bytes")
+        return
+
+    fields = Counter()
+    for i, raw in enumerate(iter_raw_packets(args.db, portnum=args.portnum)):
+        if i < args.limit:
+            print(f"{raw.rx_time} {raw.from_id}: {raw.payload}")
+        fields.update(raw.payload.keys())
+    print(f"Payload fields seen: {dict(fields)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+"""Full-text message search over the messages_fts index (see meshdb.initialize_message_fts).
+
+Results are newest first by id (messages are stored in arrival order), which
+FTS5 can return straight from its index, so a LIMIT stops early even for
+common words. Pages use a keyset cursor: pass the 'next' id of one page as
+before= to get the next one, so deep pages cost the same as the first.
+Without FTS5 the sender, recipient, channel and time filters use the
+(column, timestamp) indexes on messages.
+
+    python3 search.py "battery low" --sender '!a1b2c3d4' --since 2024-08-01
+    python3 search.py --benchmark hello
+"""
+import argparse
+import datetime
+import re
+import time as time_module
+
+from pragmas import connect
+
+DEFAULT_LIMIT = 50
+
+
+def fts_query(text):
+    """Turn plain user text into an FTS5 query matching all words (prefix match on the last one)."""
+    words = re.findall(r'\w+', text, flags=re.UNICODE)
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += '*'
+    return ' '.join(terms)
+
+
+def has_fts(conn):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'").fetchone() is not None
+
+
+def _filters(sender, recipient, channel, since, until):
+    clauses = []
+    params = []
+    for column, value in (('m.sender', sender), ('m.recipient', recipient), ('m.channel', channel)):
+        if value is not None:
+            clauses.append(f'{column} = ?')
+            params.append(value)
+    if since is not None:
+        clauses.append('m.timestamp >= ?')
+        params.append(since)
+    if until is not None:
+        clauses.append('m.timestamp < ?')
+        params.append(until)
+    return clauses, params
+
+
+def search_messages(text, sender=None, recipient=None, channel=None, since=None, until=None, before=None,
+                    limit=DEFAULT_LIMIT, raw=False, database_path='messages.db'):
+    """One page of messages matching text, newest first.
+
+    Returns (rows, next) where rows are dicts (id, message_id, sender,
+    recipient, channel, timestamp, message, snippet) and next is the id to
+    pass as before= for the following page, or None on the last page. raw=True passes text
+    to FTS5 unchanged (AND/OR/NEAR, "phrases", prefix*).
+    """
+    conn = connect(database_path)
+    clauses, params = _filters(sender, recipient, channel, since, until)
+    if has_fts(conn):
+        match = text if raw else fts_query(text)
+        if match is None:
+            conn.close()
+            return [], None
+        query = '''SELECT m.id, m.message_id, m.sender, m.recipient, m.channel, m.timestamp, m.message,
+                          snippet(messages_fts, 0, '[', ']', '…', 12)
+                   FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                   WHERE messages_fts MATCH ?'''
+        params = [match] + params
+        if before is not None:
+            query += ' AND messages_fts.rowid < ?'
+            params.append(before)
+        order = ' ORDER BY messages_fts.rowid DESC'
+    else:
+        query = '''SELECT m.id, m.message_id, m.sender, m.recipient, m.channel, m.timestamp, m.message, m.message
+                   FROM messages m WHERE m.message LIKE ?'''
+        params = [f'%{text}%'] + params
+        if before is not None:
+            query += ' AND m.id < ?'
+            params.append(before)
+        order = ' ORDER BY m.id DESC'
+    for clause in clauses:
+        query += ' AND ' + clause
+    query += order + ' LIMIT ?'
+    params.append(limit + 1)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+
+    keys = ('id', 'message_id', 'sender', 'recipient', 'channel', 'timestamp', 'message', 'snippet')
+    results = [dict(zip(keys, row)) for row in rows[:limit]]
+    following = results[-1]['id'] if len(rows) > limit else None
+    return results, following
+
+
+def like_baseline(text, limit=DEFAULT_LIMIT, database_path='messages.db'):
+    """The old way: a LIKE scan over every message."""
+    conn = connect(database_path)
+    rows = conn.execute('''SELECT id, message FROM messages WHERE message LIKE ?
+                           ORDER BY id DESC LIMIT ?''', (f'%{text}%', limit)).fetchall()
+    conn.close()
+    return rows
+
+
+def benchmark(text, repeat=5, database_path='messages.db'):
+    """(FTS seconds, LIKE seconds) per query, best of repeat."""
+    timings = []
+    for search in (lambda: search_messages(text, database_path=database_path),
+                   lambda: like_baseline(text, database_path=database_path)):
+        best = float('inf')
+        for _ in range(repeat):
+            start = time_module.perf_counter()
+            search()
+            best = min(best, time_module.perf_counter() - start)
+        timings.append(best)
+    return tuple(timings)
+
+
+def _timestamp(value):
+    return int(datetime.datetime.strptime(value, '%Y-%m-%d').timestamp()) if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Search stored messages.")
+    parser.add_argument('text', nargs='?', help="Words to search for")
+    parser.add_argument('--sender', help="Sender id, e.g. !a1b2c3d4")
+    parser.add_argument('--recipient', help="Recipient id, or ^all")
+    parser.add_argument('--channel', type=int)
+    parser.add_argument('--since', help="Start date (YYYY-MM-DD)")
+    parser.add_argument('--until', help="End date (YYYY-MM-DD)")
+    parser.add_argument('--limit', type=int, default=DEFAULT_LIMIT)
+    parser.add_argument('--raw', action='store_true', help="Pass the text to FTS5 as a query expression")
+    parser.add_argument('--benchmark', metavar='TEXT', help="Compare FTS and LIKE search times for TEXT")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    args = parser.parse_args()
+
+    if args.benchmark:
+        fts_seconds, like_seconds = benchmark(args.benchmark, database_path=args.db)
+        print(f"FTS5: {fts_seconds * 1000:.1f} ms, LIKE: {like_seconds * 1000:.1f} ms "
+              f"({like_seconds / max(fts_seconds, 1e-9):.0f}x)")
+        return
+    if not args.text:
+        parser.error("give the text to search for")
+
+    rows, _ = search_messages(args.text, args.sender, args.recipient, args.channel, _timestamp(args.since),
+                              _timestamp(args.until), limit=args.limit, raw=args.raw, database_path=args.db)
+    for row in rows:
+        when = datetime.datetime.fromtimestamp(row['timestamp']).strftime('%d.%m.%Y %H:%M:%S')
+        print(f"{when} {row['sender']} -> {row['recipient']} (ch {row['channel']}): {row['snippet']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""Durable spool in front of the meshdb store functions, so a locked database never costs a packet.
+
+on_receive does not write to messages.db itself. It calls
+
+    spool.put('write_telemetry', node_id, samples)
+
+which appends one JSON line to an append-only log in spool/ and returns.
+Lines are written to the OS at once (they survive the process crashing)
+and fsync'ed in batches, every FSYNC_RECORDS records or FSYNC_INTERVAL
+seconds (they survive power loss after that). The log is split into
+segment files named by their first sequence number, like the change feed
+(see changefeed.py), and is read back with its ChangeReader.
+
+A drain thread applies the records in order by calling the store
+function with the recorded arguments. Records are retried, so the
+handlers must only write: the dead-band filters and anomaly detectors
+run once, before put() (see meshdb.filter_telemetry). Connections wait BUSY_TIMEOUT for a
+lock (see pragmas.py); if the database is still locked or busy the record
+stays in the spool and is retried after a growing delay (RETRY_DELAY up to
+MAX_RETRY_DELAY). Any other error is logged and the record is skipped, so
+one bad record cannot block the rest.
+
+If the spool itself cannot be written (disk full), put() calls the
+store function directly; if that fails too the record is logged and
+counted as dropped rather than raised into on_receive.
+
+The last applied sequence number is kept in spool/drained, written once
+per drain batch, and segments that are completely applied are deleted.
+On startup the drain thread replays whatever is still pending. Delivery
+is at least once: a crash before spool/drained is updated applies the
+records of that batch again (messages are de-duplicated by message_id,
+other tables may get duplicate rows).
+
+    python3 spool.py            # pending records
+    python3 spool.py --drain    # apply them while get-reply.py is stopped
+"""
+import argparse
+import base64
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time as time_module
+
+from changefeed import ChangeReader, _segments
+
+logger = logging.getLogger(__name__)
+
+SPOOL_DIR = 'spool'
+SEGMENT_BYTES = 4 * 1024 * 1024
+FSYNC_RECORDS = 50
+FSYNC_INTERVAL = 0.5
+# Records applied per drain pass
+DRAIN_BATCH = 500
+# Delay before retrying a locked database; doubled on every failure up to MAX_RETRY_DELAY (seconds)
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+SUFFIX = '.jsonl'
+DRAINED_FILE = 'drained'
+
+
+def _encode(value):
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return {'$bytes': base64.b64encode(bytes(value)).decode('ascii')}
+    return value
+
+
+def _decode(value):
+    if isinstance(value, dict) and '$bytes' in value:
+        return base64.b64decode(value['$bytes'])
+    return value
+
+
+def _last_seq(path):
+    """Sequence number of the last complete record in a segment, None if it has none."""
+    with open(path, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        size = f.tell()
+        f.seek(max(size - 65536, 0))
+        lines = f.read().split(b'\n')[:-1]
+    return json.loads(lines[-1])['seq'] if lines and lines[-1] else None
+
+
+def _read_drained(directory):
+    try:
+        with open(os.path.join(directory, DRAINED_FILE)) as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return None
+
+
+def spool_status(directory=SPOOL_DIR):
+    """{'depth': records not yet applied, 'last_seq', 'drained', 'oldest': time of the oldest pending record}.
+
+    Reads only the spool files, so it works from any process (webmap.py).
+    """
+    segments = _segments(directory)
+    last = None
+    for first, path in reversed(segments):
+        last = _last_seq(path)
+        if last is not None:
+            break
+    drained = _read_drained(directory)
+    if drained is None:
+        drained = segments[0][0] - 1 if segments else 0
+    last = max(last or 0, drained)
+    oldest = None
+    if last > drained:
+        pending = ChangeReader(directory).read(drained, 1)
+        oldest = pending[0]['time'] if pending else None
+    return {'depth': last - drained, 'last_seq': last, 'drained': drained, 'oldest': oldest}
+
+
+def _is_locked(error):
+    message = str(error).lower()
+    return 'locked' in message or 'busy' in message
+
+
+class Spool:
+    """Append-only log of store calls (op name + arguments), applied to the database by a drain thread.
+
+    handlers maps op names to the functions put() records calls to, e.g.
+    {'store_message': meshdb.store_message}.
+    """
+
+    def __init__(self, handlers, directory=SPOOL_DIR, segment_bytes=SEGMENT_BYTES, fsync_records=FSYNC_RECORDS,
+                 fsync_interval=FSYNC_INTERVAL):
+        self.handlers = handlers
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_records = fsync_records
+        self.fsync_interval = fsync_interval
+        self.lock = threading.Lock()
+        self.file = None
+        self.unsynced = 0
+        self.last_sync = time_module.time()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.retry_delay = RETRY_DELAY
+        self.blocked = False
+        self.stats = {'spooled': 0, 'applied': 0, 'failed': 0, 'retries': 0, 'dropped': 0}
+        self._open()
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        segments = _segments(self.directory)
+        drained = _read_drained(self.directory)
+        self.drained = drained if drained is not None else (segments[0][0] - 1 if segments else 0)
+        self.seq = self.drained
+        if segments:
+            path = segments[-1][1]
+            with open(path, 'rb+') as f:
+                data = f.read()
+                end = data.rfind(b'\n') + 1
+                if end < len(data):
+                    # A record cut off by a crash was never acknowledged to anyone
+                    f.truncate(end)
+            lines = data[:end].splitlines()
+            self.seq = max(self.seq, json.loads(lines[-1])['seq'] if lines else segments[-1][0] - 1)
+            self.file = open(path, 'a', encoding='utf-8')
+        else:
+            self._rotate()
+        self.reader = ChangeReader(self.directory)
+        if self.depth:
+            logger.info(f"Spool has {self.depth} records left from the last run, replaying them")
+
+    def _rotate(self):
+        if self.file is not None:
+            self._sync()
+            self.file.close()
+        self.file = open(os.path.join(self.directory, f'{self.seq + 1:020d}{SUFFIX}'), 'a', encoding='utf-8')
+
+    @property
+    def depth(self):
+        """Records spooled but not yet applied to the database."""
+        return self.seq - self.drained
+
+    def put(self, op, *args):
+        """Persist a call of handlers[op](*args); it is applied to the database by the drain thread."""
+        now = time_module.time()
+        try:
+            with self.lock:
+                record = {'seq': self.seq + 1, 'op': op, 'args': [_encode(arg) for arg in args], 'time': now}
+                self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+                self.file.flush()
+                self.seq += 1
+                self.unsynced += 1
+                self.stats['spooled'] += 1
+                if self.unsynced >= self.fsync_records or now - self.last_sync >= self.fsync_interval:
+                    self._sync(now)
+                if self.file.tell() >= self.segment_bytes:
+                    self._rotate()
+        except (OSError, TypeError, ValueError) as e:
+            # Spool not writable (disk full?) or arguments not JSON: store directly rather than drop the packet
+            logger.error(f"Error writing to spool, storing {op} directly: {e}")
+            try:
+                self.handlers[op](*args)
+            except Exception as e:
+                # Never raise into the radio/MQTT callback; a locked database loses this record
+                self.stats['dropped'] += 1
+                logger.error(f"Error storing {op} directly, record dropped: {e}")
+            return
+        self.wakeup.set()
+
+    def sync(self):
+        """fsync records written since the last sync."""
+        with self.lock:
+            self._sync()
+
+    def _sync(self, now=None):
+        if self.unsynced:
+            os.fsync(self.file.fileno())
+            self.unsynced = 0
+        self.last_sync = now if now is not None else time_module.time()
+
+    def drain(self, limit=DRAIN_BATCH):
+        """Apply up to limit pending records in order; returns how many were applied or skipped.
+
+        Stops at the first record that fails because the database is locked
+        or busy; it is retried on the next call.
+        """
+        done = 0
+        self.blocked = False
+        for record in self.reader.read(self.drained, limit):
+            handler = self.handlers.get(record['op'])
+            try:
+                if handler is None:
+                    raise ValueError(f"no handler for {record['op']}")
+                handler(*[_decode(arg) for arg in record['args']])
+                self.stats['applied'] += 1
+            except sqlite3.OperationalError as e:
+                if _is_locked(e):
+                    self.stats['retries'] += 1
+                    logger.warning(f"Database busy, {self.depth} records waiting in the spool: {e}")
+                    self.blocked = True
+                    break
+                self.stats['failed'] += 1
+                logger.error(f"Error applying spooled {record['op']} #{record['seq']}, skipped: {e}")
+            except Exception as e:
+                self.stats['failed'] += 1
+                logger.error(f"Error applying spooled {record['op']} #{record['seq']}, skipped: {e}")
+            self.drained = record['seq']
+            done += 1
+        if done:
+            # Once per batch rather than per record: a crash re-applies at most this batch (at least once anyway)
+            self._save_drained()
+            self._delete_drained()
+        return done
+
+    def _save_drained(self):
+        path = os.path.join(self.directory, DRAINED_FILE)
+        with open(path + '.tmp', 'w') as f:
+            f.write(str(self.drained))
+        os.replace(path + '.tmp', path)
+
+    def _delete_drained(self):
+        """Remove segments whose records are all applied (never the one being written)."""
+        segments = _segments(self.directory)
+        for (first, path), (following, _) in zip(segments, segments[1:]):
+            if following - 1 > self.drained:
+                break
+            os.remove(path)
+            if self.reader.position is not None and self.reader.position[0] == path:
+                self.reader.position = None
+
+    def _run(self):
+        while True:
+            self.wakeup.wait(self.fsync_interval)
+            self.wakeup.clear()
+            if self.unsynced and time_module.time() - self.last_sync >= self.fsync_interval:
+                self.sync()
+            while self.depth and self.drain() and not self.blocked:
+                pass
+            if self.blocked:
+                # Stopped on a locked database: back off before trying again
+                time_module.sleep(self.retry_delay)
+                self.retry_delay = min(self.retry_delay * 2, MAX_RETRY_DELAY)
+                self.wakeup.set()
+            else:
+                self.retry_delay = RETRY_DELAY
+
+    def start(self):
+        """Start the drain thread; records left over from the last run are applied first."""
+        self.thread = threading.Thread(target=self._run, name='spool-drain', daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """fsync what was written; pending records stay in the spool for the next start."""
+        with self.lock:
+            self._sync()
+            self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Show or apply records waiting in the ingest spool.")
+    parser.add_argument('--dir', default=SPOOL_DIR)
+    parser.add_argument('--drain', action='store_true', help="Apply pending records to messages.db (stop get-reply.py first)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    if args.drain:
+        import meshdb
+        meshdb.initialize_db()
+        spool = Spool({name: getattr(meshdb, name) for name in dir(meshdb)
+                       if name.startswith(('store_', 'write_', 'upsert_'))}, args.dir)
+        while spool.depth and spool.drain():
+            pass
+        spool.close()
+        print(f"Applied {spool.stats['applied']} records, {spool.stats['failed']} failed, {spool.depth} still pending")
+        return
+    status = spool_status(args.dir)
+    oldest = ''
+    if status['oldest'] is not None:
+        oldest = f", oldest from {time_module.strftime('%Y-%m-%d %H:%M:%S', time_module.localtime(status['oldest']))}"
+    print(f"{status['depth']} records pending (last {status['last_seq']}, applied up to {status['drained']}{oldest})")
+
+
+if __name__ == "__main__":
+    main()
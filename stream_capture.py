@@ -0,0 +1,415 @@
+#!/usr/bin/env python3
+"""Fast capture of Meshtastic packets straight from the serial/TCP stream API.
+
+Skips meshtastic.serial_interface, pubsub and MessageToDict: frames are cut out
+of a reusable buffer, decoded with protowire (only the fields we persist) and
+handed to the same meshdb store functions get-reply.py uses. No replies are sent.
+
+    python3 stream_capture.py --port /dev/ttyUSB0 --record capture.bin
+    python3 stream_capture.py --host 192.168.1.50
+    python3 stream_capture.py --replay capture.bin
+    python3 stream_capture.py --benchmark capture.bin
+"""
+import argparse
+import base64
+import logging
+import random
+import socket
+import time as time_module
+
+import protowire
+from meshdb import (initialize_db, store_message, store_telemetry, store_position, store_environment,
+                    store_traceroute, store_routing, upsert_node, store_neighbors, sync_nodedb, store_raw_packet)
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    datefmt='%Y-%m-%d %H:%M:%S'
+)
+logger = logging.getLogger(__name__)
+
+# StreamInterface framing: START1 START2 <length MSB> <length LSB> <protobuf>
+START1 = 0x94
+START2 = 0xC3
+HEADER_LEN = 4
+MAX_TO_FROM_RADIO_SIZE = 512
+TCP_PORT = 4403
+SERIAL_BAUDRATE = 115200
+# The radio drops the API client if it does not hear from it for a while
+HEARTBEAT_INTERVAL = 300
+# Also keep the original protobuf of every packet in raw_packets (--raw)
+STORE_RAW_PACKETS = False
+
+
+class StreamFramer:
+    """Cut FromRadio frames out of a byte stream using one reusable buffer.
+
+    readinto(view) must fill view and return the number of bytes read, 0 at end
+    of stream, or None when no data arrived yet (e.g. a serial read timeout).
+    """
+
+    def __init__(self, readinto, bufsize=64 * 1024):
+        self._readinto = readinto
+        self._buf = bytearray(bufsize)
+        self._view = memoryview(self._buf)
+        self._start = 0
+        self._end = 0
+        self.frames_read = 0
+        self.bytes_skipped = 0
+
+    def _fill(self):
+        # Move the unread tail to the front when there is no room for a full frame behind it
+        if len(self._buf) - self._end < HEADER_LEN + MAX_TO_FROM_RADIO_SIZE:
+            remaining = self._end - self._start
+            self._buf[:remaining] = bytes(self._view[self._start:self._end])
+            self._start, self._end = 0, remaining
+        n = self._readinto(self._view[self._end:])
+        if n:
+            self._end += n
+        return n
+
+    def frames(self):
+        """Yield each frame payload as a memoryview, or None when a read returned no data.
+
+        The view points into the shared buffer and is only valid until the next frame is requested.
+        """
+        buf = self._buf
+        view = self._view
+        while True:
+            while self._end - self._start >= HEADER_LEN:
+                start = buf.find(b'\x94\xc3', self._start, self._end)
+                if start < 0:
+                    # Anything before a header is debug log output; keep a trailing START1 byte
+                    keep = self._end - 1 if buf[self._end - 1] == START1 else self._end
+                    self.bytes_skipped += keep - self._start
+                    self._start = keep
+                    break
+                self.bytes_skipped += start - self._start
+                self._start = start
+                if self._end - start < HEADER_LEN:
+                    break
+                length = (buf[start + 2] << 8) | buf[start + 3]
+                if length > MAX_TO_FROM_RADIO_SIZE:
+                    # Not a real header, resync on the next byte
+                    self._start = start + 1
+                    self.bytes_skipped += 1
+                    continue
+                if self._end - start < HEADER_LEN + length:
+                    break
+                self._start = start + HEADER_LEN + length
+                self.frames_read += 1
+                yield view[start + HEADER_LEN:self._start]
+            n = self._fill()
+            if n == 0:
+                return
+            if n is None:
+                yield None
+
+
+def frame(payload):
+    """Wrap a serialized ToRadio message in the stream header."""
+    return bytes((START1, START2, len(payload) >> 8, len(payload) & 0xFF)) + payload
+
+
+def want_config_frame(config_id):
+    """ToRadio { want_config_id } asks the radio to dump its NodeDB and start streaming packets."""
+    return frame(b'\x18' + protowire.encode_varint(config_id))
+
+
+def heartbeat_frame():
+    """ToRadio { heartbeat {} } keeps the API session alive."""
+    return frame(b'\x3a\x00')
+
+
+def open_serial(port):
+    """Open a serial port, returning (readinto, write, close)."""
+    import serial
+    ser = serial.Serial(port, SERIAL_BAUDRATE, timeout=0.5)
+    return (lambda view: ser.readinto(view) or None), ser.write, ser.close
+
+
+def open_tcp(host, port=TCP_PORT):
+    """Connect to a network-enabled node, returning (readinto, write, close)."""
+    sock = socket.create_connection((host, port))
+    sock.settimeout(0.5)
+
+    def readinto(view):
+        try:
+            return sock.recv_into(view)
+        except socket.timeout:
+            return None
+
+    return readinto, sock.sendall, sock.close
+
+
+def recording(readinto, record_file):
+    """Wrap readinto so every received byte is also appended to a capture file for later replay."""
+    def readinto_and_record(view):
+        n = readinto(view)
+        if n:
+            record_file.write(view[:n])
+        return n
+    return readinto_and_record
+
+
+def _upsert_from_packet(num, user_id, nodes, last_heard=None):
+    """Upsert a node seen in a packet header; last_heard=None keeps the last_heard already known."""
+    if num is None or num == protowire.BROADCAST_NUM:
+        return
+    node = nodes.setdefault(user_id, {'num': num, 'user': {'id': user_id}})
+    if last_heard is not None:
+        node['lastHeard'] = last_heard
+    last_heard = node.get('lastHeard')
+    user = node.get('user', {})
+    upsert_node(user_id, num, user.get('shortName', ''), user.get('longName', ''), user.get('hwModel', ''), last_heard)
+
+
+def store_packet(packet, nodes, timestamp):
+    """Persist one decoded MeshPacket the same way on_receive in get-reply.py does."""
+    fromId = packet.get('fromId')
+    toId = packet.get('toId')
+    channel = packet.get('channel', 0)
+    last_heard = packet.get('rxTime') or timestamp
+
+    _upsert_from_packet(packet.get('from'), fromId, nodes, last_heard)
+    # Being sent a packet is not being heard (a DM to an offline node)
+    _upsert_from_packet(packet.get('to'), toId, nodes)
+
+    if 'encrypted' in packet:
+        encrypted_text = base64.b64encode(packet['encrypted']).decode('ascii')
+        store_message(packet.get('id'), fromId, toId, encrypted_text, timestamp, channel)
+        return
+
+    decoded = packet.get('decoded')
+    if decoded is None:
+        return
+    portnum = decoded.get('portnum')
+
+    if portnum == 'TEXT_MESSAGE_APP' and decoded.get('text'):
+        store_message(packet.get('id'), fromId, toId, decoded['text'], timestamp, channel)
+
+    elif portnum == 'TELEMETRY_APP':
+        telemetry = decoded.get('telemetry', {})
+        metrics = telemetry.get('deviceMetrics')
+        if metrics:
+            store_telemetry(fromId, metrics.get('batteryLevel'), metrics.get('voltage'), metrics.get('channelUtilization'),
+                            metrics.get('airUtilTx'), metrics.get('uptimeSeconds'), timestamp)
+        environment = telemetry.get('environmentMetrics')
+        if environment:
+            store_environment(fromId, environment.get('temperature'), environment.get('relativeHumidity'),
+                              environment.get('barometricPressure'), environment.get('iaq'), timestamp)
+
+    elif portnum == 'POSITION_APP':
+        position = decoded.get('position', {})
+        store_position(fromId, position.get('latitude'), position.get('longitude'), position.get('altitude'),
+                       position.get('time'), position.get('satsInView'), timestamp)
+
+    elif portnum == 'NODEINFO_APP':
+        user = decoded.get('user', {})
+        node = nodes.setdefault(fromId, {'num': packet.get('from')})
+        node['user'] = user
+        upsert_node(fromId, packet.get('from'), user.get('shortName'), user.get('longName'), user.get('hwModel'), last_heard)
+
+    elif portnum == 'TRACEROUTE_APP':
+        route = decoded.get('traceroute', {})
+        snr_towards = route.get('snrTowards', [])
+        hops = []
+        for i, num in enumerate(route.get('route', [])):
+            # SNR in RouteDiscovery is scaled by 4
+            hops.append({'nodeId': protowire.node_id(num), 'snr': snr_towards[i] / 4 if i < len(snr_towards) else None})
+        store_traceroute(fromId, toId, hops, timestamp)
+
+    elif portnum == 'ROUTING_APP':
+        store_routing(fromId, toId, str(decoded.get('routes', [])), timestamp)
+
+    elif portnum == 'NEIGHBORINFO_APP':
+        neighbor_info = decoded.get('neighborinfo', {})
+        node_id = neighbor_info.get('nodeId')
+        for neighbor in neighbor_info.get('neighbors', []):
+            store_neighbors(node_id, neighbor.get('nodeId'), neighbor.get('snr'), timestamp)
+
+
+def handle_from_radio(buf, nodes, timestamp=None):
+    """Decode one FromRadio frame and store whatever it carries. Returns the decoded message."""
+    message = protowire.decode_from_radio(buf)
+    node_info = message.get('nodeInfo')
+    if node_info and 'user' in node_info:
+        nodes[node_info['user'].get('id')] = node_info
+    if 'configCompleteId' in message:
+        # The radio has finished dumping its NodeDB
+        sync_nodedb(nodes)
+    packet = message.get('packet')
+    if packet is not None:
+        timestamp = timestamp or int(time_module.time())
+        if STORE_RAW_PACKETS:
+            portnum = protowire.PORTNUM_VALUES.get(packet.get('decoded', {}).get('portnum'))
+            store_raw_packet(packet.get('from'), portnum, packet.get('rxTime') or timestamp, bytes(message['packetBytes']))
+        store_packet(packet, nodes, timestamp)
+    return message
+
+
+def capture(readinto, write, record_path=None):
+    """Read frames from a live radio and store them until interrupted."""
+    record_file = open(record_path, 'ab') if record_path else None
+    if record_file:
+        readinto = recording(readinto, record_file)
+    nodes = {}
+    # Wake the radio up and ask for the NodeDB followed by the packet stream
+    write(bytes([START2]) * 32)
+    time_module.sleep(0.1)
+    write(want_config_frame(random.randint(1, 0xFFFFFFFF)))
+    last_heartbeat = time_module.time()
+    framer = StreamFramer(readinto)
+    try:
+        for buf in framer.frames():
+            if buf is not None:
+                try:
+                    handle_from_radio(buf, nodes)
+                except Exception as e:
+                    logger.error(f"Error handling frame: {e}")
+            if time_module.time() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                write(heartbeat_frame())
+                last_heartbeat = time_module.time()
+    finally:
+        if record_file:
+            record_file.close()
+    logger.info(f"Stream closed after {framer.frames_read} frames ({framer.bytes_skipped} bytes of log output skipped).")
+
+
+def replay(path):
+    """Store every packet from a capture file, dated by its rxTime."""
+    nodes = {}
+    with open(path, 'rb') as f:
+        framer = StreamFramer(f.readinto)
+        for buf in framer.frames():
+            if buf is None:
+                continue
+            try:
+                handle_from_radio(buf, nodes, timestamp=_rx_time(buf))
+            except Exception as e:
+                logger.error(f"Error handling frame: {e}")
+    # Positions and metrics came in with the packets and the NodeDB dump; only bring the nodes up to date
+    sync_nodedb(nodes, bootstrap=False)
+    logger.info(f"Replayed {framer.frames_read} frames from {path}.")
+
+
+def _rx_time(buf):
+    """rxTime of the MeshPacket in a FromRadio frame without decoding the rest."""
+    for field_number, _, value in protowire.iter_fields(buf):
+        if field_number == 2:
+            for packet_field, _, packet_value in protowire.iter_fields(value):
+                if packet_field == 7:
+                    return int.from_bytes(packet_value, 'little')
+    return None
+
+
+def _decode_with_meshtastic(buf):
+    """Roughly what the meshtastic library does per frame before pubsub delivers it to on_receive."""
+    from meshtastic import protocols
+    from meshtastic.protobuf import mesh_pb2
+    from google.protobuf.json_format import MessageToDict
+
+    from_radio = mesh_pb2.FromRadio()
+    from_radio.ParseFromString(bytes(buf))
+    as_dict = MessageToDict(from_radio)
+    if from_radio.HasField('packet'):
+        packet = MessageToDict(from_radio.packet)
+        if from_radio.packet.HasField('decoded'):
+            handler = protocols.get(from_radio.packet.decoded.portnum)
+            if handler is not None and handler.protobufFactory is not None:
+                payload = handler.protobufFactory()
+                payload.ParseFromString(from_radio.packet.decoded.payload)
+                packet['decoded'][handler.name] = MessageToDict(payload)
+        as_dict['packet'] = packet
+    return as_dict
+
+
+def benchmark(path, rounds=5):
+    """Compare decode throughput of the framer/protowire path and the meshtastic library path on a capture file."""
+    with open(path, 'rb') as f:
+        data = f.read()
+    frames = []
+    framer = StreamFramer(_reader(data))
+    for buf in framer.frames():
+        if buf is not None:
+            frames.append(bytes(buf))
+    if not frames:
+        print(f"No frames found in {path}.")
+        return
+
+    def run(decode):
+        best = None
+        for _ in range(rounds):
+            start = time_module.perf_counter()
+            for buf in frames:
+                decode(buf)
+            elapsed = time_module.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return len(frames) / best
+
+    start = time_module.perf_counter()
+    for buf in StreamFramer(_reader(data)).frames():
+        if buf is not None:
+            protowire.decode_from_radio(buf)
+    framed_rate = len(frames) / (time_module.perf_counter() - start)
+
+    print(f"{len(frames)} frames in {path} ({len(data)} bytes)")
+    print(f"framer + protowire:         {framed_rate:,.0f} frames/s")
+    fast_rate = run(protowire.decode_from_radio)
+    print(f"protowire decode only:      {fast_rate:,.0f} frames/s")
+    try:
+        slow_rate = run(_decode_with_meshtastic)
+    except ImportError:
+        print("meshtastic is not installed, skipping the library comparison.")
+        return
+    print(f"meshtastic + MessageToDict: {slow_rate:,.0f} frames/s ({fast_rate / slow_rate:.1f}x slower)")
+
+
+def _reader(data):
+    """readinto over an in-memory capture."""
+    source = memoryview(data)
+    pos = [0]
+
+    def readinto(view):
+        n = min(len(view), len(source) - pos[0])
+        view[:n] = source[pos[0]:pos[0] + n]
+        pos[0] += n
+        return n
+    return readinto
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Capture Meshtastic packets to messages.db without the meshtastic library.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('--port', help="Serial port of the radio, e.g. /dev/ttyUSB0")
+    source.add_argument('--host', help="Hostname or IP of a network-enabled radio")
+    source.add_argument('--replay', metavar='FILE', help="Store packets from a capture file")
+    source.add_argument('--benchmark', metavar='FILE', help="Benchmark decoding of a capture file")
+    parser.add_argument('--record', metavar='FILE', help="Also append the raw stream to a capture file")
+    parser.add_argument('--raw', action='store_true', help="Also store every packet's protobuf in raw_packets")
+    args = parser.parse_args()
+
+    global STORE_RAW_PACKETS
+    STORE_RAW_PACKETS = args.raw
+
+    if args.benchmark:
+        benchmark(args.benchmark)
+        return
+
+    initialize_db()
+    if args.replay:
+        replay(args.replay)
+        return
+
+    readinto, write, close = open_serial(args.port) if args.port else open_tcp(args.host)
+    print("Capturing packets... Press Ctrl+C to stop.")
+    try:
+        capture(readinto, write, args.record)
+    except KeyboardInterrupt:
+        print("Stopping capture...")
+    finally:
+        close()
+
+
+if __name__ == "__main__":
+    main()
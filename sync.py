@@ -0,0 +1,209 @@
+#!/usr/bin/env python3
+"""Merge gateway databases into a central messages.db, copying only what is new.
+
+For every source and table the central database remembers the last id
+and timestamp it copied (sync_state), so a run reads only the rows added
+since the previous one. Rows are copied with INSERT ... SELECT from the
+attached source in id batches, each batch and its high-water mark
+committed together, so an interrupted run resumes where it stopped.
+
+The same packet is usually stored by several gateways. A row is skipped
+when the central table already has a row with the same key columns
+within DEDUPE_WINDOW seconds (messages use their UNIQUE message_id).
+Nodes are reconciled instead: the entry with the latest last_heard wins.
+
+If a source's ids go backwards (the gateway started a new database) its
+rows are selected by the timestamp high-water mark instead.
+
+    python3 sync.py /mnt/gw-north/messages.db /mnt/gw-south/messages.db --db central.db
+"""
+import argparse
+import logging
+import os
+import time as time_module
+
+from pragmas import connect
+from dictionary import COMPACT_COLUMNS, storage_table, table_definition
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 50000
+# Rows of the same record stored by two gateways are at most this far apart (seconds)
+DEDUPE_WINDOW = 120
+# table -> columns identifying the same record across gateways (None: rely on a UNIQUE constraint)
+SYNCED_TABLES = {
+    'messages': None,
+    'telemetry': ('node_id', 'uptime_seconds', 'battery_level', 'voltage'),
+    'environment': ('node_id', 'temperature', 'humidity', 'bar'),
+    'positions': ('node_id', 'latitude', 'longitude', 'time'),
+    'neighbors': ('node_id', 'neighbor_node_id', 'snr'),
+    'traceroute': ('from_node', 'to_node', 'hop_id', 'hop_node'),
+    'routing': ('from_node', 'to_node', 'routes'),
+    'events': ('node_id', 'kind', 'metric', 'value'),
+}
+
+
+def initialize_sync(c):
+    c.execute('''CREATE TABLE IF NOT EXISTS sync_state (
+                    source TEXT,
+                    table_name TEXT,
+                    last_id INTEGER,
+                    last_timestamp INTEGER,
+                    synced_at INTEGER,
+                    PRIMARY KEY (source, table_name)
+                )''')
+
+
+def _columns(c, schema, table):
+    c.execute(f'PRAGMA {schema}.table_info({table})')
+    return [row[1] for row in c.fetchall()]
+
+
+def _ensure_table(c, table):
+    """Create table in the central database from the source's definition if it is missing."""
+    if _columns(c, 'main', table):
+        return True
+    c.execute("SELECT sql FROM src.sqlite_master WHERE type = 'table' AND name = ?", (table,))
+    row = c.fetchone()
+    if row is not None:
+        c.execute(row[0])
+        return True
+    # A compacted source (see dictionary.py) has a view there: create the plain table it shows
+    c.execute(f'PRAGMA src.table_info({table})')
+    info = c.fetchall()
+    if not info:
+        return False
+    c.execute(table_definition(f'main.{table}', info))
+    return True
+
+
+def _save_state(conn, c, source, table, last_id, last_timestamp):
+    c.execute('''INSERT INTO sync_state (source, table_name, last_id, last_timestamp, synced_at) VALUES (?, ?, ?, ?, ?)
+                 ON CONFLICT(source, table_name) DO UPDATE SET
+                 last_id = excluded.last_id, last_timestamp = excluded.last_timestamp, synced_at = excluded.synced_at''',
+              (source, table, last_id, last_timestamp, int(time_module.time())))
+    conn.commit()
+
+
+def _probe(table, column, storage):
+    """s.column as stored in main.storage: its dictionary id when the central table is compacted.
+
+    Probing the rows by code keeps the duplicate check an index lookup; through the view it is a scan.
+    """
+    if storage == table or column not in COMPACT_COLUMNS[table]:
+        return f's.{column}'
+    # 0 is no dictionary id: a string the central database has not seen matches no row
+    return (f"COALESCE((SELECT id FROM main.dictionary WHERE value = s.{column} AND kind = '{COMPACT_COLUMNS[table][column]}'), "
+            f"CASE WHEN s.{column} IS NOT NULL THEN 0 END)")
+
+
+def _sync_table(conn, c, source, table, key, batch_size):
+    if not _ensure_table(c, table):
+        return 0
+    storage = storage_table(c, table)
+    if key:
+        # Index for the duplicate probe (telemetry, positions and events already have it)
+        c.execute(f'CREATE INDEX IF NOT EXISTS idx_{table}_{key[0]}_timestamp ON {storage}({key[0]}, timestamp)')
+    central = _columns(c, 'main', table)
+    columns = [column for column in _columns(c, 'src', table) if column in central and column != 'id']
+    c.execute('SELECT last_id, last_timestamp FROM sync_state WHERE source = ? AND table_name = ?', (source, table))
+    last_id, last_timestamp = c.fetchone() or (0, 0)
+    # ORDER BY id LIMIT 1 rather than MIN()/MAX(), which scan the view of a compacted table
+    c.execute(f'SELECT id FROM src.{table} ORDER BY id DESC LIMIT 1')
+    newest = (c.fetchone() or (0,))[0]
+    if newest < last_id:
+        logger.warning(f"{source}: {table} ids went back from {last_id} to {newest}, resuming from timestamp {last_timestamp}")
+        c.execute(f'SELECT id FROM src.{table} WHERE timestamp > ? ORDER BY id LIMIT 1', (last_timestamp,))
+        resume = (c.fetchone() or (None,))[0]
+        last_id = resume - 1 if resume is not None else newest
+        _save_state(conn, c, source, table, last_id, last_timestamp)
+
+    select = ', '.join(f's.{column}' for column in columns)
+    query = f'''INSERT OR IGNORE INTO main.{table} ({', '.join(columns)})
+                SELECT {select} FROM src.{table} s WHERE s.id > ? AND s.id <= ?'''
+    if key:
+        match = ' AND '.join(f'm.{column} IS {_probe(table, column, storage)}' for column in key)
+        query += f''' AND NOT EXISTS (SELECT 1 FROM main.{storage} m WHERE {match}
+                                      AND m.timestamp BETWEEN s.timestamp - {DEDUPE_WINDOW} AND s.timestamp + {DEDUPE_WINDOW})'''
+    query += ' ORDER BY s.id'
+
+    copied = 0
+    while last_id < newest:
+        upper = min(last_id + batch_size, newest)
+        if storage == table:
+            c.execute(query, (last_id, upper))
+            copied += c.rowcount
+        else:
+            # Rows inserted through the view's trigger are not in rowcount; count the new ids instead
+            c.execute(f'SELECT id FROM main.{storage} ORDER BY id DESC LIMIT 1')
+            before = (c.fetchone() or (0,))[0]
+            c.execute(query, (last_id, upper))
+            c.execute(f'SELECT COUNT(*) FROM main.{storage} WHERE id > ?', (before,))
+            copied += c.fetchone()[0]
+        c.execute(f'SELECT MAX(timestamp) FROM src.{table} WHERE id > ? AND id <= ?', (last_id, upper))
+        last_timestamp = max(last_timestamp or 0, c.fetchone()[0] or 0)
+        last_id = upper
+        _save_state(conn, c, source, table, last_id, last_timestamp)
+    return copied
+
+
+def _sync_nodes(conn, c):
+    """Upsert the source's nodes; an existing entry is only replaced by one heard more recently."""
+    if not _ensure_table(c, 'nodes'):
+        return 0
+    central = _columns(c, 'main', 'nodes')
+    columns = [column for column in _columns(c, 'src', 'nodes') if column in central]
+    if 'user_id' not in columns:
+        return 0
+    updates = ', '.join(f'{column} = excluded.{column}' for column in columns if column != 'user_id')
+    c.execute(f'''INSERT INTO main.nodes ({', '.join(columns)})
+                  SELECT {', '.join(columns)} FROM src.nodes WHERE user_id IS NOT NULL
+                  ON CONFLICT(user_id) DO UPDATE SET {updates}
+                  WHERE COALESCE(excluded.last_heard, 0) > COALESCE(nodes.last_heard, 0)''')
+    changed = c.rowcount
+    conn.commit()
+    return changed
+
+
+def sync_source(source_path, name=None, tables=SYNCED_TABLES, batch_size=BATCH_SIZE, database_path='messages.db'):
+    """Copy new rows of source_path into database_path; returns {table: rows copied (nodes: upserted)}.
+
+    name identifies the source in sync_state (default: its absolute path),
+    so it must stay the same from run to run.
+    """
+    name = name or os.path.abspath(source_path)
+    conn = connect(database_path, uri=True)
+    c = conn.cursor()
+    initialize_sync(c)
+    conn.commit()
+    c.execute('ATTACH DATABASE ? AS src', (f'file:{source_path}?mode=ro',))
+    counts = {}
+    try:
+        counts['nodes'] = _sync_nodes(conn, c)
+        for table in tables:
+            if _columns(c, 'src', table):
+                counts[table] = _sync_table(conn, c, name, table, SYNCED_TABLES.get(table), batch_size)
+    finally:
+        conn.commit()
+        c.execute('DETACH DATABASE src')
+        conn.close()
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Copy new rows from gateway databases into a central one.")
+    parser.add_argument('sources', nargs='+', help="Gateway messages.db files")
+    parser.add_argument('--db', default='messages.db', help="Central database")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    for source in args.sources:
+        start = time_module.perf_counter()
+        counts = sync_source(source, batch_size=args.batch_size, database_path=args.db)
+        summary = ', '.join(f"{table} {rows}" for table, rows in counts.items() if rows)
+        print(f"{source}: {summary or 'nothing new'} ({time_module.perf_counter() - start:.1f} s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,178 @@
-import sqlite3
+#!/usr/bin/env python3
+"""Telemetry statistics and charts, for one node or the whole mesh.
+
+    python3 telemetry.py '!a1b2c3d4'                   # statistics and charts for one node
+    python3 telemetry.py --all --output-dir report      # stats.csv plus one PNG per node
+    python3 telemetry.py --nodes '!a1b2c3d4' '!0badc0de' --output-dir report --since 2024-08-01
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import pandas as pd
-import matplotlib.pyplot as plt
-
-# Connect to the SQLite database
-conn = sqlite3.connect('messages.db')
-
-# Query to fetch telemetry data for a specific node
-node_id = ''  # Replace with the desired node ID
-query = f"SELECT * FROM telemetry WHERE node_id = '{node_id}'"
-
-# Load the data into a DataFrame
-df = pd.read_sql_query(query, conn)
-
-# Close the database connection
-conn.close()
-
-# Convert timestamp to datetime and adjust to CEST timezone
-df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True)
-df['timestamp'] = df['timestamp'].dt.tz_convert('Europe/Berlin')
-
-# Display basic statistics
-stats = df.describe()
-
-print("Basic Statistics for Node:", node_id)
-print(stats)
-
-# Plotting battery level over time
-plt.figure(figsize=(10, 6))
-plt.plot(df['timestamp'], df['battery_level'], marker='o', linestyle='-', color='b')
-plt.title('Battery Level Over Time (CEST)')
-plt.xlabel('Timestamp (CEST)')
-plt.ylabel('Battery Level (%)')
-plt.grid(True)
-plt.xticks(rotation=45)  # Rotate timestamps for better readability
-plt.show()
-
-# Plotting voltage over time
-plt.figure(figsize=(10, 6))
-plt.plot(df['timestamp'], df['voltage'], marker='o', linestyle='-', color='g')
-plt.title('Voltage Over Time (CEST)')
-plt.xlabel('Timestamp (CEST)')
-plt.ylabel('Voltage (V)')
-plt.grid(True)
-plt.xticks(rotation=45)
-plt.show()
-
-# Plotting channel utilization over time
-plt.figure(figsize=(10, 6))
-plt.plot(df['timestamp'], df['channel_utilization'], marker='o', linestyle='-', color='orange')
-plt.title('Channel Utilization Over Time (CEST)')
-plt.xlabel('Timestamp (CEST)')
-plt.ylabel('Channel Utilization')
-plt.grid(True)
-plt.xticks(rotation=45)
-plt.show()
-
-# Plotting air utilization (TX) over time
-plt.figure(figsize=(10, 6))
-plt.plot(df['timestamp'], df['air_util_tx'], marker='o', linestyle='-', color='r')
-plt.title('Air Utilization (TX) Over Time (CEST)')
-plt.xlabel('Timestamp (CEST)')
-plt.ylabel('Air Utilization (TX)')
-plt.grid(True)
-plt.xticks(rotation=45)
-plt.show()
-
-# You can add more plots for other metrics as needed.
 
+from pragmas import connect
+
+TIMEZONE = 'Europe/Berlin'
+# (column, title, y label, color) of each chart
+PLOTS = [
+    ('battery_level', 'Battery Level', 'Battery Level (%)', 'b'),
+    ('voltage', 'Voltage', 'Voltage (V)', 'g'),
+    ('channel_utilization', 'Channel Utilization', 'Channel Utilization', 'orange'),
+    ('air_util_tx', 'Air Utilization (TX)', 'Air Utilization (TX)', 'r'),
+]
+COLUMNS = [column for column, _, _, _ in PLOTS]
+CHUNK_SIZE = 100000
+
+
+def build_query(node_ids=None, since=None, until=None):
+    """Parameterized telemetry query for the given nodes (all when None) and time range."""
+    query = f"SELECT node_id, timestamp, {', '.join(COLUMNS)} FROM telemetry WHERE 1 = 1"
+    params = []
+    if node_ids:
+        query += f" AND node_id IN ({', '.join('?' * len(node_ids))})"
+        params.extend(node_ids)
+    if since is not None:
+        query += ' AND timestamp >= ?'
+        params.append(since)
+    if until is not None:
+        query += ' AND timestamp < ?'
+        params.append(until)
+    return query, params
+
+
+def load_node(node_id, since=None, until=None, database_path='messages.db'):
+    """Telemetry of one node ordered by time, with timestamps converted to TIMEZONE."""
+    query, params = build_query([node_id], since, until)
+    conn = connect(database_path)
+    df = pd.read_sql_query(query + ' ORDER BY timestamp', conn, params=params)
+    conn.close()
+    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='s', utc=True).dt.tz_convert(TIMEZONE)
+    return df
+
+
+def node_statistics(node_ids=None, since=None, until=None, chunksize=CHUNK_SIZE, database_path='messages.db'):
+    """Per-node count, mean, std, min and max of every metric, streamed over the table in chunks.
+
+    Each chunk is reduced with one groupby to partial sums, so memory stays
+    bounded by the chunk size however long the history is.
+    """
+    query, params = build_query(node_ids, since, until)
+    conn = connect(database_path)
+    partials = []
+    for chunk in pd.read_sql_query(query, conn, params=params, chunksize=chunksize):
+        values = chunk[COLUMNS].astype('float64')
+        grouped = values.groupby(chunk['node_id'])
+        partial = grouped.agg(['count', 'sum', 'min', 'max'])
+        squares = (values ** 2).groupby(chunk['node_id']).sum()
+        for column in COLUMNS:
+            partial[(column, 'sq')] = squares[column]
+        timestamps = chunk['timestamp'].groupby(chunk['node_id'])
+        partial[('timestamp', 'first')] = timestamps.min()
+        partial[('timestamp', 'last')] = timestamps.max()
+        partials.append(partial)
+    conn.close()
+    if not partials:
+        return pd.DataFrame()
+
+    combined = pd.concat(partials).groupby(level=0)
+    how = {key: ('min' if key[1] in ('min', 'first') else 'max' if key[1] in ('max', 'last') else 'sum')
+           for key in partials[0].columns}
+    totals = combined.agg(how)
+
+    stats = pd.DataFrame(index=totals.index)
+    stats['records'] = totals[[(column, 'count') for column in COLUMNS]].max(axis=1).astype(int)
+    stats['first_seen'] = pd.to_datetime(totals[('timestamp', 'first')], unit='s', utc=True).dt.tz_convert(TIMEZONE)
+    stats['last_seen'] = pd.to_datetime(totals[('timestamp', 'last')], unit='s', utc=True).dt.tz_convert(TIMEZONE)
+    for column in COLUMNS:
+        count = totals[(column, 'count')].where(totals[(column, 'count')] > 0)
+        mean = totals[(column, 'sum')] / count
+        variance = (totals[(column, 'sq')] - count * mean ** 2) / (count - 1)
+        stats[f'{column}_mean'] = mean
+        stats[f'{column}_std'] = variance.clip(lower=0) ** 0.5
+        stats[f'{column}_min'] = totals[(column, 'min')]
+        stats[f'{column}_max'] = totals[(column, 'max')]
+    stats.index.name = 'node_id'
+    return stats
+
+
+def plot_node(plt, df, node_id):
+    """One figure with a chart per metric."""
+    fig, axes = plt.subplots(len(PLOTS), 1, figsize=(10, 3 * len(PLOTS)), sharex=True)
+    for ax, (column, title, ylabel, color) in zip(axes, PLOTS):
+        ax.plot(df['timestamp'], df[column], marker='o', linestyle='-', color=color)
+        ax.set_title(f'{title} Over Time (CEST)')
+        ax.set_ylabel(ylabel)
+        ax.grid(True)
+    axes[-1].set_xlabel('Timestamp (CEST)')
+    axes[-1].tick_params(axis='x', labelrotation=45)
+    fig.suptitle(f'Telemetry for {node_id}')
+    fig.tight_layout()
+    return fig
+
+
+def _use_agg():
+    import matplotlib
+    matplotlib.use('Agg')
+
+
+def render_node(node_id, output_dir, since=None, until=None, database_path='messages.db'):
+    """Write output_dir/<node>.png; runs in a worker process with the Agg backend."""
+    import matplotlib.pyplot as plt
+    df = load_node(node_id, since, until, database_path)
+    if df.empty:
+        return None
+    fig = plot_node(plt, df, node_id)
+    path = os.path.join(output_dir, f"{node_id.lstrip('!')}.png")
+    fig.savefig(path, dpi=100)
+    plt.close(fig)
+    return path
+
+
+def batch_report(node_ids=None, output_dir='report', since=None, until=None, workers=None, database_path='messages.db'):
+    """Write stats.csv and one chart per node to output_dir; returns the statistics DataFrame."""
+    os.makedirs(output_dir, exist_ok=True)
+    stats = node_statistics(node_ids, since, until, database_path=database_path)
+    stats.to_csv(os.path.join(output_dir, 'stats.csv'))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_use_agg) as pool:
+        futures = [pool.submit(render_node, node_id, output_dir, since, until, database_path) for node_id in stats.index]
+        for future in futures:
+            future.result()
+    return stats
+
+
+def _timestamp(value):
+    return int(pd.Timestamp(value, tz=TIMEZONE).timestamp()) if value else None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Telemetry statistics and charts from messages.db.")
+    parser.add_argument('node_id', nargs='?', help="Show statistics and charts for one node")
+    parser.add_argument('--all', action='store_true', help="Report on every node")
+    parser.add_argument('--nodes', nargs='+', help="Report on these nodes")
+    parser.add_argument('--output-dir', default='report', help="Where the batch report is written")
+    parser.add_argument('--since', help="Start date/time (local time)")
+    parser.add_argument('--until', help="End date/time (local time)")
+    parser.add_argument('--workers', type=int, help="Chart rendering processes (default: CPU count)")
+    parser.add_argument('--db', default='messages.db', help="Database path")
+    args = parser.parse_args()
+    since = _timestamp(args.since)
+    until = _timestamp(args.until)
+
+    if args.all or args.nodes:
+        stats = batch_report(args.nodes, args.output_dir, since, until, args.workers, args.db)
+        print(f"Wrote statistics and charts for {len(stats)} nodes to {args.output_dir}")
+        return
+    if not args.node_id:
+        parser.error("give a node_id, --nodes or --all")
+
+    df = load_node(args.node_id, since, until, args.db)
+    print("Basic Statistics for Node:", args.node_id)
+    print(df.describe())
+    import matplotlib.pyplot as plt
+    plot_node(plt, df, args.node_id)
+    plt.show()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Compacted tables keep their ids, counters and readers; the encode cache never keeps a rolled back code."""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import meshdb
+import pragmas
+from dictionary import Dictionary, compact_table, storage_table
+from federation import connect_federated
+from sync import sync_source
+
+ROWS = [('!0000abcd', 90, 4.1, 1.5, 0.2, 100, 1000),
+        ('!0000abcd', 89, 4.0, 1.6, 0.2, 200, 1100),
+        ('!0000beef', 50, 3.7, 9.0, 1.0, 300, 1200)]
+
+
+class DictionaryTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        meshdb.change_feed = None
+        meshdb.codes = Dictionary()
+
+    def tearDown(self):
+        held = pragmas._held.pop('messages.db', None)
+        if held is not None:
+            held.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def _plain_db(self):
+        """messages.db as an existing database has it before `dictionary.py compact`, with rows in telemetry."""
+        conn = sqlite3.connect('messages.db')
+        # Not a new database, so initialize_db leaves the tables plain
+        conn.execute('CREATE TABLE existing (id INTEGER)')
+        conn.commit()
+        meshdb.initialize_db()
+        conn.executemany(f'INSERT INTO telemetry ({", ".join(meshdb.TELEMETRY_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)', ROWS)
+        # A deleted last row leaves the sequence ahead of the largest id
+        conn.execute('DELETE FROM telemetry WHERE id = 3')
+        conn.commit()
+        return conn
+
+    def _compact(self, conn):
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        self.assertTrue(compact_table(c, 'telemetry'))
+        conn.commit()
+
+    def _counter(self, conn):
+        return conn.execute("SELECT row_count FROM table_counts WHERE name = 'telemetry'").fetchone()[0]
+
+    def test_compact_keeps_ids_sequence_and_counter(self):
+        conn = self._plain_db()
+        rows = conn.execute('SELECT * FROM telemetry ORDER BY id').fetchall()
+        self.assertEqual(self._counter(conn), 2)
+
+        self._compact(conn)
+        self.assertEqual(storage_table(conn.cursor(), 'telemetry'), 'telemetry_data')
+        self.assertEqual(conn.execute('SELECT * FROM telemetry ORDER BY id').fetchall(), rows)
+        self.assertEqual(conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'telemetry_data'").fetchone()[0], 3)
+        self.assertEqual(self._counter(conn), 2)
+
+        # New rows continue the sequence, and the counter triggers moved along to telemetry_data
+        conn.execute(f'INSERT INTO telemetry ({", ".join(meshdb.TELEMETRY_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)', ROWS[2])
+        conn.commit()
+        self.assertEqual(conn.execute('SELECT id FROM telemetry ORDER BY id DESC LIMIT 1').fetchone()[0], 4)
+        self.assertEqual(self._counter(conn), 3)
+        conn.execute('DELETE FROM telemetry WHERE id = 1')
+        conn.commit()
+        self.assertEqual(self._counter(conn), 2)
+        conn.close()
+
+    def test_view_writes_match_direct_inserts(self):
+        conn = self._plain_db()
+        self._compact(conn)
+        c = conn.cursor()
+        c.execute(f'INSERT INTO telemetry ({", ".join(meshdb.TELEMETRY_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)', ROWS[2])
+        conn.commit()
+        through_view = c.execute('SELECT id FROM telemetry ORDER BY id DESC LIMIT 1').fetchone()[0]
+        direct = meshdb.codes.insert(c, 'telemetry', meshdb.TELEMETRY_COLUMNS, [ROWS[2]])
+        conn.commit()
+
+        stored = 'SELECT node_id, battery_level, voltage, channel_utilization, air_util_tx, uptime_seconds, timestamp FROM {} WHERE id = ?'
+        self.assertEqual(c.execute(stored.format('telemetry_data'), (through_view,)).fetchone(),
+                         c.execute(stored.format('telemetry_data'), (direct,)).fetchone())
+        self.assertEqual(c.execute(stored.format('telemetry'), (direct,)).fetchone(), ROWS[2])
+
+        c.execute('DELETE FROM telemetry WHERE id IN (?, ?)', (through_view, direct))
+        conn.commit()
+        self.assertEqual(c.execute('SELECT COUNT(*) FROM telemetry_data WHERE id IN (?, ?)',
+                                   (through_view, direct)).fetchone()[0], 0)
+        conn.close()
+
+    def test_rolled_back_code_is_not_cached(self):
+        conn = self._plain_db()
+        self._compact(conn)
+        c = conn.cursor()
+        row = ('!0000f00d',) + ROWS[0][1:]
+        meshdb.codes.insert(c, 'telemetry', meshdb.TELEMETRY_COLUMNS, [row])
+        conn.rollback()
+        # The next insert starts a transaction and confirms the codes of earlier ones: this one was rolled back
+        meshdb.codes.insert(c, 'telemetry', meshdb.TELEMETRY_COLUMNS, [ROWS[0]])
+        conn.commit()
+        self.assertNotIn(('node', '!0000f00d'), meshdb.codes.codes)
+
+        row_id = meshdb.codes.insert(c, 'telemetry', meshdb.TELEMETRY_COLUMNS, [row])
+        conn.commit()
+        meshdb.codes.insert(c, 'telemetry', meshdb.TELEMETRY_COLUMNS, [ROWS[0]])
+        conn.commit()
+        code = c.execute("SELECT id FROM dictionary WHERE value = '!0000f00d' AND kind = 'node'").fetchone()[0]
+        self.assertEqual(meshdb.codes.codes[('node', '!0000f00d')], code)
+        self.assertEqual(c.execute('SELECT node_id FROM telemetry WHERE id = ?', (row_id,)).fetchone()[0], '!0000f00d')
+        conn.close()
+
+    def test_sync_and_federation_read_a_compacted_source(self):
+        # A new database is compacted by initialize_db
+        meshdb.initialize_db()
+        conn = sqlite3.connect('messages.db')
+        self.assertEqual(storage_table(conn.cursor(), 'positions'), 'positions_data')
+        conn.executemany(f'INSERT INTO telemetry ({", ".join(meshdb.TELEMETRY_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)', ROWS)
+        conn.execute(f'INSERT INTO positions ({", ".join(meshdb.POSITION_COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                     ('!0000abcd', 50.0, 14.0, 200, 990, 7, 1000))
+        conn.execute('''INSERT INTO nodes (user_id, node_number, short_name, long_name, hw_model, last_heard)
+                        VALUES ('!0000abcd', 43981, 'AB', 'Alpha Bravo', 'HELTEC_V3', 1000)''')
+        conn.commit()
+        conn.close()
+
+        counts = sync_source('messages.db', name='gw', database_path='central.db')
+        self.assertEqual((counts['telemetry'], counts['positions'], counts['nodes']), (3, 1, 1))
+        self.assertEqual(sync_source('messages.db', name='gw', database_path='central.db')['telemetry'], 0)
+        central = sqlite3.connect('central.db')
+        self.assertEqual(central.execute(f'SELECT {", ".join(meshdb.TELEMETRY_COLUMNS)} FROM telemetry ORDER BY id').fetchall(),
+                         ROWS)
+        central.close()
+
+        federated = connect_federated(['messages.db', 'central.db'])
+        self.assertEqual(federated.execute('SELECT COUNT(*) FROM telemetry').fetchone()[0], 6)
+        # The same fix from both databases is one position
+        self.assertEqual(federated.execute('SELECT node_id, latitude FROM positions').fetchall(), [('!0000abcd', 50.0)])
+        self.assertEqual(federated.execute('SELECT node_id FROM latest_positions').fetchall(), [('!0000abcd',)])
+        self.assertEqual(federated.execute('SELECT long_name FROM nodes').fetchall(), [('Alpha Bravo',)])
+        federated.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
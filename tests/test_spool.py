@@ -0,0 +1,92 @@
+"""A spooled write that hits a locked database must still arrive once the lock is gone."""
+import os
+import shutil
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import meshdb
+import pragmas
+from anomaly import AnomalyDetector, TELEMETRY_RULES, ENVIRONMENT_RULES
+from deadband import DeadbandFilter, TELEMETRY_TOLERANCES, ENVIRONMENT_TOLERANCES
+from dictionary import Dictionary
+from spool import Spool
+from tracks import PositionFilter
+
+
+class LockedDatabaseTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.busy_timeout = pragmas.BUSY_TIMEOUT
+        pragmas.BUSY_TIMEOUT = 0.2
+        meshdb.telemetry_filter = DeadbandFilter(TELEMETRY_TOLERANCES)
+        meshdb.environment_filter = DeadbandFilter(ENVIRONMENT_TOLERANCES)
+        meshdb.position_filter = PositionFilter()
+        meshdb.telemetry_detector = AnomalyDetector(TELEMETRY_RULES)
+        meshdb.environment_detector = AnomalyDetector(ENVIRONMENT_RULES, counter=None)
+        meshdb.change_feed = None
+        meshdb.codes = Dictionary()
+        meshdb.initialize_db()
+
+    def tearDown(self):
+        held = pragmas._held.pop('messages.db', None)
+        if held is not None:
+            held.close()
+        pragmas.BUSY_TIMEOUT = self.busy_timeout
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def _count(self, table):
+        conn = sqlite3.connect('messages.db')
+        count = conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0]
+        conn.close()
+        return count
+
+    def test_rows_arrive_after_unlock(self):
+        spool = Spool({store.__name__: store for store in (meshdb.write_telemetry, meshdb.write_environment,
+                                                           meshdb.write_position, meshdb.store_events)}, 'spool')
+        # What get-reply.py's on_receive does: filter once, spool the writes
+        if meshdb.filter_position('!0000abcd', 50.0, 14.0, 1000):
+            spool.put('write_position', '!0000abcd', 50.0, 14.0, 200, 1000, 7, 1000)
+        events, samples = meshdb.filter_telemetry('!0000abcd', 90, 4.1, 1.5, 0.2, 100, 1000)
+        spool.put('write_telemetry', '!0000abcd', samples)
+        events, samples = meshdb.filter_environment('!0000abcd', 21.5, 40.0, 1013.0, None, 1000)
+        spool.put('write_environment', '!0000abcd', samples)
+
+        lock = sqlite3.connect('messages.db')
+        lock.execute('BEGIN EXCLUSIVE')
+        spool.drain()
+        self.assertTrue(spool.blocked)
+        self.assertEqual(spool.depth, 3)
+        lock.rollback()
+        lock.close()
+
+        spool.drain()
+        spool.close()
+        self.assertFalse(spool.blocked)
+        self.assertEqual(spool.depth, 0)
+        for table in ('positions', 'telemetry', 'environment'):
+            self.assertEqual(self._count(table), 1, table)
+
+    def test_put_does_not_raise_when_spool_and_database_fail(self):
+        spool = Spool({'write_position': meshdb.write_position}, 'spool')
+        spool.file.close()
+        lock = sqlite3.connect('messages.db')
+        lock.execute('BEGIN EXCLUSIVE')
+        try:
+            # Writing to the closed spool file fails, and so does the direct write to the locked database
+            spool.put('write_position', '!0000abcd', 50.0, 14.0, 200, 1000, 7, 1000)
+        finally:
+            lock.rollback()
+            lock.close()
+        self.assertEqual(spool.stats['dropped'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
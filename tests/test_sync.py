@@ -0,0 +1,73 @@
+"""sync_nodedb adds only snapshot rows newer than the stored ones and publishes what was stored."""
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import meshdb
+import pragmas
+from deadband import DeadbandFilter, TELEMETRY_TOLERANCES
+from dictionary import Dictionary
+from tracks import PositionFilter
+
+
+class SyncNodeDBTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        self.publish_changes = meshdb.publish_changes
+        self.published = []
+        meshdb.publish_changes = lambda table, op, rows: self.published.append((table, op, rows))
+        meshdb.telemetry_filter = DeadbandFilter(TELEMETRY_TOLERANCES)
+        meshdb.position_filter = PositionFilter()
+        meshdb.codes = Dictionary()
+        meshdb.initialize_db()
+
+    def tearDown(self):
+        meshdb.publish_changes = self.publish_changes
+        held = pragmas._held.pop('messages.db', None)
+        if held is not None:
+            held.close()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def _sync(self, last_heard, bootstrap=True):
+        self.published = []
+        meshdb.sync_nodedb({'!0000abcd': {'num': 43981, 'lastHeard': last_heard,
+                                          'user': {'id': '!0000abcd', 'shortName': 'AB'},
+                                          'position': {'latitude': 50.0, 'longitude': 14.0},
+                                          'deviceMetrics': {'voltage': 4.1}}}, bootstrap)
+        return {table: rows for table, op, rows in self.published}
+
+    def test_only_newer_rows_are_added(self):
+        first = self._sync(1000)
+        self.assertEqual([row['timestamp'] for row in first['positions']], [1000])
+        self.assertEqual(len(first['telemetry']), 1)
+
+        older = self._sync(900)
+        self.assertEqual(older['positions'], [])
+        self.assertEqual(older['telemetry'], [])
+        self.assertEqual(older['nodes'][0]['last_heard'], 1000)
+
+        newer = self._sync(1100)
+        self.assertEqual([(row['id'], row['node_id']) for row in newer['positions']], [(2, '!0000abcd')])
+        self.assertEqual(newer['nodes'][0]['last_heard'], 1100)
+
+    def test_resync_only_upserts_nodes(self):
+        self._sync(1000)
+        # A stationary node: the position filter keeps its later reports out
+        for timestamp in (2000, 3000, 4000):
+            meshdb.store_position('!0000abcd', 50.0, 14.0, None, None, None, timestamp)
+        resync = self._sync(5000, bootstrap=False)
+        self.assertEqual(resync['positions'], [])
+        self.assertEqual(resync['telemetry'], [])
+        self.assertEqual(resync['nodes'][0]['last_heard'], 5000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,236 @@
+"""In-memory mesh topology graph built from NEIGHBORINFO_APP and traceroute data.
+
+Edges carry a time-decayed average SNR: older observations fade with
+half_life, so a link that got worse recently shows it quickly. The graph is
+updated one observation at a time and query results are cached:
+
+- structural queries (components, articulation nodes, hop counts, k-hop
+  reachability) are only recomputed after an edge is added or expires;
+- most-reliable-path results are also recomputed when a link's SNR inside
+  the same component moved enough to change its cost.
+
+refresh() reads only the neighbors/traceroute rows added since the last call.
+"""
+import math
+import time as time_module
+
+import networkx as nx
+
+from pragmas import connect
+
+# Observations lose half their weight after this long (seconds)
+DEFAULT_HALF_LIFE = 6 * 60 * 60
+# Links not heard for this long are dropped (seconds)
+DEFAULT_MAX_AGE = 7 * 24 * 60 * 60
+# SNR at which a LoRa link is assumed to deliver half of the packets, and how steep the curve is (dB)
+SNR_MIDPOINT = -10.0
+SNR_SCALE = 3.0
+# Cost changes smaller than this do not invalidate cached paths
+COST_EPSILON = 0.05
+
+
+def node_num(node):
+    """Node number from '!a1b2c3d4', a decimal string or an int."""
+    if node is None:
+        return None
+    if isinstance(node, int):
+        return node
+    node = str(node)
+    if node.startswith('!'):
+        return int(node[1:], 16)
+    return int(node)
+
+
+def node_id(num):
+    return f'!{num:08x}'
+
+
+def link_reliability(snr):
+    """Rough packet delivery probability of a link with this SNR."""
+    return 1.0 / (1.0 + math.exp(-(snr - SNR_MIDPOINT) / SNR_SCALE))
+
+
+def link_cost(snr):
+    """-log(reliability), so the cheapest path is the most reliable one."""
+    return -math.log(max(link_reliability(snr), 1e-9))
+
+
+class TopologyGraph:
+    """Undirected graph of node numbers with SNR-weighted, time-decayed edges and cached queries.
+
+    Not thread-safe: queries write the cache, so threads sharing one graph
+    must serialize refresh() and queries (webmap.py's query_topology does).
+    """
+
+    def __init__(self, half_life=DEFAULT_HALF_LIFE, max_age=DEFAULT_MAX_AGE):
+        self.half_life = half_life
+        self.max_age = max_age
+        self.graph = nx.Graph()
+        self.structure_version = 0
+        self._component_of = None          # node -> component index, rebuilt after structural changes
+        self._component_versions = {}      # component index -> version bumped on cost changes
+        self._cache = {}
+        self.last_neighbor_id = 0
+        self.last_traceroute_id = 0
+
+    # Updates
+
+    def observe_link(self, a, b, snr, timestamp):
+        """Record that a and b heard each other with the given SNR."""
+        a = node_num(a)
+        b = node_num(b)
+        if a is None or b is None or a == b:
+            return
+        edge = self.graph.get_edge_data(a, b)
+        if edge is None:
+            snr = snr if snr is not None else SNR_MIDPOINT
+            self.graph.add_edge(a, b, snr=snr, weight_sum=1.0, last_seen=timestamp, count=1, cost=link_cost(snr))
+            self._structure_changed()
+            return
+
+        edge['count'] += 1
+        if snr is not None:
+            decay = 2 ** (-max(timestamp - edge['last_seen'], 0) / self.half_life)
+            previous = edge['weight_sum'] * decay
+            edge['snr'] = (edge['snr'] * previous + snr) / (previous + 1.0)
+            edge['weight_sum'] = previous + 1.0
+            cost = link_cost(edge['snr'])
+            if abs(cost - edge['cost']) > COST_EPSILON:
+                edge['cost'] = cost
+                self._cost_changed(a)
+        edge['last_seen'] = max(edge['last_seen'], timestamp)
+
+    def observe_neighborinfo(self, node, neighbors, timestamp):
+        """Feed one NEIGHBORINFO_APP report: neighbors is a list of (neighbor, snr)."""
+        for neighbor, snr in neighbors:
+            self.observe_link(node, neighbor, snr, timestamp)
+
+    def observe_route(self, route, snrs, timestamp):
+        """Feed one traceroute: consecutive nodes in route are linked, snrs[i] belongs to the hop into route[i + 1]."""
+        for i in range(len(route) - 1):
+            snr = snrs[i] if i < len(snrs) else None
+            self.observe_link(route[i], route[i + 1], snr, timestamp)
+
+    def expire(self, now=None):
+        """Drop links not heard for max_age seconds."""
+        now = now if now is not None else time_module.time()
+        stale = [(a, b) for a, b, last_seen in self.graph.edges(data='last_seen') if now - last_seen > self.max_age]
+        if stale:
+            self.graph.remove_edges_from(stale)
+            self.graph.remove_nodes_from([n for n in list(self.graph.nodes) if self.graph.degree(n) == 0])
+            self._structure_changed()
+        return len(stale)
+
+    def _structure_changed(self):
+        self.structure_version += 1
+        self._component_of = None
+        self._component_versions = {}
+        self._cache.clear()
+
+    def _component(self, node):
+        if self._component_of is None:
+            self._component_of = {}
+            for index, members in enumerate(nx.connected_components(self.graph)):
+                for member in members:
+                    self._component_of[member] = index
+        return self._component_of.get(node)
+
+    def _cost_changed(self, node):
+        component = self._component(node)
+        self._component_versions[component] = self._component_versions.get(component, 0) + 1
+
+    # Loading
+
+    def refresh(self, database_path='messages.db', now=None):
+        """Apply neighbors and traceroute rows stored since the last refresh, then expire old links."""
+        conn = connect(database_path)
+        c = conn.cursor()
+        c.execute('''SELECT id, node_id, neighbor_node_id, snr, timestamp FROM neighbors
+                     WHERE id > ? ORDER BY id''', (self.last_neighbor_id,))
+        for row_id, node, neighbor, snr, timestamp in c.fetchall():
+            try:
+                self.observe_link(node, neighbor, snr, timestamp)
+            except ValueError:
+                pass
+            self.last_neighbor_id = row_id
+
+        c.execute('''SELECT id, from_node, to_node, hop_node, hop_snr, timestamp FROM traceroute
+                     WHERE id > ? ORDER BY id''', (self.last_traceroute_id,))
+        routes = {}
+        for row_id, from_node, to_node, hop_node, hop_snr, timestamp in c.fetchall():
+            routes.setdefault((from_node, to_node, timestamp), []).append((hop_node, hop_snr))
+            self.last_traceroute_id = row_id
+        conn.close()
+
+        for (from_node, to_node, timestamp), hops in routes.items():
+            try:
+                # Traceroute replies come from the destination; the hops are listed from the requester (to_node) on
+                route = [to_node] + [hop for hop, _ in hops] + [from_node]
+                self.observe_route(route, [snr for _, snr in hops], timestamp)
+            except ValueError:
+                pass
+        self.expire(now)
+
+    # Queries
+
+    def _cached(self, key, version, compute):
+        entry = self._cache.get(key)
+        if entry is not None and entry[0] == version:
+            return entry[1]
+        result = compute()
+        self._cache[key] = (version, result)
+        return result
+
+    def shortest_path(self, a, b):
+        """Fewest-hops path between two nodes as a list of node numbers, or None."""
+        a = node_num(a)
+        b = node_num(b)
+
+        def compute():
+            try:
+                return nx.shortest_path(self.graph, a, b)
+            except (nx.NetworkXNoPath, nx.NodeNotFound):
+                return None
+        return self._cached(('shortest', a, b), self.structure_version, compute)
+
+    def most_reliable_path(self, a, b):
+        """(path, delivery probability) maximizing the product of link reliabilities, or (None, 0.0)."""
+        a = node_num(a)
+        b = node_num(b)
+        component = self._component(a)
+        version = (self.structure_version, self._component_versions.get(component, 0))
+
+        def compute():
+            try:
+                cost, path = nx.single_source_dijkstra(self.graph, a, b, weight='cost')
+            except (nx.NetworkXNoPath, nx.NodeNotFound):
+                return None, 0.0
+            return path, math.exp(-cost)
+        return self._cached(('reliable', a, b), version, compute)
+
+    def articulation_nodes(self):
+        """Nodes whose loss would split the mesh."""
+        return self._cached(('articulation',), self.structure_version,
+                            lambda: sorted(nx.articulation_points(self.graph)))
+
+    def components(self):
+        """Connected components, largest first, as sorted lists of node numbers."""
+        return self._cached(('components',), self.structure_version,
+                            lambda: sorted((sorted(c) for c in nx.connected_components(self.graph)), key=len, reverse=True))
+
+    def k_hop(self, node, k):
+        """Nodes reachable from node within k hops (excluding node itself)."""
+        node = node_num(node)
+
+        def compute():
+            if node not in self.graph:
+                return []
+            reachable = nx.single_source_shortest_path_length(self.graph, node, cutoff=k)
+            return sorted(n for n in reachable if n != node)
+        return self._cached(('k_hop', node, k), self.structure_version, compute)
+
+    def edges(self):
+        """All links as dicts, for drawing or JSON."""
+        return [{'a': node_id(a), 'b': node_id(b), 'snr': round(data['snr'], 2), 'reliability': round(link_reliability(data['snr']), 3),
+                 'last_seen': data['last_seen'], 'count': data['count']}
+                for a, b, data in self.graph.edges(data=True)]
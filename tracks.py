@@ -0,0 +1,174 @@
+"""Stationary-position suppression at ingest and simplified movement tracks for the map.
+
+Fixed routers broadcast the same coordinates for months. PositionFilter only
+lets a position through when the node moved more than min_distance_m since
+the last stored row, or when heartbeat seconds have passed. get_track() and
+get_tracks() return Douglas-Peucker or Visvalingam simplified polylines.
+"""
+
+import numpy as np
+
+from geo import haversine_m, project_m
+from pragmas import connect
+
+# A node has to move this far before a new position row is written (meters)
+DEFAULT_MIN_DISTANCE_M = 50
+# ...or this much time has to pass (seconds)
+DEFAULT_HEARTBEAT = 6 * 60 * 60
+
+
+class PositionFilter:
+    """Per-node filter deciding whether a position report is worth a new row."""
+
+    def __init__(self, min_distance_m=DEFAULT_MIN_DISTANCE_M, heartbeat=DEFAULT_HEARTBEAT):
+        self.min_distance_m = min_distance_m
+        self.heartbeat = heartbeat
+        self._last = {}  # node_id -> (timestamp, latitude, longitude) of the last stored row
+        self.accepted = 0
+        self.suppressed = 0
+
+    def should_store(self, node_id, latitude, longitude, timestamp):
+        if latitude is None or longitude is None:
+            # Nothing to compare; keep the old behaviour and store it
+            return True
+        last = self._last.get(node_id)
+        if (last is None or timestamp - last[0] >= self.heartbeat
+                or haversine_m(last[1], last[2], latitude, longitude) > self.min_distance_m):
+            self._last[node_id] = (timestamp, latitude, longitude)
+            self.accepted += 1
+            return True
+        self.suppressed += 1
+        return False
+
+
+def douglas_peucker(x, y, tolerance):
+    """Indices of the points kept by Douglas-Peucker for planar coordinates in meters."""
+    n = len(x)
+    if n < 3:
+        return np.arange(n)
+    keep = np.zeros(n, dtype=bool)
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+        dx = x[end] - x[start]
+        dy = y[end] - y[start]
+        px = x[start + 1:end] - x[start]
+        py = y[start + 1:end] - y[start]
+        length = np.hypot(dx, dy)
+        if length == 0:
+            distances = np.hypot(px, py)
+        else:
+            distances = np.abs(dx * py - dy * px) / length
+        i = int(np.argmax(distances))
+        if distances[i] > tolerance:
+            split = start + 1 + i
+            keep[split] = True
+            stack.append((start, split))
+            stack.append((split, end))
+    return np.flatnonzero(keep)
+
+
+def visvalingam(x, y, tolerance):
+    """Indices of the points kept by Visvalingam-Whyatt with an effective-area threshold of tolerance**2.
+
+    Each pass removes, in one vectorized step, every point whose triangle is
+    below the threshold and no larger than its neighbours' triangles, never
+    two adjacent points at once.
+    """
+    index = np.arange(len(x))
+    threshold = tolerance ** 2
+    while len(index) > 2:
+        xs = x[index]
+        ys = y[index]
+        areas = np.abs((xs[:-2] - xs[2:]) * (ys[1:-1] - ys[:-2]) - (xs[:-2] - xs[1:-1]) * (ys[2:] - ys[:-2])) / 2
+        padded = np.concatenate(([np.inf], areas, [np.inf]))
+        candidates = (areas < threshold) & (areas <= padded[:-2]) & (areas <= padded[2:])
+        # In a run of equal minima (e.g. collinear points) drop every other one
+        position = np.arange(len(candidates))
+        run_start = np.maximum.accumulate(np.where(candidates & ~np.concatenate(([False], candidates[:-1])), position, 0))
+        drop = candidates & ((position - run_start) % 2 == 0)
+        if not drop.any():
+            break
+        index = np.concatenate((index[:1], index[1:-1][~drop], index[-1:]))
+    return index
+
+
+SIMPLIFIERS = {
+    'dp': douglas_peucker,
+    'vw': visvalingam,
+}
+
+
+def simplify(latitudes, longitudes, tolerance_m=25, method='dp'):
+    """Indices of the points to keep so the simplified line stays within roughly tolerance_m of the original."""
+    x, y = project_m(latitudes, longitudes)
+    return SIMPLIFIERS[method](x, y, tolerance_m)
+
+
+def get_track(node_id, start=None, end=None, tolerance_m=25, method='dp', database_path='messages.db'):
+    """Simplified [(latitude, longitude, timestamp), ...] track of one node between start and end."""
+    query = '''SELECT latitude, longitude, timestamp FROM positions
+               WHERE node_id = ? AND latitude IS NOT NULL AND longitude IS NOT NULL'''
+    params = [node_id]
+    if start is not None:
+        query += ' AND timestamp >= ?'
+        params.append(start)
+    if end is not None:
+        query += ' AND timestamp < ?'
+        params.append(end)
+    query += ' ORDER BY timestamp'
+    conn = connect(database_path)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    if not rows:
+        return []
+    data = np.array(rows, dtype=np.float64)
+    keep = simplify(data[:, 0], data[:, 1], tolerance_m, method)
+    return [(data[i, 0], data[i, 1], int(data[i, 2])) for i in keep]
+
+
+def get_tracks(start=None, end=None, tolerance_m=25, method='dp', min_distance_m=DEFAULT_MIN_DISTANCE_M,
+               database_path='messages.db'):
+    """Simplified tracks of every node that moved more than min_distance_m between start and end.
+
+    Returns {node_id: [(latitude, longitude), ...]}.
+    """
+    query = '''SELECT node_id, latitude, longitude FROM positions
+               WHERE latitude IS NOT NULL AND longitude IS NOT NULL'''
+    params = []
+    if start is not None:
+        query += ' AND timestamp >= ?'
+        params.append(start)
+    if end is not None:
+        query += ' AND timestamp < ?'
+        params.append(end)
+    query += ' ORDER BY node_id, timestamp'
+    conn = connect(database_path)
+    rows = conn.execute(query, params).fetchall()
+    conn.close()
+    if not rows:
+        return {}
+
+    node_ids = np.array([row[0] for row in rows], dtype=object)
+    coordinates = np.array([row[1:] for row in rows], dtype=np.float64)
+    # Rows are sorted by node, so each node is one contiguous slice
+    boundaries = np.flatnonzero(node_ids[1:] != node_ids[:-1]) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.concatenate((boundaries, [len(rows)]))
+
+    tracks = {}
+    for first, last in zip(starts, ends):
+        if last - first < 2:
+            continue
+        latitudes = coordinates[first:last, 0]
+        longitudes = coordinates[first:last, 1]
+        x, y = project_m(latitudes, longitudes)
+        # Skip nodes whose fixes all fit inside a min_distance_m box
+        if max(np.ptp(x), np.ptp(y)) <= min_distance_m:
+            continue
+        keep = SIMPLIFIERS[method](x, y, tolerance_m)
+        tracks[node_ids[first]] = [(latitudes[i], longitudes[i]) for i in keep]
+    return tracks
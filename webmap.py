@@ -1,27 +1,100 @@
 #!/usr/bin/env python3
-from flask import Flask, render_template_string, request
+from flask import Flask, render_template_string, request, jsonify
 import sqlite3
+import threading
+import time
 import folium
-from folium.plugins import MarkerCluster
+from folium.plugins import MarkerCluster, HeatMap
 from datetime import datetime, timedelta
+from tracks import get_tracks
+from topology import TopologyGraph, node_id
+from coverage import CoverageModel
+from battery import BatteryForecaster
+from presence import PresenceReader
+from search import search_messages
+from federation import connect_federated
+from pragmas import connect
+from spool import spool_status
 
 app = Flask(__name__)
 
-# Define the cutoff for "active" nodes (last 2 days)
-active_cutoff = datetime.now() - timedelta(days=2)
-# We will select only nodes that have been active in the last 2 days
-active_cutoff_unix = int(active_cutoff.timestamp())
+# Nodes heard within this window count as "active" (seconds, rolling from each request)
+ACTIVE_WINDOW = int(timedelta(days=2).total_seconds())
+
+# Render one regional map from several gateways' databases (see federation.py), e.g.
+# ['messages.db', '/mnt/gw-north/messages.db']. Empty: only the local messages.db.
+GATEWAY_DATABASES = []
+
+def connect_map_db():
+    """Connection for the map queries: the federated gateway views, or the local database."""
+    if GATEWAY_DATABASES:
+        return connect_federated(GATEWAY_DATABASES)
+    return connect('messages.db')
+
+# Live last heard / SNR / hops published by get-reply.py (see presence.py)
+presence = PresenceReader()
+
+# Mesh topology graph, fed incrementally from new neighbors/traceroute rows
+topology = TopologyGraph()
+topology_lock = threading.Lock()
+# Refresh the graph from the database at most this often (seconds)
+TOPOLOGY_REFRESH_INTERVAL = 30
+topology_refreshed = 0
+
+def query_topology(query):
+    """query(topology) run under topology_lock, after refreshing the graph if it is due.
+
+    Queries fill the graph's cache and a refresh changes the graph, so both
+    must hold the lock; Flask serves requests from several threads.
+    """
+    global topology_refreshed
+    with topology_lock:
+        if time.time() - topology_refreshed >= TOPOLOGY_REFRESH_INTERVAL:
+            topology.refresh()
+            topology_refreshed = time.time()
+        return query(topology)
+
+# Estimated coverage raster, only recomputed for nodes whose position or links changed
+coverage = CoverageModel()
+coverage_lock = threading.Lock()
+coverage_refreshed = 0
+
+def get_coverage_points():
+    global coverage_refreshed
+    with coverage_lock:
+        if time.time() - coverage_refreshed >= TOPOLOGY_REFRESH_INTERVAL:
+            coverage.refresh()
+            coverage_refreshed = time.time()
+        return coverage.heatmap_points()
+
+# Battery drain/charge trends, fed incrementally from new telemetry rows
+battery = BatteryForecaster()
+battery_lock = threading.Lock()
+battery_refreshed = 0
+
+def get_battery_forecast():
+    global battery_refreshed
+    with battery_lock:
+        if time.time() - battery_refreshed >= TOPOLOGY_REFRESH_INTERVAL:
+            battery.refresh()
+            battery_refreshed = time.time()
+        return battery.fleet()
 
 def convert_unix_to_str(unix_time):
     return datetime.fromtimestamp(unix_time).strftime('%d.%m.%Y %H:%M:%S') if unix_time else None
 
 def generate_map(user_id=None):
-    # Connect to the SQLite database
-    conn = sqlite3.connect('messages.db')
+    # We will select only nodes that have been active in the last 2 days
+    active_cutoff_unix = int(time.time()) - ACTIVE_WINDOW
+    # Prefer the ingest process' live last heard times over the nodes table when it is running
+    live_last_heard = {node_id(num): heard for num, heard in (presence.last_heard() or {}).items()}
+
+    # Connect to the SQLite database (or all gateways' databases)
+    conn = connect_map_db()
     cursor = conn.cursor()
 
     # Base query to fetch nodes and neighbors
-    query = f"""
+    query = """
     WITH LatestPositions AS (
         SELECT 
             p.node_id,
@@ -79,12 +152,14 @@ def generate_map(user_id=None):
             LatestPositions lp2 ON n2.user_id = lp2.node_id AND lp2.rn = 1
         WHERE
             lp1.latitude IS NOT NULL AND lp1.longitude IS NOT NULL AND
-            lp2.latitude IS NOT NULL AND lp2.longitude IS NOT NULL AND (n2.last_heard IS NULL OR n2.last_heard > {active_cutoff_unix})
+            lp2.latitude IS NOT NULL AND lp2.longitude IS NOT NULL AND (n2.last_heard IS NULL OR n2.last_heard > ?)
     """
+    params = [active_cutoff_unix]
 
     # Apply the filter if a user_id is provided
     if user_id:
-        query += f" AND n1.user_id = '{user_id}'"
+        query += " AND n1.user_id = ?"
+        params.append(user_id)
 
     query += """
         ORDER BY 
@@ -123,9 +198,10 @@ def generate_map(user_id=None):
 
     # Apply the filter if a user_id is provided
     if user_id:
-        query += f" AND n.user_id = '{user_id}'"
+        query += " AND n.user_id = ?"
+        params.append(user_id)
 
-    cursor.execute(query)
+    cursor.execute(query, params)
     results = cursor.fetchall()
 
     # Close the database connection
@@ -142,12 +218,14 @@ def generate_map(user_id=None):
         node_long_name = row[1]
         node_hw_model = row[2]
         node_short_name = row[3]
-        node_last_heard = convert_unix_to_str(row[4])
+        node_last_heard_unix = max(row[4] or 0, live_last_heard.get(node_user_id, 0)) or None
+        node_last_heard = convert_unix_to_str(node_last_heard_unix)
         neighbor_user_id = row[5]
         neighbor_long_name = row[6]
         neighbor_hw_model = row[7]
         neighbor_short_name = row[8]
-        neighbor_last_heard = convert_unix_to_str(row[9])
+        neighbor_last_heard_unix = max(row[9] or 0, live_last_heard.get(neighbor_user_id, 0)) or None
+        neighbor_last_heard = convert_unix_to_str(neighbor_last_heard_unix)
         node_latitude = row[10]
         node_longitude = row[11]
         neighbor_latitude = row[12]
@@ -157,19 +235,9 @@ def generate_map(user_id=None):
         max_snr = row[16]
         record_count = row[17]
 
-        # Handle cases where node_last_heard is None
-        if node_last_heard is not None:
-            node_last_heard_dt = datetime.strptime(node_last_heard, '%d.%m.%Y %H:%M:%S')
-            node_is_active = node_last_heard_dt > active_cutoff
-        else:
-            node_is_active = False
-
-        # Handle cases where neighbor_last_heard is None
-        if neighbor_last_heard is not None:
-            neighbor_last_heard_dt = datetime.strptime(neighbor_last_heard, '%d.%m.%Y %H:%M:%S')
-            neighbor_is_active = neighbor_last_heard_dt > active_cutoff
-        else:
-            neighbor_is_active = False
+        # Compare the raw unix times; never heard counts as inactive
+        node_is_active = node_last_heard_unix is not None and node_last_heard_unix > active_cutoff_unix
+        neighbor_is_active = neighbor_last_heard_unix is not None and neighbor_last_heard_unix > active_cutoff_unix
 
         if neighbor_long_name is None:
             # Handle nodes without neighbors
@@ -221,7 +289,7 @@ def generate_map(user_id=None):
                 'neighbor_long_name': neighbor_long_name,
                 'node_is_active': node_is_active,
                 'neighbor_is_active': neighbor_is_active,
-                'neighbor_last_heard': neighbor_last_heard_dt if neighbor_last_heard_dt else None
+                'neighbor_last_heard': neighbor_last_heard
             })
 
     # Count the total number of unique nodes
@@ -267,7 +335,7 @@ def generate_map(user_id=None):
                 line_style['dash_array'] = '5, 5'  # dashed line for inactive nodes
 
             # Directly use the already converted datetime string
-            neighbor_last_heard_str = connection['neighbor_last_heard'].strftime('%d.%m.%Y %H:%M:%S') if connection['neighbor_last_heard'] else 'N/A'
+            neighbor_last_heard_str = connection['neighbor_last_heard'] or 'N/A'
 
             line_popup = folium.Popup(
                 f"<b>Connection between:</b> {connection['node_long_name']} <b>and</b> {connection['neighbor_long_name']}<br>"
@@ -304,10 +372,30 @@ def generate_map(user_id=None):
                 icon=folium.Icon(color=color)
             ).add_to(no_neighbor_group)
 
+        # Draw simplified movement trails of nodes that moved while active
+        track_group = folium.FeatureGroup(name="Tracks", show=False)
+        for track_user_id, points in get_tracks(start=active_cutoff_unix).items():
+            if user_id and track_user_id != user_id:
+                continue
+            folium.PolyLine(
+                locations=[[latitude, longitude] for latitude, longitude in points],
+                color='purple',
+                weight=2,
+                popup=folium.Popup(f"<b>Track of:</b> {track_user_id}", max_width=300)
+            ).add_to(track_group)
+
+        # Estimated coverage from positions and neighbor SNR
+        coverage_group = folium.FeatureGroup(name="Coverage", show=False)
+        coverage_points = get_coverage_points()
+        if coverage_points:
+            HeatMap(coverage_points, radius=8, blur=6, min_opacity=0.2).add_to(coverage_group)
+
         # Add the groups to the map
         node_group.add_to(folium_map)
         connection_group.add_to(folium_map)
         no_neighbor_group.add_to(folium_map)
+        track_group.add_to(folium_map)
+        coverage_group.add_to(folium_map)
 
         # Add a timestamp and total node count at the top of the map as a custom HTML element
         timestamp = datetime.now().strftime('%d.%m.%Y %H:%M:%S')
@@ -395,5 +483,97 @@ def index():
     """, map_html=map_html)
 
 
+@app.route('/api/topology/path')
+def topology_path():
+    """Path between ?from= and ?to= (node ids or numbers); ?mode=reliable (default) or shortest."""
+    try:
+        source = request.args['from']
+        target = request.args['to']
+        if request.args.get('mode', 'reliable') == 'shortest':
+            path, reliability = query_topology(lambda graph: graph.shortest_path(source, target)), None
+        else:
+            path, reliability = query_topology(lambda graph: graph.most_reliable_path(source, target))
+    except (KeyError, ValueError):
+        return jsonify({'error': "Both 'from' and 'to' must be node ids like !a1b2c3d4"}), 400
+    return jsonify({'path': [node_id(n) for n in path] if path else None, 'reliability': reliability})
+
+@app.route('/api/topology/articulation')
+def topology_articulation():
+    """Nodes whose loss would split the mesh."""
+    return jsonify([node_id(n) for n in query_topology(lambda graph: graph.articulation_nodes())])
+
+@app.route('/api/topology/components')
+def topology_components():
+    """Connected parts of the mesh, largest first."""
+    return jsonify([[node_id(n) for n in component] for component in query_topology(lambda graph: graph.components())])
+
+@app.route('/api/topology/reach')
+def topology_reach():
+    """Nodes within ?k= hops (default 2) of ?node=."""
+    try:
+        node = request.args['node']
+        k = int(request.args.get('k', 2))
+        nodes = query_topology(lambda graph: graph.k_hop(node, k))
+    except (KeyError, ValueError):
+        return jsonify({'error': "'node' must be a node id like !a1b2c3d4 and 'k' a number"}), 400
+    return jsonify([node_id(n) for n in nodes])
+
+@app.route('/api/topology/edges')
+def topology_edges():
+    """All current links with their decayed SNR."""
+    return jsonify(query_topology(lambda graph: graph.edges()))
+
+@app.route('/api/battery')
+def battery_forecast():
+    """Battery rates and time-to-empty of every node, soonest-empty first; ?limit= to cut the list."""
+    nodes = get_battery_forecast()
+    try:
+        limit = int(request.args['limit']) if 'limit' in request.args else None
+    except ValueError:
+        return jsonify({'error': "'limit' must be a number"}), 400
+    return jsonify(nodes[:limit])
+
+@app.route('/api/messages/search')
+def messages_search():
+    """Full-text message search: ?q= plus optional sender, recipient, channel, since, until, limit and before (cursor)."""
+    try:
+        channel = int(request.args['channel']) if 'channel' in request.args else None
+        since = int(request.args['since']) if 'since' in request.args else None
+        until = int(request.args['until']) if 'until' in request.args else None
+        limit = min(int(request.args.get('limit', 50)), 500)
+        before = int(request.args['before']) if 'before' in request.args else None
+        rows, following = search_messages(request.args['q'], request.args.get('sender'), request.args.get('recipient'),
+                                          channel, since, until, before, limit)
+    except (KeyError, ValueError, sqlite3.OperationalError):
+        return jsonify({'error': "'q' is required; channel, since, until, limit and before must be numbers"}), 400
+    return jsonify({'messages': rows, 'next': following})
+
+@app.route('/api/presence')
+def presence_online():
+    """Nodes heard in the last ?minutes= (default 15), most recent first."""
+    try:
+        seconds = float(request.args.get('minutes', 15)) * 60
+    except ValueError:
+        return jsonify({'error': "'minutes' must be a number"}), 400
+    online = presence.online(seconds)
+    if online is None:
+        # get-reply.py is not running here; fall back to the nodes table
+        conn = connect_map_db()
+        rows = conn.execute('SELECT node_number, last_heard FROM nodes WHERE last_heard >= ?',
+                            (time.time() - seconds,)).fetchall()
+        conn.close()
+        online = {int(number): {'last_heard': heard, 'last_snr': None, 'last_rssi': None, 'hops_away': None}
+                  for number, heard in rows if number}
+    nodes = [dict(node_id=node_id(number), **details) for number, details in online.items()]
+    return jsonify(sorted(nodes, key=lambda node: node['last_heard'], reverse=True))
+
+@app.route('/api/spool')
+def spool_depth():
+    """Records get-reply.py has received but not yet written to messages.db (see spool.py)."""
+    status = spool_status()
+    status['oldest_age'] = time.time() - status['oldest'] if status['oldest'] is not None else None
+    return jsonify(status)
+
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8000)